@@ -7,66 +7,101 @@ Created on Tue 11/08/2020
 @author: t.lawson
 
 Fill in 'ExpU' and 'k' fields in Results table.
+fill_expu_k() can be restricted to a set of Run_Ids (e.g. those just ingested).
+k is calculated once per distinct DoF and applied with set-based UPDATEs.
 """
 
 
-import sqlite3
+import db_connections
 import GTC as gtc
 
+from db_writer import select_runs
+import perf
 
-# Set up connection to database:
-db_path = input('Full Resistors.db path? (press "d" for default location) >')
-if db_path == 'd':
-    db_path = r'G:\My Drive\Resistors.db'  # Default location.
-db_connection = sqlite3.connect(db_path)
-curs = db_connection.cursor()
-
-# Populate ExpU, k (for all rows where they're both null):
-query = ("SELECT Run_Id, Meas_No, Parameter, Uncert, DoF FROM Results "
-         "WHERE ExpU IS NULL AND k IS NULL;")
-curs.execute(query)
-rows = curs.fetchall()
-print(f'Returning {len(rows)} rows with NULL Exp_U, k.')
-for row in rows:
-    runid = row[0]  # primary key 1
-    meas_no = row[1]  # primary key 2
-    param = row[2]  # primary key 3
-    u = row[3]
-    df = row[4]
-    if u is None:  # Can't do anything with no std uncert!
-        k = 'NULL'
-        exp_u = 'NULL'
-    else:
-        print(f'{row}\t,unc = {u}, df = {df}')
-        k = gtc.rp.k_factor(df)
-        exp_u = k*u
-    # print(f"{row}\t, exp_u = {exp_u}, k = {k}")
-    query = (f"UPDATE Results SET ExpU = {exp_u}, k = {k} WHERE Run_Id = '{runid}' AND Meas_no = {meas_no}"
-             f" AND Parameter = '{param}';")
-    curs.execute(query)
-
-# Populate k (for all rows where it's still null):
-query = "SELECT Run_Id, Meas_No, Parameter, Uncert, ExpU FROM Results WHERE k IS NULL;"
-curs.execute(query)
-rows = curs.fetchall()
-print(f'Returning {len(rows)} rows with NULL k.')
-for row in rows:
-    runid = row[0]  # primary key 1
-    meas_no = row[1]  # primary key 2
-    param = row[2]  # primary key 3
-    u = row[3]
-    if u is None:  # Can't do anything with no std uncert!
-        k = 'NULL'
+
+CHUNK_SIZE = 50000  # Results rowids per UPDATE statement.
+
+
+def rowid_chunks(db_connection, where, chunk_size=CHUNK_SIZE):
+    """
+    Split the Results rows matching where into rowid ranges, for chunked UPDATEs.
+    :return: generator of (first rowid, last rowid) pairs
+    """
+    lo, hi = db_connection.execute(f"SELECT MIN(rowid), MAX(rowid) FROM Results WHERE {where};").fetchone()
+    if lo is None:
+        return
+    for start in range(lo, hi + 1, chunk_size):
+        yield start, min(start + chunk_size - 1, hi)
+
+
+def update_in_chunks(db_connection, set_clause, where, label, chunk_size=CHUNK_SIZE):
+    """
+    UPDATE Results SET <set_clause> WHERE <where>, one rowid range at a time, with progress.
+    :return: No. of rows updated
+    """
+    n = 0
+    for lo, hi in rowid_chunks(db_connection, where, chunk_size):
+        with perf.timer('sql.update'):
+            curs = db_connection.execute(f"UPDATE Results SET {set_clause} WHERE rowid BETWEEN ? AND ? AND {where};",
+                                         (lo, hi))
+        n += curs.rowcount
+        print(f'\t{label}: {n} rows (to rowid {hi})')
+    return n
+
+
+def fill_expu_k(db_connection, run_ids=None, chunk_size=CHUNK_SIZE):
+    """
+    Populate NULL ExpU & k fields in the Results table.
+    k (95 % coverage) is calculated once for each distinct DoF, held in a temporary
+    table and applied with set-based UPDATEs (in chunks of rowids).
+    (Doesn't commit - that's up to the caller.)
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param run_ids: Only update these runs (default: all runs)
+    :param chunk_size: No. of Results rowids per UPDATE statement
+    """
+    if run_ids is None:
+        run_term = ''
     else:
-        exp_u = row[4]
-        print(f'{row}\t,ExpUnc = {exp_u}')
-        k = exp_u/u
-    # print(f'{row}\t, k = {k}')
-    query = f"UPDATE Results SET k = {k} WHERE Run_Id = '{runid}' AND Meas_No = {meas_no} AND Parameter = '{param}';"
-    curs.execute(query)
-
-# tidy up:
-db_connection.commit()  # Assign all updates to database.
-curs.close()
-if db_connection:
-    db_connection.close()
+        run_term = f"AND Run_Id IN ({select_runs(db_connection, run_ids)})"
+    if not db_connection.in_transaction:
+        db_connection.execute('BEGIN')
+
+    # Populate ExpU, k (for all rows where they're both null):
+    where = f"ExpU IS NULL AND k IS NULL AND Uncert IS NOT NULL AND DoF IS NOT NULL {run_term}"
+    dofs = [row[0] for row in db_connection.execute(f"SELECT DISTINCT DoF FROM Results WHERE {where};")]
+    print(f'Calculating k for {len(dofs)} distinct DoF values.')
+    db_connection.execute("CREATE TEMP TABLE IF NOT EXISTS K_Factors (DoF REAL PRIMARY KEY, k REAL);")
+    db_connection.execute("DELETE FROM temp.K_Factors;")
+    with perf.timer('gtc.k_factor'):
+        db_connection.executemany("INSERT INTO temp.K_Factors (DoF, k) VALUES (?,?);",
+                                  ((df, gtc.rp.k_factor(df)) for df in dofs))
+    k_term = "(SELECT k FROM temp.K_Factors WHERE K_Factors.DoF = Results.DoF)"
+    n = update_in_chunks(db_connection, f"ExpU = {k_term}*Uncert, k = {k_term}", where, 'ExpU, k', chunk_size)
+    perf.count('rows.expu_filled', n)
+    print(f'Filled ExpU, k in {n} rows.')
+    n_no_dof = db_connection.execute("SELECT COUNT(*) FROM Results WHERE ExpU IS NULL AND k IS NULL AND "
+                                     f"Uncert IS NOT NULL AND DoF IS NULL {run_term};").fetchone()[0]
+    if n_no_dof:
+        print(f'{n_no_dof} rows with NULL DoF left unchanged.')
+
+    # Populate k (for all rows where it's still null):
+    where = f"k IS NULL AND Uncert IS NOT NULL AND ExpU IS NOT NULL {run_term}"
+    n = update_in_chunks(db_connection, "k = CAST(ExpU AS REAL)/Uncert", where, 'k', chunk_size)
+    print(f'Filled k (from ExpU) in {n} rows.')
+
+
+if __name__ == '__main__':
+    perf.start('Add_ExpU_to_Results')
+
+    # Set up connection to database:
+    db_path = input('Full Resistors.db path? (press "d" for default location) >')
+    if db_path == 'd':
+        db_path = r'G:\My Drive\Resistors.db'  # Default location.
+    db_connection = db_connections.connect(db_connections.checkout(db_path))  # (Working copy if HR_WORKING_COPY=1.)
+
+    fill_expu_k(db_connection)
+
+    # tidy up:
+    db_connection.commit()  # Assign all updates to database.
+    if db_connection:
+        db_connections.close(db_connection, publish=True)  # (Publishes a working copy - see db_connections.py.)
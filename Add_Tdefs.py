@@ -9,7 +9,7 @@ Created on Wed 16/09/2020
 Add T_def to db.Res_Info table (one entry per resistor)
 """
 
-import sqlite3
+import db_connections
 import GTC as gtc
 
 
@@ -24,7 +24,7 @@ def ureal_to_str(un):
 db_path = input('Full Resistors.db path? (press "d" for default location) >')
 if db_path == 'd':
     db_path = r'G:\My Drive\Resistors.db'  # Default location.
-db_connection = sqlite3.connect(db_path)
+db_connection = db_connections.connect(db_path)
 curs = db_connection.cursor()
 
 q_get_R_lst = "SELECT DISTINCT R_Name FROM Res_Info;"
@@ -8,45 +8,75 @@ Created on Tue 29/09/2020
 
 Add date to 'Runs' table. Use the most recent date
 from 'Results'.Meas_Date for each Run_Id.
+add_dates() can be restricted to a set of Run_Ids (e.g. those just ingested).
+All runs' dates are set with one UPDATE (per chunk of runs), rather than a
+SELECT and an UPDATE per run.
 
 """
 
 
-import sqlite3
-
-
-# Set up connection to database:
-db_path = input('Full Resistors.db path? (press "d" for default location) >')
-if db_path == 'd':
-    db_path = r'G:\My Drive\Resistors.db'  # Default location.
-db_connection = sqlite3.connect(db_path)
-curs = db_connection.cursor()
-
-test = True
-Q_test_script = input('Test before running properly? (Y/N) >')
-if Q_test_script.startswith('N'):
-    test = False  # This is NOT a test!
-
-q_get_runs = ("SELECT Run_Id FROM Runs WHERE Run_Id "
-              "IN (SELECT Run_Id FROM Results);")  # Include analysed runs only.
-curs.execute(q_get_runs)
-rows = curs.fetchall()  # A list of 1-item tuples.
-print(f'Found {len(rows)} Runs.')
-for row in rows:
-    runid = row[0]
-    q_get_date = (f"SELECT Meas_Date FROM Results WHERE Run_Id='{runid}' "
-                  "ORDER by Meas_Date DESC LIMIT 1;")
-    curs.execute(q_get_date)
-    row = curs.fetchone()  # A 1-item tuple.
-    date = row[0]
-    print(f'{runid}\tDate={date}')
-    q_add_date = f"UPDATE Runs SET Meas_Date='{date}' WHERE Run_Id='{runid}';"
-    curs.execute(q_add_date)
-
-# tidy up:
-if test is False:
-    db_connection.commit()  # Assign all updates to database.
-
-curs.close()
-if db_connection:
-    db_connection.close()
+import db_connections
+
+from db_writer import select_runs
+import perf
+
+
+CHUNK_SIZE = 20000  # Runs rowids per UPDATE statement.
+
+
+def add_dates(db_connection, run_ids=None, chunk_size=CHUNK_SIZE):
+    """
+    Set Runs.Meas_Date to the most recent Results.Meas_Date of each run.
+    One set-based UPDATE per chunk of Runs rowids, with progress.
+    (Doesn't commit - that's up to the caller.)
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param run_ids: Only update these runs (default: all analysed runs)
+    :param chunk_size: No. of Runs rowids per UPDATE statement
+    """
+    if run_ids is None:
+        run_term = ''
+    else:
+        run_term = f"AND Run_Id IN ({select_runs(db_connection, run_ids)})"
+    where = f"Run_Id IN (SELECT Run_Id FROM Results) {run_term}"  # Include analysed runs only.
+    lo, hi = db_connection.execute(f"SELECT MIN(rowid), MAX(rowid) FROM Runs WHERE {where};").fetchone()
+    if lo is None:
+        print('Found 0 Runs.')
+        return
+    if not db_connection.in_transaction:
+        db_connection.execute('BEGIN')
+
+    q_add_date = ("UPDATE Runs SET Meas_Date = "
+                  "(SELECT MAX(Meas_Date) FROM Results WHERE Results.Run_Id = Runs.Run_Id) "
+                  f"WHERE rowid BETWEEN ? AND ? AND {where};")
+    n = 0
+    for start in range(lo, hi + 1, chunk_size):
+        stop = min(start + chunk_size - 1, hi)
+        with perf.timer('sql.update'):
+            n += db_connection.execute(q_add_date, (start, stop)).rowcount
+        print(f'\tMeas_Date: {n} Runs (to rowid {stop})')
+    perf.count('runs.dated', n)
+    print(f'Updated Meas_Date of {n} Runs.')
+
+
+if __name__ == '__main__':
+    perf.start('Add_date_to_Runs')
+
+    # Set up connection to database:
+    db_path = input('Full Resistors.db path? (press "d" for default location) >')
+    if db_path == 'd':
+        db_path = r'G:\My Drive\Resistors.db'  # Default location.
+    db_connection = db_connections.connect(db_connections.checkout(db_path))  # (Working copy if HR_WORKING_COPY=1.)
+
+    test = True
+    Q_test_script = input('Test before running properly? (Y/N) >')
+    if Q_test_script.startswith('N'):
+        test = False  # This is NOT a test!
+
+    add_dates(db_connection)
+
+    # tidy up:
+    if test is False:
+        db_connection.commit()  # Assign all updates to database.
+
+    if db_connection:
+        db_connections.close(db_connection, publish=not test)  # (Publishes a working copy - see db_connections.py.)
@@ -11,10 +11,20 @@ for all occurrences in table <tab>:
 Tables affected: Raw_Data(V1_time, Vd_time, V2_time),
                  Results(Meas_Date),
                  Res_Info(Value WHERE Parameter = 'Cal_Date').
+Conversion is done in SQL, in chunked transactions (see fix_dates()).
 """
 
 
-import sqlite3
+import db_connections
+import time
+
+
+CHUNK_SIZE = 50000  # Rows per transaction.
+
+# {table: (columns to convert, extra WHERE condition)}:
+DATE_COLUMNS = {'Raw_Data': (('V1_time', 'Vd_time', 'V2_time'), ''),
+                'Results': (('Meas_Date',), ''),
+                'Res_Info': (('Value',), "Parameter = 'Cal_Date'")}
 
 
 def convert(t_str):
@@ -27,67 +37,63 @@ def convert(t_str):
         return f"{yr}-{mon}-{day} {time}"
 
 
-# Set up connection to database:
-db_path = input('Full Resistors.db path? (press "d" for default location) >')
-if db_path == 'd':
-    db_path = r'G:\My Drive\Resistors.db'  # Default location.
-db_connection = sqlite3.connect(db_path)
-curs = db_connection.cursor()
-
-tab = input('Table? >')
-
-if tab == 'Raw_Data':
-    # Raw_data table...
-    q_raw_d = "SELECT Run_Id, Meas_No, Rev_No, V1_time, Vd_time, V2_time FROM Raw_Data;"
-    curs.execute(q_raw_d)
-    rows = curs.fetchall()
-    for row in rows:
-        runid = row[0]
-        meas_no = row[1]
-        rev_no = row[2]
-        V1t = row[3]
-        Vdt = row[4]
-        V2t = row[5]
-        V1t = convert(V1t)
-        Vdt = convert(Vdt)
-        V2t = convert(V2t)
-
-        q_raw_d2 = (f"UPDATE Raw_Data SET V1_time='{V1t}', Vd_time='{Vdt}', V2_time='{V2t}'"
-                    f" WHERE Run_Id='{runid}' AND Meas_No='{meas_no}' AND Rev_No='{rev_no}';")
-        curs.execute(q_raw_d2)
-
-if tab == 'Results':
-    # Results table...
-    q_res = "SELECT Run_Id, Meas_No, Parameter, Meas_Date FROM Results;"
-    curs.execute(q_res)
-    rows = curs.fetchall()
-    for row in rows:
-        runid = row[0]
-        meas_no = row[1]
-        param = row[2]
-        m_date = row[3]
-        m_date = convert(m_date)
-
-        q_res_d2 = (f"UPDATE Results SET Meas_Date='{m_date}'"
-                    f" WHERE Run_Id='{runid}' AND Meas_No='{meas_no}' AND Parameter='{param}';")
-        curs.execute(q_res_d2)
-
-if tab == 'Res_Info':
-    # Res_Info table...
-    q_res_info = "SELECT R_Name, Value FROM Res_Info WHERE Parameter = 'Cal_Date';"
-    curs.execute(q_res_info)
-    rows = curs.fetchall()
-    for row in rows:
-        name = row[0]
-        val = row[1]
-        val = convert(val)
-
-        q_res_info_d2 = (f"UPDATE Res_Info SET Value='{val}' WHERE "
-                         f"R_Name = '{name}' AND Parameter = 'Cal_Date';")
-        curs.execute(q_res_d2)
-
-# tidy up:
-db_connection.commit()  # Assign all updates to database.
-curs.close()
-if db_connection:
-    db_connection.close()
+def convert_date(t_str):
+    """SQL function convert_date(): convert() for 'DD/MM/YYYY hh:mm:ss' strings, other values unchanged."""
+    if not isinstance(t_str, str) or '/' not in t_str:
+        return t_str
+    return convert(t_str)
+
+
+def fix_dates(db_connection, tab, chunk_size=CHUNK_SIZE):
+    """
+    Convert all 'DD/MM/YYYY hh:mm:ss' dates in table tab (see DATE_COLUMNS) to 'YYYY-MM-DD hh:mm:ss'.
+    Rows are updated in SQL (via the registered function convert_date()), one chunk of
+    rowids per transaction, so progress is kept if interrupted - only rows with a '/'
+    in a date column are touched, so it's safe to run again.
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param tab: Table name
+    :param chunk_size: No. of rowids per transaction
+    :return: No. of rows updated
+    """
+    cols, condition = DATE_COLUMNS[tab]
+    db_connection.create_function('convert_date', 1, convert_date, deterministic=True)
+    where = '(' + ' OR '.join(f"{c} LIKE '%/%'" for c in cols) + ')'
+    if condition:
+        where += f' AND {condition}'
+    set_clause = ', '.join(f'{c} = convert_date({c})' for c in cols)
+
+    lo, hi = db_connection.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {tab} WHERE {where};").fetchone()
+    if lo is None:
+        print(f'No dates to convert in {tab}.')
+        return 0
+    n = 0
+    t_start = time.perf_counter()
+    for start in range(lo, hi + 1, chunk_size):
+        stop = min(start + chunk_size - 1, hi)
+        n += db_connection.execute(f"UPDATE {tab} SET {set_clause} WHERE rowid BETWEEN ? AND ? AND {where};",
+                                   (start, stop)).rowcount
+        db_connection.commit()
+        print(f'\t{tab}: {n} rows converted (to rowid {stop}, {time.perf_counter() - t_start:.1f} s)')
+    return n
+
+
+"""
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    # Set up connection to database:
+    db_path = input('Full Resistors.db path? (press "d" for default location) >')
+    if db_path == 'd':
+        db_path = r'G:\My Drive\Resistors.db'  # Default location.
+    db_connection = db_connections.connect(db_connections.checkout(db_path))  # (Working copy if HR_WORKING_COPY=1.)
+
+    tab = input('Table? >')
+    assert tab in DATE_COLUMNS, f'Error - Table must be one of {list(DATE_COLUMNS)}!'
+    n = fix_dates(db_connection, tab)
+    print(f'Converted dates in {n} {tab} rows.')
+
+    # tidy up:
+    if db_connection:
+        db_connections.close(db_connection, publish=True)  # (Publishes a working copy - see db_connections.py.)
@@ -8,16 +8,30 @@ Created on Thur 2/09/2021
 
 Interrogates database and returns resistor value and uncertainty,
 given resistor name and, temperature and test-voltage.
+
+Batch mode: values for many (resistor, T, V, date) rows are read from a CSV file
+and written to another, with each resistor's Res_Info loaded just once.
+Each resistor's rows are evaluated together (NumPy), using the covariance of its
+book-value parameters. By default each row is then evaluated with GTC, so its dof is
+exactly that of a single look-up. With exact=False the NumPy values and uncertainties
+(the same as GTC's - first-order propagation) are used as they are, with a
+Welch-Satterthwaite dof that ignores correlations between the parameters (so can
+differ from GTC's). That column is headed 'DoF_approx' rather than 'DoF'.
 """
 
-import sqlite3
+import csv
+import math
 import GTC as gtc
-import datetime as dt
 import time
 import sys
 
+import numpy as np
+
+import db_connections
+import hr_dates
+import perf
 
-T_FMT = '%Y-%m-%d %H:%M:%S'
+from Results_to_Res_Info import read_book_values
 
 
 """
@@ -30,15 +44,10 @@ def db_connect():
     db_path = input('Full Resistors.db path? (press "d" for default location) >')
     if db_path == 'd':
         db_path = r'G:\My Drive\Resistors.db'  # Default location.
-    db_connection = sqlite3.connect(db_path)
+    db_connection = db_connections.connect(db_path, read_only=True)
     return db_connection
 
 
-def str_to_ureal(j_str, name):
-    archive = gtc.pr.loads_json(j_str)
-    return archive.extract(name)
-
-
 def input_to_ureal(msg):
     """
     Request input from user and return it as a ureal.
@@ -62,72 +71,214 @@ def get_true_R_name(guess, curs):
     return curs.fetchone()[0]
 
 
+def str_to_ureal_args(u_str):
+    """
+    Convert a "val unc dof" string (as typed at the prompts) to a ureal, or a float if only a value is given.
+    """
+    arg_lst = [float(i) for i in u_str.split()]
+    assert len(arg_lst) > 0, 'No value given!'
+    if len(arg_lst) == 1:
+        return arg_lst[0]
+    return gtc.ureal(*arg_lst)
+
+
+def date_to_days(R_time):
+    """
+    Convert a date-time string ('yyyy-mm-dd HH:MM:SS', or 'n' for now) to days from epoch
+    (timezone-stable - see hr_dates.py).
+    """
+    if R_time == 'n':
+        return hr_dates.now_days()
+    return hr_dates.to_days(R_time)
+
+
+def todays_value(book, R_temp, R_V, t_days):
+    """
+    Resistor value at temperature R_temp, test-voltage R_V and time t_days.
+    :param book: dict of book-value ureals {Parameter: ureal}, from read_book_values()
+    :param R_temp: Temperature (ureal or float)
+    :param R_V: Test-voltage (ureal or float)
+    :param t_days: Time (days from epoch)
+    :return: ureal
+    """
+    R0 = book['R0']
+    alpha = book['alpha']
+    T0 = book['TRef']
+    gamma = book.get('gamma', 0)  # (No gamma record if it wasn't determined - assumed zero.)
+    V0 = book['VRef']
+    tau = book['tau']
+    t0 = book['Cal_Date']
+    return R0*(1 + alpha*(R_temp-T0) + gamma*(R_V-V0) + tau*(t_days-t0))
+
+
+BOOK_PARAMS = ('R0', 'alpha', 'TRef', 'gamma', 'VRef', 'tau', 'Cal_Date')
+
+# Batch CSV input columns (u_T, df_T, u_V, df_V optional; T and V may also be "val unc dof"):
+CSV_IN = ('R_name', 'T', 'u_T', 'df_T', 'V', 'u_V', 'df_V', 'Date')
+CSV_OUT = ('Value', 'Uncert', 'DoF')
+CSV_OUT_APPROX = ('Value', 'Uncert', 'DoF_approx')  # (exact=False.)
+
+
+def _split_ureal(row, name):
+    """(value, uncert, dof) of input column name (and optional u_/df_ columns) in a CSV row."""
+    args = [float(i) for i in row[name].split()]
+    assert len(args) > 0, f'No {name} value given!'
+    if row.get(f'u_{name}') not in (None, ''):
+        args[1:] = [float(row[f'u_{name}'])]
+        if row.get(f'df_{name}') not in (None, ''):
+            args.append(float(row[f'df_{name}']))
+    val = args[0]
+    unc = args[1] if len(args) > 1 else 0.0
+    df = args[2] if len(args) > 2 else math.inf
+    return val, unc, df
+
+
+def batch_values(book, T, u_T, df_T, V, u_V, df_V, t_days):
+    """
+    Vectorised todays_value() for one resistor and many (T, V, t) points.
+    T and V are treated as independent of each other and of the book values.
+    :param book: dict of book-value ureals {Parameter: ureal}, from read_book_values()
+    :param T, u_T, df_T: Arrays of temperature values, uncertainties and dof
+    :param V, u_V, df_V: Arrays of test-voltage values, uncertainties and dof
+    :param t_days: Array of times (days from epoch)
+    :return: (values, uncertainties, dofs) arrays - dof is a Welch-Satterthwaite approximation,
+        ignoring correlations between the book-value parameters
+    """
+    params = [book.get(p, 0) for p in BOOK_PARAMS]  # (gamma may be absent - assumed zero.)
+    x = np.array([gtc.value(p) for p in params])
+    u = np.array([gtc.uncertainty(p) for p in params])
+    df = np.array([gtc.dof(p) if u_k > 0 else math.inf for p, u_k in zip(params, u)])
+    n = len(params)
+    C = np.zeros((n, n))  # Covariance of book-value parameters.
+    for i in range(n):
+        for j in range(i, n):
+            if u[i] > 0 and u[j] > 0:
+                C[i, j] = C[j, i] = gtc.get_covariance(params[i], params[j]) if i != j else u[i]**2
+
+    R0, alpha, T0, gamma, V0, tau, t0 = x
+    dT = np.asarray(T, dtype=float) - T0
+    dV = np.asarray(V, dtype=float) - V0
+    dt_days = np.asarray(t_days, dtype=float) - t0
+    D = 1 + alpha*dT + gamma*dV + tau*dt_days
+    values = R0*D
+
+    # Sensitivities to (R0, alpha, TRef, gamma, VRef, tau, Cal_Date), one row per point:
+    ones = np.ones_like(D)
+    J = np.column_stack((D, R0*dT, -R0*alpha*ones, R0*dV, -R0*gamma*ones, R0*dt_days, -R0*tau*ones))
+    u_T_comp = R0*alpha*np.asarray(u_T, dtype=float)
+    u_V_comp = R0*gamma*np.asarray(u_V, dtype=float)
+    var = np.einsum('ij,jk,ik->i', J, C, J) + u_T_comp**2 + u_V_comp**2
+
+    # Welch-Satterthwaite, with each parameter (and T, V) as one component:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ws = np.sum((J*u)**4/df, axis=1) + u_T_comp**4/np.asarray(df_T, dtype=float) + \
+             u_V_comp**4/np.asarray(df_V, dtype=float)
+        dofs = np.where(ws > 0, var**2/ws, math.inf)
+    return values, np.sqrt(var), dofs
+
+
+def batch_predict(curs, rows, exact=True):
+    """
+    Resistor values for many rows, loading each resistor's Res_Info once.
+    :param curs: Database cursor
+    :param rows: Iterable of dicts with CSV_IN keys (u_T, df_T, u_V, df_V optional; Date 'n' = now)
+    :param exact: If True, evaluate each row with GTC (exact dof); if False, with batch_values()
+        (faster - but approximate dof)
+    :return: list of input dicts, each updated with CSV_OUT (or, if not exact, CSV_OUT_APPROX) keys,
+        in input order
+    """
+    out_keys = CSV_OUT if exact else CSV_OUT_APPROX
+    rows = [dict(r) for r in rows]
+    by_name = {}
+    for i, row in enumerate(rows):
+        by_name.setdefault(row['R_name'], []).append(i)
+
+    for R_name, idx in by_name.items():
+        with perf.timer('value.book'):
+            book = read_book_values(curs, R_name)
+        assert len(book) > 0, f'No resistor info available for {R_name}!'
+        t_start = time.perf_counter()
+        T = np.array([_split_ureal(rows[i], 'T') for i in idx]).reshape(-1, 3)
+        V = np.array([_split_ureal(rows[i], 'V') for i in idx]).reshape(-1, 3)
+        t_days = np.array([date_to_days(rows[i]['Date']) for i in idx])
+        if exact:
+            results = []
+            for (T_i, V_i, t_i) in zip(T, V, t_days):
+                R_temp = gtc.ureal(*T_i) if T_i[1] > 0 else T_i[0]
+                R_V = gtc.ureal(*V_i) if V_i[1] > 0 else V_i[0]
+                R = todays_value(book, R_temp, R_V, t_i)
+                results.append((R.x, R.u, R.df))
+            values, uncerts, dofs = zip(*results)
+        else:
+            values, uncerts, dofs = batch_values(book, T[:, 0], T[:, 1], T[:, 2], V[:, 0], V[:, 1], V[:, 2],
+                                                 t_days)
+        for i, val, unc, df in zip(idx, values, uncerts, dofs):
+            rows[i].update(zip(out_keys, (float(val), float(unc), float(df))))
+        perf.add_time('value.calc', time.perf_counter() - t_start)
+    perf.count('value.rows', len(rows))
+    return rows
+
+
+def batch_csv(curs, in_file, out_file, exact=True):
+    """
+    Batch mode: read (R_name, T, V, Date) rows from in_file and write them, with
+    Value, Uncert and DoF (or, if not exact, DoF_approx) columns added, to out_file.
+    :return: No. of rows processed
+    """
+    with open(in_file, newline='') as f:
+        reader = csv.DictReader(f)
+        fields = list(reader.fieldnames)
+        rows = batch_predict(curs, reader, exact)
+    with perf.timer('csv.write'), open(out_file, 'w', newline='') as f:
+        out_keys = CSV_OUT if exact else CSV_OUT_APPROX
+        writer = csv.DictWriter(f, fieldnames=fields + [c for c in out_keys if c not in fields])
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
+
+
 """
 ------------------------ Main Script --------------------------
 """
+if __name__ == '__main__':
+    perf.start('Get_Todays_Value')
+
+    # Set up connections to database. # and XL file...
+    db_connection = db_connect()
+    curs = db_connection.cursor()
+
+    in_file = input('Batch input CSV file? (press "Enter" for a single value) >')
+    if in_file != '':
+        out_file = input('Output CSV file? >')
+        fast = input('Fast mode (NumPy - approximate dof)? (y/n) >') in ('y', 'Y', 'yes', 'Yes')
+        t_start = time.perf_counter()
+        n = batch_csv(curs, in_file, out_file, exact=not fast)
+        print(f'Wrote {n} values to {out_file} in {time.perf_counter() - t_start:.2f} s.')
+        db_connection.close()
+        sys.exit()
+
+    R_name_guess = input('Resistor name? ')
+    R_name = get_true_R_name(R_name_guess, curs)
+    print(f'I assume you meant {R_name}!')
+
+    R_temp = input_to_ureal('Resistor temperature (in ureal format: "val unc dof")? ')
+    R_V = input_to_ureal('Resistor test-voltage (in ureal format: "val unc dof")? ')
+    R_time = input('Resistor calibration date ("yyyy-mm-dd HH:MM:SS" or "n" for now)? ')
+    t_days = date_to_days(R_time)
+
+    # All parameters for this resistor, as ureals (from its 'Book_Values' archive, if it has one):
+    try:
+        with perf.timer('value.book'):
+            book = read_book_values(curs, R_name)
+        assert len(book) > 0, 'No resistor info available!'
+    except AssertionError as msg:
+        print(msg)
+        sys.exit()
+
+    print(f"alpha = {book['alpha']}")
+    print(f"gamma = {book.get('gamma')}")
+    print(f"tau = {book['tau']}")
 
-# Set up connections to database. # and XL file...
-db_connection = db_connect()
-curs = db_connection.cursor()
-
-R_name_guess = input('Resistor name? ')
-R_name = get_true_R_name(R_name_guess, curs)
-print(f'I assume you meant {R_name}!')
-
-R_temp = input_to_ureal('Resistor temperature (in ureal format: "val unc dof")? ')
-R_V = input_to_ureal('Resistor test-voltage (in ureal format: "val unc dof")? ')
-R_time = input('Resistor calibration date ("yyyy-mm-dd HH:MM:SS" or "n" for now)? ')
-if R_time == 'n':
-    t_val_dt = dt.datetime.now()  # A datetime object
-else:
-    t_val_dt = dt.datetime.strptime(R_time, T_FMT)  # A datetime object.
-
-t_tup = dt.datetime.timetuple(t_val_dt,)  # A time-tuple object.
-t_s = time.mktime(t_tup)  # Time as float (seconds from epoch).
-t_days = t_s/86400  # Time as float (days from epoch).
-
-query = f"SELECT * FROM Res_Info WHERE R_Name LIKE '%{R_name}%';"
-curs.execute(query)
-
-try:
-    rows = curs.fetchall()
-    assert len(rows) > 0, 'No resistor info available!'
-except AssertionError as msg:
-    print(msg)
-    sys.exit()
-
-#  Compile data for this resistor into a dictionary.
-res_info = {}
-for row in rows:
-    parameter = row[1]
-    val = row[2]
-    unc = row[3]
-    df = row[4]
-    lbl = row[5]
-    u_str = row[7]
-    res_info.update(
-        {parameter: {'value': val,
-                     'uncert': unc,
-                     'dof': df,
-                     'label': lbl,
-                     'ureal_str': u_str
-                     }
-         }
-    )
-
-    # construct ureals and add to sub-dictionaries:
-    res_info[parameter].update({lbl: str_to_ureal(res_info[parameter]['ureal_str'], lbl)})
-
-R0 = res_info['R0'][f'{R_name}_R0']
-alpha = res_info['alpha'][f'{R_name}_alpha']
-print(f'alpha = {alpha}')
-T0 = res_info['TRef'][f'{R_name}_TRef']
-gamma = res_info['gamma'][f'{R_name}_gamma']
-print(f'gamma = {gamma}')
-V0 = res_info['VRef'][f'{R_name}_VRef']
-tau = res_info['tau'][f'{R_name}_tau']
-print(f'tau = {tau}')
-t0 = res_info['Cal_Date'][f'{R_name}_t0']
-
-R = R0*(1 + alpha*(R_temp-T0) + gamma*(R_V-V0) + tau*(t_days-t0))
-print(f'R-value :\n\t{R.x} +/- {R.u}, df = {R.df}')
+    with perf.timer('value.calc'):
+        R = todays_value(book, R_temp, R_V, t_days)
+    print(f'R-value :\n\t{R.x} +/- {R.u}, df = {R.df}')
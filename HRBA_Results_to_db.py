@@ -11,8 +11,14 @@ and transfer information to Resistors.db >Results and >Uncert_Contribs tables.
 Also updates PRE-EXISTING RECORDS in >Runs table to include meas_date and analysis note.
 """
 
+import collections
 import pylightxl as xl
-import sqlite3
+import db_connections
+
+from db_writer import BatchWriter
+from ingest_manifest import Manifest
+import perf
+from Results_to_Drift_History import refresh_drift_history
 
 
 """
@@ -43,150 +49,179 @@ def convert_date_fmt(t_str):
 
 """
 ---------------------------------------
-Set up connections to database and XL file...
+            Sheet parser:
+parse_results() steps through the rows of the 'Results' sheet and yields typed
+records (Measurement, BudgetLine) - no database involved. to_db_records() turns
+them into (run_id, query, values) records, ready for a db_writer.BatchWriter.
+---------------------------------------
 """
-# Connect to Resistors database:
-db_path = input('Full Resistors.db path? (press "d" for default location) >')
-if db_path == 'd':
-    db_path = r'G:\My Drive\Resistors.db'  # Default location.
-db_connection = sqlite3.connect(db_path)
-curs = db_connection.cursor()
-
-test = True
-response = input('Is this just a test (Y/N)? >')
-if response.startswith('N'):
-    test = False
-
-# Connect to XL file (E.g: r'G:\My Drive\TechProcDev\E052_Py3\HRBC_test_Py3.xlsx'):
-filename = input('Full XL path/filename? >')
-wb = xl.readxl(filename, ('Results',))
-
-[maxrow, maxcol] = wb.ws('Results').size
-print(f'Results sheet size: {maxrow} rows x {maxcol} columns.')
-
-this_analysis_note = ''
-this_run = ''
-first_meas_block = False
-next_meas_block = False
-meas_no = 0
-
-meas_date = ''
-Vtest_val = Vtest_unc = Vtest_df = 0
-T_val = T_unc = T_df = 0
-R_val = R_unc = R_df = R_expu = 0
-
-global_row_count = 0  # Row count within entire sheet.
-run_row_count = 0
-meas_row_count = 0
-
-print("Getting rows from 'Results' sheet...")
-for row in wb.ws('Results').rows:  # Step through rows and gather info...
-    # print(row)
-    global_row_count += 1
-    if row[0].startswith('Processed') or row[0].startswith('Data-rows'):  # Start of new run...
-        run_row_count = 1  # Row count within 1 run. Reset here.
-        this_analysis_note = row[0]
-        meas_no = 1  # Set / reset measurement number
-        print(f'\nAnalysis note:\t{this_analysis_note}')
-        continue
-
-    if row[2] == 'Run Id:':  # ... start of new run (still)
-        run_row_count += 1
-        this_run = row[3]
-        print(f'RUN ID:\t{this_run}')
-        continue
-
-    if row[0] == 'Name':  # 1st Actual data block starts NEXT row.
-        run_row_count += 1
-        meas_row_count = 0  # Reset row count within 1 meas-data block (excludes any headings).
-        first_meas_block = True
-        continue
-
-    if first_meas_block is True or next_meas_block is True:
-        """
-        We're now in a block of data relating to a single measurement.
-        'first_meas_block == True' means we're in the 1st measurement;
-        'next_meas_block == True' means we're in a subsequent measurement.
-        """
-        run_row_count += 1
-        meas_row_count += 1
-        print(f'In measurement block {meas_no}')
-
-        # Write budget line to Uncert_Contribs table:
-        if row[12] == 'inf':  # dof
-            df = 1e6
-        else:
-            df = row[12]
+
+# dof of 1e6 stands for infinite (or unrecorded) dof, as stored in the database.
+Quantity = collections.namedtuple('Quantity', 'value uncert dof expu')
+Measurement = collections.namedtuple('Measurement', 'run_id analysis_note meas_no meas_date V T R')
+BudgetLine = collections.namedtuple('BudgetLine', 'run_id meas_no label value uncert dof sens_co u_contrib')
+
+BUDGET_QUERY = ("INSERT OR REPLACE INTO Uncert_Contribs "
+                "(Run_id,Meas_No,Quantity_Label,Value,Uncert,DoF,Sens_Co,U_Contrib) VALUES (?,?,?,?,?,?,?,?);")
+RESULT_QUERY = ("INSERT OR REPLACE INTO Results "
+                "(Run_id,Meas_Date,Analysis_Note,Meas_No,Parameter,Value,Uncert,DoF,ExpU) VALUES (?,?,?,?,?,?,?,?,?);")
+RUNS_QUERY = "UPDATE OR REPLACE Runs SET Meas_Date=?, Analysis_Note=? WHERE Run_Id = ?;"
+
+
+def parse_results(rows):
+    """
+    Parse 'Results' sheet rows into typed records.
+
+    Each run starts with an analysis-note row ('Processed...' or 'Data-rows...'), then
+    a 'Run Id:' row and a 'Name' heading row. Measurement blocks follow, one per
+    measurement, separated by rows with an empty Value column (K). In each block:
+        row 1: V, date, T, R, u(R), dof(R), ExpU(R)  (columns B:H)
+        row 2: u(V), u(T)  (B, D) - zero if not recorded
+        row 3: dof(V), dof(T)  (B, D) - 1e6 if not recorded
+    and every row may carry an uncertainty-budget line (columns J:O).
+
+    :param rows: Iterable of 'Results' sheet rows (lists of cell values)
+    :return: generator of Measurement and BudgetLine records, in sheet order
+    (a Measurement follows the budget lines of its first 3 rows)
+    """
+    analysis_note = ''
+    run_id = ''
+    in_blocks = False  # After a run's 'Name' heading.
+    meas_no = 0
+    block_row = 0  # Row no. within current measurement block.
+    meas_date = ''
+    V = T = R = None
+    for row in rows:
+        if row[0].startswith('Processed') or row[0].startswith('Data-rows'):  # Start of new run...
+            analysis_note = row[0]
+            meas_no = 1
+            continue
+
+        if row[2] == 'Run Id:':  # ... start of new run (still)
+            run_id = row[3]
+            continue
+
+        if row[0] == 'Name':  # 1st measurement block starts NEXT row.
+            block_row = 0
+            in_blocks = True
+            continue
+
+        if not in_blocks:
+            continue
+
+        block_row += 1
         if row[10] != '' and row[14] > 0:  # Only include non-empty lines & non-zero contributions.
-            headings = 'Run_id,Meas_No,Quantity_Label,Value,Uncert,DoF,Sens_Co,U_Contrib'
-            values = (f"'{this_run}',{meas_no},'{row[9]}',{row[10]},{row[11]},{df},"
-                      f"{row[13]},{row[14]}")
-            budget_query = f"INSERT OR REPLACE INTO Uncert_Contribs ({headings}) VALUES ({values});"
-            curs.execute(budget_query)
-            print(f'Writing budget line for {row[9]}')
-
-        if meas_row_count == 1:  # Must be on first row of this measurement block.
-            Vtest_val = row[1]
+            dof = 1e6 if row[12] == 'inf' else row[12]
+            yield BudgetLine(run_id, meas_no, row[9], row[10], row[11], dof, row[13], row[14])
+
+        if block_row == 1:
             meas_date = convert_date_fmt(row[2])
-            # print(f'meas_date:\n{meas_date}')
-            T_val = row[3]
-            R_val, R_unc, R_df, R_expu = row[4:8]
+            V = Quantity(row[1], 0, 1e6, None)
+            T = Quantity(row[3], 0, 1e6, None)
+            R = Quantity(*row[4:8])
             continue
-        elif meas_row_count == 2:  # Must be on 2nd row of this measurement block.
-            if row[1] == '':
-                Vtest_unc = 0  # Default to zero std uncert, if not recorded.
-                T_unc = 0  # Default to zero std uncert, if not recorded.
-            else:
-                Vtest_unc = row[1]
-                T_unc = row[3]
+        elif block_row == 2:
+            if row[1] != '':  # (Uncertainties default to zero, if not recorded.)
+                V = V._replace(uncert=row[1])
+                T = T._replace(uncert=row[3])
             continue
-        elif meas_row_count == 3:  # Must be on 3rd row of this measurement block.
-            if row[1] == '':
-                Vtest_df = 1e6  # Default to max dof, if not recorded.
-                T_df = 1e6  # Default to max dof, if not recorded.
-            else:
-                Vtest_df = row[1]
-                T_df = row[3]
-            """
-            Write measurement info to Results table.
-            """
-            headings = 'Run_id,Meas_Date,Analysis_Note,Meas_No,Parameter,Value,Uncert,DoF,ExpU'
-            for key, val in {'V': [Vtest_val, Vtest_unc, Vtest_df, 'NULL'],
-                             'T': [T_val, T_unc, T_df, 'NULL'],
-                             'R': [R_val, R_unc, R_df, R_expu]}.items():
-                values = (f"'{this_run}','{meas_date}','{this_analysis_note}',"
-                          f"{meas_no},'{key}',{val[0]},{val[1]},{val[2]},{val[3]}")
-                result_query = f"INSERT OR REPLACE INTO Results ({headings}) VALUES ({values});"
-                print('Query:\n', result_query)
-                curs.execute(result_query)
-                print(f'Writing data for meas_no {meas_no} ({meas_row_count} rows)')
-
-            """
-            Update Runs table with mean Meas_Date & Analysis_Note
-            """
-            runs_query = (f"UPDATE OR REPLACE Runs SET Meas_Date='{meas_date}', Analysis_Note='{this_analysis_note}' "
-                          f"WHERE Run_Id = '{this_run}';")
-            curs.execute(runs_query)
-            print(f'Updating Runs table: meas_date - {meas_date}; {this_analysis_note}.')
-
-        if row[10] == '':  # Value column
-            """
-            We've reached the blank row between data blocks, so the
-            next measurement's data block starts next row.
-            """
-            first_meas_block = False
-            next_meas_block = True
-            print(f'END OF MEASUREMENT for meas_no {meas_no}.\n')
-            meas_row_count = 0
-            run_row_count = 0
+        elif block_row == 3:
+            if row[1] != '':  # (dof default to 1e6, if not recorded.)
+                V = V._replace(dof=row[1])
+                T = T._replace(dof=row[3])
+            yield Measurement(run_id, analysis_note, meas_no, meas_date, V, T, R)
+
+        if row[10] == '':  # Blank row - next measurement block starts on the next row.
+            block_row = 0
             meas_no += 1
+
+
+def to_db_records(records, verbose=False):
+    """
+    Convert typed records from parse_results() to database records:
+        Measurement -> Results records (V, T & R) and a Runs update (Meas_Date, Analysis_Note),
+        BudgetLine -> an Uncert_Contribs record.
+    :param records: Iterable of Measurement / BudgetLine records
+    :param verbose: Print progress if True
+    :return: generator of (run_id, query, values) tuples
+    """
+    for rec in records:
+        if isinstance(rec, BudgetLine):
+            yield rec.run_id, BUDGET_QUERY, tuple(rec)
+            continue
+        if verbose:
+            print(f'{rec.run_id}:\tmeas. {rec.meas_no} ({rec.meas_date}) R = {rec.R.value} +/- {rec.R.uncert}')
+        for param in ('V', 'T', 'R'):
+            q = getattr(rec, param)
+            yield rec.run_id, RESULT_QUERY, (rec.run_id, rec.meas_date, rec.analysis_note, rec.meas_no, param,
+                                             q.value, q.uncert, q.dof, q.expu)
+        yield rec.run_id, RUNS_QUERY, (rec.meas_date, rec.analysis_note, rec.run_id)
+
+
+def parse_results_sheet(rows, verbose=True):
+    """
+    Parse 'Results' sheet rows -> Results & Uncert_Contribs records (and Runs updates).
+    :param rows: Iterable of 'Results' sheet rows (lists of cell values)
+    :param verbose: Print progress if True
+    :return: generator of (run_id, query, values) tuples
+    """
+    return to_db_records(parse_results(rows), verbose)
+
+
+"""
+---------------------------------------
+Set up connections to database and XL file...
+"""
+if __name__ == '__main__':
+    perf.start('HRBA_Results_to_db')
+    verbose = not perf.quiet()  # (Set HR_QUIET=1 to suppress per-row output.)
+
+    # Connect to Resistors database:
+    db_path = input('Full Resistors.db path? (press "d" for default location) >')
+    if db_path == 'd':
+        db_path = r'G:\My Drive\Resistors.db'  # Default location.
+    db_connection = db_connections.connect(db_connections.checkout(db_path))  # (Working copy if HR_WORKING_COPY=1.)
+    writer = BatchWriter(db_connection)
+
+    test = True
+    response = input('Is this just a test (Y/N)? >')
+    if response.startswith('N'):
+        test = False
+
+    # Connect to XL file (E.g: r'G:\My Drive\TechProcDev\E052_Py3\HRBC_test_Py3.xlsx'):
+    filename = input('Full XL path/filename? >')
+
+    # Skip the workbook if its 'Results' sheet is unchanged since it was last ingested:
+    manifest = Manifest(db_connection, filename)
+    unchanged = manifest.is_unchanged(('Results',))
+    if unchanged:
+        response = input('Workbook unchanged since last ingest - ingest anyway? (Y/N) >')
+        manifest.force = response.startswith('Y')
+
+    if manifest.force or not unchanged:
+        with perf.timer('xl.read'):
+            wb = xl.readxl(filename, ('Results',))
+
+        [maxrow, maxcol] = wb.ws('Results').size
+        print(f'Results sheet size: {maxrow} rows x {maxcol} columns.')
+
+        print("Getting rows from 'Results' sheet...")
+        records = perf.timed_iter('parse.Results', parse_results_sheet(wb.ws('Results').rows, verbose))
+        writer.add_records(manifest.changed('Results', records))
+        manifest.record(writer, 'Results')
+        print(f"\n'Results': {len(manifest.touched['Results'])} new or modified runs.")
+        writer.flush()
+        refresh_drift_history(db_connection, run_ids=manifest.touched['Results'])
+
+        # tidy up:
+        if test is False:
+            print('\nCommitting changes to db...')
+            writer.commit()  # Assign all updates to database.
+        else:
+            writer.flush()  # Still run all queries, as a check...
+            writer.rollback()  # ...but discard the changes.
     else:
-        continue
-# tidy up:
-if test is False:
-    print('\nCommitting changes to db...')
-    db_connection.commit()  # Assign all updates to database.
-
-curs.close()
-if db_connection:
-    db_connection.close()
+        print('Nothing to do.')
+
+    if db_connection:
+        db_connections.close(db_connection, publish=not test)  # (Publishes a working copy - see db_connections.py.)
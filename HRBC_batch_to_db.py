@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+HRBC_batch_to_db.py - Initial version (Python 3).
+
+Batch version of HRBC_raw_data_to_db.py.
+
+Ingest every HRBC Excel file in a directory (or matching a glob pattern).
+Workbooks' 'Data' and 'Rlink' sheets are parsed in a pool of worker processes
+and all resulting Runs, Raw_Data and Raw_Rlink_Data records are written to
+Resistors.db through a single database connection (in this process).
+
+Each workbook is committed separately, so a failure (in parsing or writing)
+only loses that workbook - the rest of the batch carries on.
+Workbooks that are unchanged since they were last ingested (according to the
+ingest manifest) aren't parsed at all, and only new or modified runs of the
+others are written.
+A summary of rows/sec for each file, and any failures, is printed at the end.
+"""
+
+import concurrent.futures as cf
+import glob
+import os
+import time
+import traceback
+
+import db_connections
+import HRBC_raw_data_to_db as hrbc
+from db_writer import BatchWriter, BATCH_SIZE, count_rows
+from ingest_manifest import Manifest
+import perf
+
+
+"""
+---------------------------------------
+            Helper functions:
+---------------------------------------
+"""
+
+
+def find_workbooks(spec):
+    """
+    List HRBC workbooks to ingest.
+    :param spec: Directory name or glob pattern (e.g. r'G:\\My Drive\\HRBC\\**\\HRBC*.xlsx')
+    :return: Sorted list of XL paths/filenames
+    """
+    if os.path.isdir(spec):
+        spec = os.path.join(spec, '*.xlsx')
+    return sorted(f for f in glob.glob(spec, recursive=True)
+                  if not os.path.basename(f).startswith('~$'))  # Ignore Excel lock-files.
+
+
+def parse_job(xl_file, is_singledvm, streaming=False):
+    """
+    Worker-process job: parse one workbook.
+    :return: (list of records, parse time in s)
+    """
+    t_start = time.perf_counter()
+    records = hrbc.parse_workbook(xl_file, is_singledvm, streaming=streaming)
+    return records, time.perf_counter() - t_start
+
+
+def ingest_batch(db_connection, xl_files, is_singledvm, workers=None, batch_size=BATCH_SIZE, streaming=False,
+                 force=False):
+    """
+    Parse workbooks in parallel and write their records through one connection.
+    :param db_connection: Resistors.db connection (the single writer)
+    :param xl_files: List of XL paths/filenames
+    :param is_singledvm: True for single-DVM data ('Data' sheet only)
+    :param workers: Number of worker processes (default: number of CPUs)
+    :param batch_size: No. of rows per executemany() batch
+    :param streaming: Read sheets with the streaming (xlsx_stream) reader if True
+    :param force: Re-ingest every run of every workbook, even if unchanged
+    :return: (summary dict {xl_file: (n_rows, parse_t, write_t)}, failures dict {xl_file: error text})
+    n_rows is the no. of rows parsed (None for skipped, unchanged workbooks).
+    """
+    summary = {}
+    failures = {}
+    writer = BatchWriter(db_connection, batch_size)
+    sheets = ('Data',) if is_singledvm else ('Data', 'Rlink')
+
+    # Only parse new or modified workbooks:
+    manifests = {}
+    for xl_file in xl_files:
+        manifest = Manifest(db_connection, xl_file, force)
+        if force or not manifest.is_unchanged(sheets):
+            manifests[xl_file] = manifest
+        else:
+            summary[xl_file] = (None, 0.0, 0.0)
+    print(f'{len(xl_files) - len(manifests)} workbooks unchanged since last ingest.')
+
+    with cf.ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {pool.submit(parse_job, f, is_singledvm, streaming): f for f in manifests}
+        for job in cf.as_completed(jobs):
+            xl_file = jobs[job]
+            manifest = manifests[xl_file]
+            try:
+                records, parse_t = job.result()
+                perf.add_time('parse.workbook', parse_t)  # (Worker-process time.)
+                t_start = time.perf_counter()
+                n_rows = 0
+                for sheet in sheets:
+                    n_rows += count_rows(records[sheet])
+                    writer.add_records(manifest.changed(sheet, records[sheet]))
+                    manifest.record(writer, sheet)
+                writer.commit()  # One transaction per workbook.
+                write_t = time.perf_counter() - t_start
+            except Exception:
+                writer.rollback()  # Discard any partial write of this workbook only.
+                failures[xl_file] = traceback.format_exc()
+                print(f'FAILED:\t{xl_file}')
+                continue
+            summary[xl_file] = (n_rows, parse_t, write_t)
+            rate = n_rows / max(parse_t + write_t, 1e-9)
+            n_runs = sum(len(manifest.touched[sheet]) for sheet in sheets)
+            print(f'{n_rows} rows\t{rate:.0f} rows/s\t{n_runs} runs written\t{xl_file}')
+    return summary, failures
+
+
+"""
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    perf.start('HRBC_batch_to_db')
+    db_connection = hrbc.db_connect()
+
+    is_singledvm = input('Single-DVM data? (y/n)?') in ('y', 'Y', 'yes', 'Yes')
+    streaming = input('Stream sheets (for large files / low memory)? (y/n)?') in ('y', 'Y', 'yes', 'Yes')
+    force = input('Re-ingest unchanged workbooks too? (y/n)?') in ('y', 'Y', 'yes', 'Yes')
+    spec = input('Directory or glob pattern of XL files? >')
+    xl_files = find_workbooks(spec)
+    print(f'Found {len(xl_files)} workbooks.')
+
+    n_workers = input('Number of worker processes? (press "Enter" for one per CPU) >')
+    n_workers = int(n_workers) if n_workers else None
+    batch_size = input(f'Rows per write batch? (press "Enter" for {BATCH_SIZE}) >')
+    batch_size = int(batch_size) if batch_size else BATCH_SIZE
+
+    t0 = time.perf_counter()
+    summary, failures = ingest_batch(db_connection, xl_files, is_singledvm, n_workers, batch_size, streaming, force)
+    elapsed = time.perf_counter() - t0
+
+    total_rows = sum(s[0] for s in summary.values() if s[0] is not None)
+    n_parsed = sum(1 for s in summary.values() if s[0] is not None)
+    print('\n---------------------------------------------------------------------------------------------------\n')
+    print(f'Ingested {n_parsed}/{len(xl_files)} workbooks ({total_rows} rows) in {elapsed:.1f} s '
+          f'({total_rows / max(elapsed, 1e-9):.0f} rows/s).')
+    for xl_file, err in failures.items():
+        print(f'\nFAILED: {xl_file}\n{err}')
+
+    if db_connection:
+        db_connections.close(db_connection, publish=bool(summary))  # (Publishes a working copy - see db_connections.py.)
@@ -8,11 +8,29 @@ Created on Wed 5/08/2020
 
 Extract all raw data rows from 'Data' and 'Rlink' sheets of an HRBC Excel file
 and transfer information to Resistors.db >Raw_Rlink_Data, >Raw_Data and >Runs tables.
+
+The two sheets are independent, so (unless it's single-DVM data, or there's only
+one CPU) each is read and parsed in its own worker process (see SheetWorkers), while
+this process writes the records as they arrive. 'Data' records are written first,
+then 'Rlink' records (which have mostly been parsed by then), in the same order as
+parsing them one after the other, so the database ends up identical.
+Per-row progress isn't printed by the workers.
 """
 
 
+import itertools
+import multiprocessing as mp
+import os
 import pylightxl as xl
-import sqlite3
+import queue
+import db_connections
+import time
+import traceback
+
+from db_writer import BatchWriter, Rows
+from ingest_manifest import Manifest
+import perf
+import xlsx_stream
 
 
 """
@@ -87,11 +105,16 @@ def db_connect():
     db_path = input('Full Resistors.db path? (press "d" for default location) >')
     if db_path == 'd':
         db_path = r'G:\My Drive\Resistors.db'  # Default location.
-    db_connection = sqlite3.connect(db_path)
+    db_connection = db_connections.connect(db_connections.checkout(db_path))  # (Working copy if HR_WORKING_COPY=1.)
     return db_connection
 
 
 def xl_connect():
+    filename, is_singledvm, streaming = xl_prompt()
+    return read_workbook(filename, is_singledvm, streaming), is_singledvm, filename
+
+
+def xl_prompt():
     # Is the data from a single-dvm run?
     is_singledvm = input('Single-DVM data? (y/n)?')
     if is_singledvm in ('y', 'Y', 'yes', 'Yes'):
@@ -101,205 +124,457 @@ def xl_connect():
 
     # Connect to XL file (E.g: r'G:\My Drive\TechProcDev\E052_Py3\HRBC_test_Py3.xlsx'):
     filename = input('Full XL path/filename? >')
-    if is_singledvm:
-        return xl.readxl(filename, ('Data',)), is_singledvm, filename
+
+    # Large workbooks can be streamed row-by-row, rather than loaded whole:
+    streaming = input('Stream sheets (for large files / low memory)? (y/n)?') in ('y', 'Y', 'yes', 'Yes')
+    return filename, is_singledvm, streaming
+
+
+def read_workbook(filename, is_singledvm, streaming=False):
+    """
+    Read the sheets needed for ingest from an HRBC workbook.
+    :param filename: Full XL path/filename
+    :param is_singledvm: True if the data is from a single-DVM run (no 'Rlink' sheet)
+    :param streaming: If True, rows are read lazily (bounded memory) by xlsx_stream,
+    otherwise the sheets are loaded whole by pylightxl.
+    :return: pylightxl database object (or xlsx_stream.StreamWorkbook)
+    """
+    sheets = ('Data',) if is_singledvm else ('Data', 'Rlink')
+    if streaming:
+        return xlsx_stream.readxl(filename, sheets)
     else:
-        return xl.readxl(filename, ('Data', 'Rlink')), is_singledvm, filename
+        return xl.readxl(filename, sheets)
 
 """
--------------------------------------------------------------------------------------
-                          Main script starts here...
--------------------------------------------------------------------------------------
+---------------------------------------
+            Sheet parsers:
+Each parser steps through the rows of one sheet and yields
+(run_id, query, values) records, ready for a db_writer.BatchWriter.
+---------------------------------------
 """
-# Set up connections to database. # and XL file...
-db_connection = db_connect()
-curs = db_connection.cursor()
 
-wb, is_singledvm, xl_file = xl_connect()
+RUNS_HEADINGS = ('Run_Id,Comment,RS_Name,RX_Name,Range_Mode,SRC1,SRC2,DVMd,DVM12,GMH1,GMH2,GMHroom,'
+                 'Source_File')
+RAW_DATA_HEADINGS = ('Run_Id,Meas_No,Rev_No,V1set,V2set,n,Start_del,AZ1_del,Range_del,V1_time,V1_val,V1_sd,'
+                     'Vd_time,Vd_val,Vd_sd,V2_time,V2_val,V2_sd,GMH1,GMH2,Troom,Proom,RHroom')
+RLINK_HEADINGS = 'Run_Id,Reading_No,absV1,absV2,deltaVpos,deltaVneg'
+
+
+def insert_query(table, headings):
+    """
+    Build a parameterised 'INSERT OR REPLACE' query.
+    :param table: Database table name
+    :param headings: Comma-separated column names
+    :return: query string with one '?' placeholder per column
+    """
+    placeholders = ','.join('?' * len(headings.split(',')))
+    return f"INSERT OR REPLACE INTO {table} ({headings}) VALUES ({placeholders});"
+
+
+RUNS_QUERY = insert_query('Runs', RUNS_HEADINGS)
+RAW_DATA_QUERY = insert_query('Raw_Data', RAW_DATA_HEADINGS)
+RLINK_QUERY = insert_query('Raw_Rlink_Data', RLINK_HEADINGS)
+
+
+def parse_data_sheet(rows, is_singledvm, xl_file, verbose=True):
+    """
+    Parse 'Data' sheet rows -> Runs & Raw_Data records.
+    :param rows: Iterable of 'Data' sheet rows (lists of cell values)
+    :param is_singledvm: True for single-DVM data (no Raw_Data records)
+    :param xl_file: Source XL path/filename (recorded in Runs table)
+    :param verbose: Print progress if True
+    :return: generator of (run_id, query, values) tuples
+    """
+    Role_col = xl.pylightxl.utility_columnletter2num('AC')
+    Descr_col = xl.pylightxl.utility_columnletter2num('AD')
+    Rng_mode_col = xl.pylightxl.utility_columnletter2num('AE')
+    if is_singledvm is True:
+        comment_col = xl.pylightxl.utility_columnletter2num('AB')
+        DVM_null = 'DVM'
+        DVM_src = 'DVM'
+    else:
+        comment_col = xl.pylightxl.utility_columnletter2num('Z')
+        DVM_null = 'DVMd'
+        DVM_src = 'DVM12'
+
+    roles = []
+    instruments = []
+    reversal = 0
+    meas_no = 1
+    this_run = ''
+    com = ''
+    range_mode = ''
+
+    # Start working through Data sheet row by row...
+    for row in rows:
+
+        if row[0] in ('start_row', 'stop_row', 'V1_set',):
+            continue
+
+        # Look for next run_id...
+        if row[0] == 'Run Id:':
+            this_run = row[1]
+            if verbose:
+                print(f'\nRun: \t{this_run}')
+            #  Clear instrument assignment lists, reversal & meas-no, ready for next run:
+            roles.clear()
+            instruments.clear()
+            reversal = 0
+            meas_no = 1
+            continue
+
+        # Start gathering instrument assignments:
+        role = row[Role_col - 1]
+        descr = row[Descr_col - 1]
+        nom_range_mode = row[Rng_mode_col - 1]  # '', 'Range mode', 'FIXED' or 'AUTO'
+        if role == 'DVM12':
+            range_mode = nom_range_mode  # 'FIXED' or 'AUTO'
+        if row[comment_col - 1] not in ('', 'Comment'):  # row[comment_col-1].startswith('R')
+            prev_com = com
+            com = row[comment_col - 1]  # Only re-assign comment if NOT blank or 'Comment'
+            if com != prev_com and verbose:  # Only print comment if it's changed from last time
+                print(f'Comment: \t{com}')
+
+        """
+        Build instrument assignment info.
+        Ignore 'DVMT1' and 'DVMT2' roles since this info is no longer used
+        in the analysis.
+        """
+        if role not in ('', 'Role', 'DVMT1', 'DVMT2', 'switchbox'):
+            roles.append(role)
+            instruments.append(descr)
+
+        """"
+        Note range-mode for this run.
+        Have enough info to write 1 record to Runs table now.
+        (Assumes 10 role assignment rows.)
+        """
+        if len(roles) == 7:  # Only recording 7/10 roles - ignore DVMT1, DVMT2 and switchbox.
+            assignments = dict(zip(roles, instruments))
+            if verbose:
+                print(assignments)
+            Rx_name, Rs_name = extract_names(com)
+            values = (this_run, com, Rs_name, Rx_name, range_mode,
+                      assignments['SRC1'], assignments['SRC2'], assignments[DVM_null],
+                      assignments[DVM_src], assignments['GMH1'], assignments['GMH2'],
+                      assignments['GMHroom'], xl_file)
+            yield this_run, RUNS_QUERY, values
+
+        """
+        ---------------------------------------------------------------------------------
+        -----------------Next section is for *non* SINGLE-DVM files ONLY:----------------
+        """
+        if is_singledvm is False:  # Only add records to Raw_Data table if NOT a single-DVM run.
+            # Note which reversal we're on:
+            if row[0] not in ('start_row',  'stop_row', 'V1_set', 'Run Id:', '',):
+                # These rows have the actual data...
+                if reversal < 4:
+                    reversal += 1
+                else:  # Reset reversal count as measurement No. increments:
+                    reversal = 1
+                    meas_no += 1
+                if verbose:
+                    print(f'Processing run {this_run}:\n\tmeas. {meas_no}, reversal {reversal}.')
+                # correct date formats:
+                v1_t = convert(row[15])
+                v2_t = convert(row[6])
+                vd_t = convert(row[12])
+
+                values = (this_run, meas_no, reversal, row[0], row[1], row[2], row[3], row[4], row[5],
+                          v1_t, row[16], row[17], vd_t, row[13], row[14], v2_t, row[7], row[8],
+                          row[20], row[21], row[22], row[23], row[24])
+                if row[25] not in ('', 'IGNORE',):  # comment
+                    yield this_run, RAW_DATA_QUERY, values
+            # End of data row selector
+        # End of single-DVM filter
+
+
+RLINK_KEYS = ('N_Reversals', 'N_Readings', 'Run Id:', 'R1', 'R2', 'ΔV+')  # Rlink rows that aren't data.
+
+
+def _n_data_cells(row):
+    """No. of cells of (dV+, dV-) pairs in an Rlink data row - up to the first empty dV+ cell."""
+    starts = row[0::2]
+    return 2*(starts.index('') if '' in starts else len(starts))
+
+
+def rlink_block(run_id, first_reading, absV1, absV2, block):
+    """
+    Convert one Rlink data block (the rows after a 'ΔV+' heading) to a bulk record.
+    The (dV+, dV-) pairs are read left-to-right, row by row, and numbered from first_reading.
+    :param run_id: Run Id
+    :param first_reading: Reading_No of the first pair
+    :param absV1, absV2: Applied voltages (same for all readings)
+    :param block: List of data rows (lists of cell values)
+    :return: (run_id, RLINK_QUERY, Rows) record - None if the block has no readings
+    """
+    cells = list(itertools.chain.from_iterable(row[:_n_data_cells(row)] for row in block))
+    if not cells:
+        return None
+    n = len(cells)//2
+    values = Rows(zip(itertools.repeat(run_id, n), range(first_reading, first_reading + n),
+                      itertools.repeat(absV1, n), itertools.repeat(absV2, n), cells[0::2], cells[1::2]))
+    return run_id, RLINK_QUERY, values
+
+
+def parse_rlink_sheet(rows, verbose=True):
+    """
+    Parse 'Rlink' sheet rows -> Raw_Rlink_Data records.
+    Each data block is converted in one go (see rlink_block()) and yielded as one
+    bulk record, for BatchWriter.add_records().
+    :param rows: Iterable of 'Rlink' sheet rows (lists of cell values)
+    :param verbose: Print progress if True
+    :return: generator of (run_id, query, Rows) tuples
+    """
+    reading_no = 0
+    data_block = False
+    block = []  # Data rows of current block.
+    this_run = ''
+    absV1 = absV2 = 0
+    for row in rows:
+        if row[0] in RLINK_KEYS and block:  # End of data block.
+            record = rlink_block(this_run, reading_no, absV1, absV2, block)
+            block = []
+            if record is not None:
+                yield record
+                reading_no += len(record[2])
+                if verbose:
+                    print('.'*len(record[2]), end='')
+
+        # Get no of columns of data (reversals):
+        if row[0] == 'N_Reversals':
+            continue
+
+        # Get number of rows of data (readings);
+        if row[0] == 'N_Readings':
+            continue
+
+        # Look for next run_id...
+        if row[0] == 'Run Id:':
+            this_run = row[1]
+            if verbose:
+                print(f'\nRun: {this_run}')
+            data_block = False  # Not at data block yet
+            continue  # Ignore comment and date rows - this info is obtained elsewhere.
+
+        # Get applied voltages:
+        if row[0] == 'R1':
+            absV1 = row[3]
+            continue
+
+        elif row[0] == 'R2':
+            absV2 = row[3]
+            continue
+
+        # Trigger data-block reading from next row after this one:
+        if row[0] == 'ΔV+':
+            data_block = True
+            reading_no = 1  # Reset for new data block.
+            continue
+
+        if data_block is True:
+            block.append(row)  # (Any rows up to the next heading - blank ones have no readings.)
+            continue
+
+        if row[0] == '':
+            data_block = False  # If blank row, next row can't be data
+            reading_no = 0
+            continue
+
+    if block:
+        record = rlink_block(this_run, reading_no, absV1, absV2, block)
+        if record is not None:
+            yield record
+            if verbose:
+                print('.'*len(record[2]), end='')
+    #  End of R_link row loop
+
 
 """
--------------------------------------------------------------------------------------
-Start with 'Data' sheet -> Runs & Raw_Data tables...
+---------------------------------------
+        Concurrent sheet parsing:
+---------------------------------------
 """
-[maxrow, maxcol] = wb.ws('Data').size
-print(f'\nData sheet size: {maxrow} rows x {maxcol} columns.')
-
-Role_col = xl.pylightxl.utility_columnletter2num('AC')
-Descr_col = xl.pylightxl.utility_columnletter2num('AD')
-Rng_mode_col = xl.pylightxl.utility_columnletter2num('AE')
-if is_singledvm is True:
-    comment_col = xl.pylightxl.utility_columnletter2num('AB')
-    DVM_null = 'DVM'
-    DVM_src = 'DVM'
-else:
-    comment_col = xl.pylightxl.utility_columnletter2num('Z')
-    DVM_null = 'DVMd'
-    DVM_src = 'DVM12'
-
-roles = []
-instruments = []
-reversal = 0
-meas_no = 1
-this_run = ''
-com = ''
-
-# Start working through Data sheet row by row...
-for row in wb.ws('Data').rows:
-
-    if row[0] in ('start_row', 'stop_row', 'V1_set',):
-        continue
-
-    # Look for next run_id...
-    if row[0] == 'Run Id:':
-        this_run = row[1]
-        print(f'\nRun: \t{this_run}')
-        #  Clear instrument assignment lists, reversal & meas-no, ready for next run:
-        roles.clear()
-        instruments.clear()
-        reversal = 0
-        meas_no = 1
-        continue
-
-    # Start gathering instrument assignments:
-    role = row[Role_col - 1]
-    descr = row[Descr_col - 1]
-    nom_range_mode = row[Rng_mode_col - 1]  # '', 'Range mode', 'FIXED' or 'AUTO'
-    if role == 'DVM12':
-        range_mode = nom_range_mode  # 'FIXED' or 'AUTO'
-    if row[comment_col - 1] not in ('', 'Comment'):  # row[comment_col-1].startswith('R')
-        prev_com = com
-        com = row[comment_col - 1]  # Only re-assign comment if NOT blank or 'Comment'
-        if com != prev_com:  # Only print comment if it's changed from last time
-            print(f'Comment: \t{com}')
 
+PARSE_BATCH = 2000  # Records per batch passed from a sheet worker to the writer.
+WORKER_POLL = 1.0  # [s] - how often to check that a silent sheet worker is still alive.
+
+
+def parse_sheet_job(xl_file, sheet, is_singledvm, streaming, out_queue, batch_size=PARSE_BATCH):
     """
-    Build instrument assignment info.
-    Ignore 'DVMT1' and 'DVMT2' roles since this info is no longer used
-    in the analysis.
+    Worker-process job: read and parse one sheet, putting its records on out_queue.
+    Messages are (kind, payload) tuples: ('size', (rows, cols)), then ('records', [record, ...])
+    batches, then ('done', parse time in s) - or ('error', traceback text) if anything fails.
+    :param xl_file: Full XL path/filename
+    :param sheet: 'Data' or 'Rlink'
+    :param is_singledvm: True for single-DVM data
+    :param streaming: Read the sheet with the streaming (xlsx_stream) reader if True
+    :param out_queue: multiprocessing.Queue
+    :param batch_size: Records per batch
     """
-    if role not in ('', 'Role', 'DVMT1', 'DVMT2', 'switchbox'):
-        roles.append(role)
-        instruments.append(descr)
-
-    """"
-    Note range-mode for this run.
-    Have enough info to write 1 record to Runs table now.
-    (Assumes 10 role assignment rows.)
+    try:
+        t_start = time.perf_counter()
+        if streaming:
+            ws = xlsx_stream.readxl(xl_file, (sheet,)).ws(sheet)
+        else:
+            ws = xl.readxl(xl_file, (sheet,)).ws(sheet)
+        out_queue.put(('size', ws.size))
+        if sheet == 'Data':
+            records = parse_data_sheet(ws.rows, is_singledvm, xl_file, verbose=False)
+        else:
+            records = parse_rlink_sheet(ws.rows, verbose=False)
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                out_queue.put(('records', batch))
+                batch = []
+        out_queue.put(('records', batch))
+        out_queue.put(('done', time.perf_counter() - t_start))
+    except Exception:
+        out_queue.put(('error', traceback.format_exc()))
+
+
+class SheetWorkers:
     """
-    if len(roles) == 7:  # Only recording 7/10 roles - ignore DVMT1, DVMT2 and switchbox.
-        assignments = dict(zip(roles, instruments))
-        print(assignments)
-        Rx_name, Rs_name = extract_names(com)
-        # print(f'Rx: {Rx_name}, Rs: {Rs_name}')
-        headings = f'Run_Id,Comment,RS_Name,RX_Name,Range_Mode,SRC1,SRC2,DVMd,DVM12,GMH1,GMH2,GMHroom,Source_File'
-        values = (f" '{this_run}','{com}','{Rs_name}','{Rx_name}','{range_mode}',"
-                  f" '{assignments['SRC1']}','{assignments['SRC2']}','{assignments[DVM_null]}',"
-                  f" '{assignments[DVM_src]}','{assignments['GMH1']}','{assignments['GMH2']}',"
-                  f" '{assignments['GMHroom']}','{xl_file}'")
-        runs_query = f"INSERT OR REPLACE INTO Runs ({headings}) VALUES ({values});"
-        curs.execute(runs_query)
-        # print(runs_query)
+    Parse sheets of one workbook concurrently - one worker process (and queue) per sheet.
 
+    Usage:
+        with SheetWorkers(xl_file, ('Data', 'Rlink'), is_singledvm) as workers:
+            for sheet in ('Data', 'Rlink'):
+                writer.add_records(workers.records(sheet))
     """
-    ---------------------------------------------------------------------------------
-    -----------------Next section is for *non* SINGLE-DVM files ONLY:----------------
+
+    def __init__(self, xl_file, sheets, is_singledvm, streaming=False, batch_size=PARSE_BATCH):
+        self.queues = {sheet: mp.Queue() for sheet in sheets}
+        self.procs = {sheet: mp.Process(target=parse_sheet_job, daemon=True,
+                                        args=(xl_file, sheet, is_singledvm, streaming, self.queues[sheet],
+                                              batch_size))
+                      for sheet in sheets}
+        self.sizes = {}  # {sheet: (rows, cols)}
+        self.parse_times = {}  # {sheet: s} (in the worker)
+
+    def __enter__(self):
+        for proc in self.procs.values():
+            proc.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for proc in self.procs.values():
+            if proc.is_alive() and exc_type is not None:
+                proc.terminate()  # (Abandoned - its queue won't be emptied.)
+            proc.join()
+        return False
+
+    def records(self, sheet):
+        """
+        Records of one sheet, in sheet order, as its worker produces them.
+        :return: generator of (run_id, query, values) tuples
+        """
+        out_queue = self.queues[sheet]
+        while True:
+            try:
+                kind, payload = out_queue.get(timeout=WORKER_POLL)
+            except queue.Empty:
+                proc = self.procs[sheet]
+                if proc.exitcode is None:
+                    continue  # (Still working.)
+                try:  # (Anything it sent before exiting is in the queue by now.)
+                    kind, payload = out_queue.get(timeout=WORKER_POLL)
+                except queue.Empty:
+                    raise RuntimeError(f"'{sheet}' sheet worker died (exit code {proc.exitcode}) "
+                                       "before finishing - killed for lack of memory?") from None
+            if kind == 'records':
+                yield from payload
+            elif kind == 'size':
+                self.sizes[sheet] = payload
+            elif kind == 'done':
+                self.parse_times[sheet] = payload
+                perf.add_time(f'parse.{sheet}', payload)  # (Worker-process time.)
+                return
+            else:
+                raise RuntimeError(f"Parsing '{sheet}' sheet failed:\n{payload}")
+
+
+def parse_workbook(xl_file, is_singledvm, verbose=False, streaming=False):
+    """
+    Read an HRBC workbook and parse its 'Data' (and 'Rlink') sheets.
+    Runs in a worker process during batch ingest, so all records
+    are returned together in (picklable) lists.
+    :param xl_file: Full XL path/filename
+    :param is_singledvm: True for single-DVM data ('Data' sheet only)
+    :param verbose: Print progress if True
+    :param streaming: Read sheets with the streaming (xlsx_stream) reader if True
+    :return: dict of {sheet name: list of (run_id, query, values) tuples}
     """
-    if is_singledvm is False:  # Only add records to Raw_Data table if NOT a single-DVM run.
-        # Note which reversal we're on:
-        if row[0] not in ('start_row',  'stop_row', 'V1_set', 'Run Id:', '',):
-            # These rows have the actual data...
-            if reversal < 4:
-                reversal += 1
-            else:  # Reset reversal count as measurement No. increments:
-                reversal = 1
-                meas_no += 1
-            print(f'Processing run {this_run}:\n\tmeas. {meas_no}, reversal {reversal}.')
-            # input('Press any key to continue with analysis.')
-            # correct date formats:
-            v1_t = convert(row[15])
-            v2_t = convert(row[6])
-            vd_t = convert(row[12])
-
-            headings = (f'Run_Id,Meas_No,Rev_No,V1set,V2set,n,Start_del,AZ1_del,Range_del,V1_time,V1_val,V1_sd,'
-                        f'Vd_time,Vd_val,Vd_sd,V2_time,V2_val,V2_sd,GMH1,GMH2,Troom,Proom,RHroom')
-            values = (f"'{this_run}',{meas_no},{reversal},{row[0]},{row[1]},{row[2]},{row[3]},{row[4]},{row[5]},"
-                      f"'{v1_t}',{row[16]},{row[17]},'{vd_t}',{row[13]},{row[14]},'{v2_t}',{row[7]},{row[8]},"
-                      f"{row[20]},{row[21]},{row[22]},{row[23]},{row[24]}")
-            data_query = f"INSERT OR REPLACE INTO Raw_Data ({headings}) VALUES ({values});"
-            # print(data_query)
-            if row[25] not in ('', 'IGNORE',):  # comment
-                curs.execute(data_query)
-        # End of data row selector
-    # End of single-DVM filter
+    wb = read_workbook(xl_file, is_singledvm, streaming)
+    records = {'Data': list(parse_data_sheet(wb.ws('Data').rows, is_singledvm, xl_file, verbose))}
+    if not is_singledvm:
+        records['Rlink'] = list(parse_rlink_sheet(wb.ws('Rlink').rows, verbose))
+    return records
+
 
 """
-Now repeat with 'Rlink' -> Raw_Rlink_Data table...
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
 """
-print('\n---------------------------------------------------------------------------------------------------\n')
-print('Reading Rlink data...')
-
-[maxrow, maxcol] = wb.ws('Rlink').size
-print(f'Rlink sheet size: {maxrow} rows x {maxcol} columns.')
-
-reading_no = 0
-data_block = False
-Vpos_list = []
-Vneg_list = []
-n_reversals = 0
-absV1 = absV2 = 0
-for row in wb.ws('Rlink').rows:
-    # Get no of columns of data (reversals):
-    if row[0] == 'N_Reversals':
-        n_reversals = row[1]
-        continue
-
-    # Get number of rows of data (readings);
-    if row[0] == 'N_Readings':
-        n_readings = row[1]
-        continue
-
-    # Look for next run_id...
-    if row[0] == 'Run Id:':
-        this_run = row[1]
-        print(f'\nRun: {this_run}')
-        data_block = False  # Not at data block yet
-        continue  # Ignore comment and date rows - this info is obtained elsewhere.
-
-    # Get applied voltages:
-    if row[0] == 'R1':
-        absV1 = row[3]
-        continue
-
-    elif row[0] == 'R2':
-        absV2 = row[3]
-        continue
-
-    # Trigger data-block reading from next row after this one:
-    if row[0] == 'ΔV+':
-        data_block = True
-        reading_no = 1  # Reset for new data block.
-        continue
-
-    if data_block is True:
-        headings = f'Run_Id,Reading_No,absV1,absV2,deltaVpos,deltaVneg'
-        for i in range(0, len(row), 2):
-            if row[i] == '':
-                break  # Don't include empty cells
-
-            values = f" '{this_run}',{reading_no},{absV1},{absV2},{row[i]},{row[i+1]}"
-            Rlink_query = f"INSERT OR REPLACE INTO Raw_Rlink_Data ({headings}) VALUES ({values});"
-            curs.execute(Rlink_query)
-            reading_no += 1
-            print('.', end='')
-        continue
-
-    if row[0] == '':
-        data_block = False  # If blank row, next row can't be data
-        reading_no = 0
-        continue
-#  End of R_link row loop
-
-db_connection.commit()  # Assign all updates to database.
-curs.close()
-if db_connection:
-    db_connection.close()
+if __name__ == '__main__':
+    perf.start('HRBC_raw_data_to_db')
+    verbose = not perf.quiet()  # (Set HR_QUIET=1 to suppress per-row output.)
+
+    # Set up connections to database. # and XL file...
+    db_connection = db_connect()
+    writer = BatchWriter(db_connection)
+
+    xl_file, is_singledvm, streaming = xl_prompt()
+    sheets = ('Data',) if is_singledvm else ('Data', 'Rlink')
+
+    # Skip the whole workbook if it's unchanged since it was last ingested:
+    manifest = Manifest(db_connection, xl_file)
+    unchanged = manifest.is_unchanged(sheets)
+    if unchanged:
+        response = input('Workbook unchanged since last ingest - ingest anyway? (y/n)?')
+        manifest.force = response in ('y', 'Y', 'yes', 'Yes')
+
+    if manifest.force or not unchanged:
+        if len(sheets) == 1 or (os.cpu_count() or 1) < 2:
+            """
+            -------------------------------------------------------------------------------------
+            One sheet (single-DVM) or one CPU - parse the sheets here, one after the other:
+            'Data' -> Runs & Raw_Data tables, then 'Rlink' -> Raw_Rlink_Data table...
+            """
+            with perf.timer('xl.read'):
+                wb = read_workbook(xl_file, is_singledvm, streaming)
+            parsers = {'Data': lambda rows: parse_data_sheet(rows, is_singledvm, xl_file, verbose),
+                       'Rlink': lambda rows: parse_rlink_sheet(rows, verbose)}
+            for sheet in sheets:
+                [maxrow, maxcol] = wb.ws(sheet).size
+                print(f'\n{sheet} sheet size: {maxrow} rows x {maxcol} columns.')
+                records = perf.timed_iter(f'parse.{sheet}', parsers[sheet](wb.ws(sheet).rows))
+                writer.add_records(manifest.changed(sheet, records))
+                manifest.record(writer, sheet)
+        else:
+            """
+            -------------------------------------------------------------------------------------
+            'Data' -> Runs & Raw_Data tables, and 'Rlink' -> Raw_Rlink_Data table,
+            parsed concurrently (records written in sheet order)...
+            """
+            print('Reading Data and Rlink sheets...')
+            with SheetWorkers(xl_file, sheets, is_singledvm, streaming) as workers:
+                for sheet in sheets:
+                    records = perf.timed_iter(f'wait.{sheet}', workers.records(sheet))
+                    writer.add_records(manifest.changed(sheet, records))
+                    manifest.record(writer, sheet)
+                    [maxrow, maxcol] = workers.sizes[sheet]
+                    print(f'{sheet} sheet size: {maxrow} rows x {maxcol} columns '
+                          f'(parsed in {workers.parse_times[sheet]:.2f} s).')
+
+        writer.commit()  # Assign all updates to database.
+        for sheet in sheets:
+            print(f"\n'{sheet}': wrote {len(manifest.touched[sheet])} new or modified runs.")
+    else:
+        print('Nothing to do.')
+
+    if db_connection:
+        db_connections.close(db_connection, publish=manifest.force or not unchanged)  # (Publishes a working copy - see db_connections.py.)
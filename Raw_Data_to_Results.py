@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Raw_Data_to_Results.py - Initial version (Python 3).
+
+Native ratio analysis: calculate Results (and Uncert_Contribs) directly from the
+Raw_Data table, without re-opening workbooks for the HRBA analysis.
+
+HRBC model - R1 (Rx, at GMH1 temperature) and R2 (Rs, at GMH2) in series between
+sources V1 and V2, with the detector reading Vd at their junction:
+    R1/R2 = (V1 - Vd)/(Vd - V2)
+Each measurement is 4 reversals, in the sequence +, -, -, +. Using differences of
+the (+) and (-) means (each mean of 2 readings) cancels DVM offsets and linear drift:
+    ratio = (dV1 - dVd)/(dVd - dV2),    dV = mean(V[1], V[4]) - mean(V[2], V[3])
+Reading uncertainties are sd/sqrt(n), each with n-1 dof. The test-voltage is |dV1|/2,
+the temperature is the mean GMH1 reading (standard error of the mean, 3 dof), and
+    R = ratio * Rs(T, V, t)
+with Rs from its Res_Info book values (Get_Todays_Value.batch_values()), at the mean
+GMH2 temperature, its own test-voltage |dV2|/2 and the measurement's mean time.
+GMH readings are used as recorded (no thermometer corrections).
+DVM gain corrections (optional) are factors per instrument name (Runs.DVM12, .DVMd),
+applied to the V1, V2 and Vd readings - re-run after a gain correction changes.
+They're read from a JSON file ({"DVM name": gain, ...}) or a 2-column CSV file
+(DVM name, gain - with or without a header row) - see read_gains().
+
+All measurements are analysed together (NumPy), one Rs at a time - so thousands of
+runs take seconds. Results are written through the same typed records as
+HRBA_Results_to_db.py, with Analysis_Note = ANALYSIS_NOTE. Runs that already have
+HRBA-analysed Results are skipped, unless overwrite is chosen.
+"""
+
+import csv
+import json
+import time
+
+import numpy as np
+
+import db_connections
+import hr_dates
+import perf
+from Add_ExpU_to_Results import fill_expu_k
+from Add_date_to_Runs import add_dates
+from db_writer import BatchWriter, select_runs
+from Get_Todays_Value import batch_values
+from HRBA_Results_to_db import BudgetLine, Measurement, Quantity, to_db_records
+from Results_to_Drift_History import refresh_drift_history
+from Results_to_Res_Info import read_book_values
+
+
+ANALYSIS_NOTE = 'Raw_Data_to_Results.py native ratio analysis'
+INF_DOF = 1e6  # dof stored for infinite dof (as HRBA_Results_to_db.py).
+N_REV = 4  # Reversals per measurement.
+PLUS, MINUS = [0, 3], [1, 2]  # Reversal indices of the +, -, -, + sequence.
+
+RAW_QUERY = ("SELECT d.Run_Id, d.Meas_No, d.Rev_No, d.n, d.V1_val, d.V1_sd, d.Vd_val, d.Vd_sd, "
+             "d.V2_val, d.V2_sd, d.GMH1, d.GMH2, "
+             f"{hr_dates.SQL_DAYS.format('d.V1_time')}, {hr_dates.SQL_DAYS.format('d.Vd_time')}, "
+             f"{hr_dates.SQL_DAYS.format('d.V2_time')}, r.Rs_Name, r.DVM12, r.DVMd "
+             "FROM Raw_Data d JOIN Runs r ON r.Run_Id = d.Run_Id {where} "
+             "ORDER BY d.Run_Id, d.Meas_No, d.Rev_No;")
+NUMERIC = ('n', 'V1', 'u_V1', 'Vd', 'u_Vd', 'V2', 'u_V2', 'GMH1', 'GMH2', 't_V1', 't_Vd', 't_V2')
+
+
+"""
+---------------------------------------
+            Helper functions:
+---------------------------------------
+"""
+
+
+def runs_with_hrba_results(db_connection, run_ids=None):
+    """Run_Ids (of run_ids, or all) that have Results from another analysis (e.g. HRBA)."""
+    where = f"AND Run_Id IN ({select_runs(db_connection, run_ids)})" if run_ids is not None else ''
+    q = f"SELECT DISTINCT Run_Id FROM Results WHERE Analysis_Note IS NOT ? {where};"
+    return {row[0] for row in db_connection.execute(q, (ANALYSIS_NOTE,))}
+
+
+def read_raw(db_connection, run_ids=None):
+    """
+    Read Raw_Data (with each run's Rs_Name and DVMs), one row per reversal.
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param run_ids: Only these runs (default: all runs with Raw_Data)
+    :return: dict of columns - 'Run_Id', 'Meas_No', 'Rev_No', 'Rs_Name', 'DVM12', 'DVMd'
+    (lists / int arrays) and NUMERIC float arrays (NULL -> nan; times in days)
+    """
+    where = f"WHERE d.Run_Id IN ({select_runs(db_connection, run_ids)})" if run_ids is not None else ''
+    with perf.timer('sql.read'):
+        rows = db_connection.execute(RAW_QUERY.format(where=where)).fetchall()
+    cols = list(zip(*rows)) if rows else [()]*18
+    raw = {'Run_Id': list(cols[0]), 'Meas_No': np.array(cols[1], dtype=int),
+           'Rev_No': np.array(cols[2], dtype=int),
+           'Rs_Name': list(cols[15]), 'DVM12': list(cols[16]), 'DVMd': list(cols[17])}
+    for name, col in zip(NUMERIC, cols[3:15]):
+        raw[name] = np.array(col, dtype=float)
+    return raw
+
+
+def read_gains(filename):
+    """
+    DVM gain factors from a JSON file ({"DVM name": gain, ...}) or a CSV file of
+    (DVM name, gain) rows - a header row (with a non-numeric gain) is skipped.
+    :param filename: Full path of .json or .csv file
+    :return: dict {DVM name: gain factor}
+    """
+    with open(filename, newline='') as f:
+        if filename.lower().endswith('.json'):
+            return {str(name): float(gain) for name, gain in json.load(f).items()}
+        gains = {}
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].strip():
+                continue
+            try:
+                gains[row[0].strip()] = float(row[1])
+            except ValueError:
+                assert not gains, f'Invalid gain for {row[0]} in {filename}!'  # (Only a header may be non-numeric.)
+        return gains
+
+
+def gain_factors(names, gains):
+    """Array of gain factors for a list of instrument names (1 for any not in gains)."""
+    if not gains:
+        return np.ones(len(names))
+    return np.array([float(gains.get(name, 1.0)) for name in names])
+
+
+def complete_measurements(raw):
+    """
+    Indices of the rows of complete measurements - those with reversals 1 to 4, in order.
+    :return: int array, shape (no. of measurements, 4)
+    """
+    n = len(raw['Run_Id'])
+    if n < N_REV:
+        return np.zeros((0, N_REV), dtype=int)
+    # Rows are ordered by (Run_Id, Meas_No, Rev_No), so a complete measurement is a run
+    # of 4 rows with Rev_No 1..4 and the same (Run_Id, Meas_No):
+    run_idx = np.unique(raw['Run_Id'], return_inverse=True)[1]
+    first = np.flatnonzero(raw['Rev_No'][:n - N_REV + 1] == 1)
+    idx = first[:, None] + np.arange(N_REV)
+    ok = np.all(raw['Rev_No'][idx] == np.arange(1, N_REV + 1), axis=1)
+    ok &= np.all(run_idx[idx] == run_idx[first][:, None], axis=1)
+    ok &= np.all(raw['Meas_No'][idx] == raw['Meas_No'][first][:, None], axis=1)
+    return idx[ok]
+
+
+def reversal_difference(vals, uncs, dofs):
+    """
+    (+) mean minus (-) mean of each measurement's readings, with W-S dof.
+    :param vals, uncs, dofs: arrays, shape (no. of measurements, 4)
+    :return: (difference, uncertainty, dof) arrays
+    """
+    diff = vals[:, PLUS].mean(axis=1) - vals[:, MINUS].mean(axis=1)
+    var_k = (uncs/2)**2  # (Each reading's contribution.)
+    var = var_k.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dof = np.where(var > 0, var**2/(var_k**2/dofs).sum(axis=1), np.inf)
+    return diff, np.sqrt(var), dof
+
+
+def welch_satterthwaite(u_comps, dofs):
+    """Effective dof of a sum of components (arrays of standard-uncertainty contributions and their dof)."""
+    var = sum(u**2 for u in u_comps)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = sum(u**4/df for u, df in zip(u_comps, dofs))
+        return np.where(denom > 0, var**2/denom, np.inf)
+
+
+def stored_dof(dof):
+    """dof as stored in the database (infinite -> INF_DOF)."""
+    return float(dof) if np.isfinite(dof) and dof < INF_DOF else INF_DOF
+
+
+"""
+---------------------------------------
+            Analysis:
+---------------------------------------
+"""
+
+
+def ratio_analysis(raw, gains=None):
+    """
+    Ratio, test-voltage, temperatures and mean time of every complete measurement.
+    :param raw: From read_raw()
+    :param gains: dict {DVM name: gain factor} (default: no corrections)
+    :return: dict of per-measurement values - 'Run_Id', 'Meas_No', 'Rs_Name' (lists) and arrays
+    'ratio', 'u_ratio', 'df_ratio', 'u_dV1', 'u_dVd', 'u_dV2', 'c_dV1', 'c_dVd', 'c_dV2',
+    'V', 'u_V', 'df_V', 'T', 'u_T', 'T_Rs', 'u_T_Rs', 'V_Rs', 'u_V_Rs', 'df_V_Rs', 't_days'
+    """
+    idx = complete_measurements(raw)
+    first = idx[:, 0]
+    g12 = gain_factors(raw['DVM12'], gains)[idx]
+    gd = gain_factors(raw['DVMd'], gains)[idx]
+    n = raw['n'][idx]
+    n = np.where(n > 1, n, np.nan)  # (Need >1 reading for an sd.)
+    rt_n = np.sqrt(n)
+    dof = n - 1
+
+    dV1, u_dV1, df_dV1 = reversal_difference(g12*raw['V1'][idx], g12*raw['u_V1'][idx]/rt_n, dof)
+    dVd, u_dVd, df_dVd = reversal_difference(gd*raw['Vd'][idx], gd*raw['u_Vd'][idx]/rt_n, dof)
+    dV2, u_dV2, df_dV2 = reversal_difference(g12*raw['V2'][idx], g12*raw['u_V2'][idx]/rt_n, dof)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        num = dV1 - dVd
+        den = dVd - dV2
+        ratio = num/den
+        c_dV1 = 1/den  # Sensitivity coefficients.
+        c_dV2 = num/den**2
+        c_dVd = -(dV1 - dV2)/den**2
+    comps = (c_dV1*u_dV1, c_dVd*u_dVd, c_dV2*u_dV2)
+    u_ratio = np.sqrt(sum(u**2 for u in comps))
+    df_ratio = welch_satterthwaite(comps, (df_dV1, df_dVd, df_dV2))
+
+    T = raw['GMH1'][idx].mean(axis=1)
+    u_T = raw['GMH1'][idx].std(axis=1, ddof=1)/np.sqrt(N_REV)
+    T_Rs = raw['GMH2'][idx].mean(axis=1)
+    u_T_Rs = raw['GMH2'][idx].std(axis=1, ddof=1)/np.sqrt(N_REV)
+    times = np.concatenate((raw['t_V1'][idx], raw['t_Vd'][idx], raw['t_V2'][idx]), axis=1)
+
+    return {'Run_Id': [raw['Run_Id'][i] for i in first], 'Meas_No': raw['Meas_No'][first].tolist(),
+            'Rs_Name': [raw['Rs_Name'][i] for i in first],
+            'ratio': ratio, 'u_ratio': u_ratio, 'df_ratio': df_ratio,
+            'u_dV1': u_dV1, 'u_dVd': u_dVd, 'u_dV2': u_dV2, 'c_dV1': c_dV1, 'c_dVd': c_dVd, 'c_dV2': c_dV2,
+            'V': np.abs(dV1)/2, 'u_V': u_dV1/2, 'df_V': df_dV1, 'T': T, 'u_T': u_T,
+            'T_Rs': T_Rs, 'u_T_Rs': u_T_Rs, 'V_Rs': np.abs(dV2)/2, 'u_V_Rs': u_dV2/2, 'df_V_Rs': df_dV2,
+            't_days': np.nanmean(times, axis=1)}
+
+
+def rs_values(curs, meas):
+    """
+    Value of each measurement's Rs, from its Res_Info book values (one batch_values() call per Rs).
+    :param curs: Database cursor
+    :param meas: From ratio_analysis()
+    :return: (values, uncertainties, dofs) arrays (nan where Rs has no Res_Info), set of missing Rs names
+    """
+    n = len(meas['Rs_Name'])
+    vals, uncs, dofs = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+    by_rs = {}
+    for i, name in enumerate(meas['Rs_Name']):
+        by_rs.setdefault(name, []).append(i)
+    missing = set()
+    for name, rows in by_rs.items():
+        with perf.timer('value.book'):
+            book = read_book_values(curs, name) if name else {}
+        if not all(p in book for p in ('R0', 'alpha', 'TRef', 'VRef', 'tau', 'Cal_Date')):
+            missing.add(name)
+            continue
+        i = np.array(rows)
+        df_T = np.full(len(i), N_REV - 1.0)
+        vals[i], uncs[i], dofs[i] = batch_values(book, meas['T_Rs'][i], meas['u_T_Rs'][i], df_T,
+                                                 meas['V_Rs'][i], meas['u_V_Rs'][i], meas['df_V_Rs'][i],
+                                                 meas['t_days'][i])
+    return vals, uncs, dofs, missing
+
+
+def analysis_records(meas, Rs, u_Rs, df_Rs):
+    """
+    Typed Results records (as HRBA_Results_to_db.parse_results()) for every measurement
+    with a finite ratio and Rs value.
+    :param meas: From ratio_analysis()
+    :param Rs, u_Rs, df_Rs: From rs_values()
+    :return: generator of BudgetLine and Measurement records
+    """
+    R = meas['ratio']*Rs
+    u_R_ratio = np.abs(Rs)*meas['u_ratio']  # Contributions to u(R).
+    u_R_Rs = np.abs(meas['ratio'])*u_Rs
+    u_R = np.hypot(u_R_ratio, u_R_Rs)
+    df_R = welch_satterthwaite((u_R_ratio, u_R_Rs), (meas['df_ratio'], df_Rs))
+    ok = np.isfinite(R) & np.isfinite(u_R)
+    for i in np.flatnonzero(ok):
+        run_id, meas_no = meas['Run_Id'][i], meas['Meas_No'][i]
+        yield BudgetLine(run_id, meas_no, 'ratio', float(meas['ratio'][i]), float(meas['u_ratio'][i]),
+                         stored_dof(meas['df_ratio'][i]), float(Rs[i]), float(u_R_ratio[i]))
+        yield BudgetLine(run_id, meas_no, 'Rs', float(Rs[i]), float(u_Rs[i]), stored_dof(df_Rs[i]),
+                         float(meas['ratio'][i]), float(u_R_Rs[i]))
+        u_T = float(meas['u_T'][i]) if np.isfinite(meas['u_T'][i]) else 0
+        yield Measurement(run_id, ANALYSIS_NOTE, meas_no, hr_dates.from_days(meas['t_days'][i]),
+                          Quantity(float(meas['V'][i]), float(meas['u_V'][i]), stored_dof(meas['df_V'][i]), None),
+                          Quantity(float(meas['T'][i]), u_T, stored_dof(N_REV - 1 if u_T > 0 else np.inf), None),
+                          Quantity(float(R[i]), float(u_R[i]), stored_dof(df_R[i]), None))
+
+
+def analyse_runs(db_connection, run_ids=None, overwrite=False, gains=None, verbose=True):
+    """
+    Calculate Results from Raw_Data and write them (replacing any earlier Results and
+    Uncert_Contribs of the same runs, but keeping their Excluded flags).
+    The caller should commit (or roll back) afterwards.
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param run_ids: Only these runs (default: all runs with Raw_Data)
+    :param overwrite: Also re-analyse runs with HRBA-analysed Results
+    :param gains: dict {DVM name: gain factor} (default: no corrections)
+    :param verbose: Print progress if True
+    :return: (list of Run_Ids written, dict {Run_Id: reason} of runs skipped)
+    """
+    raw = read_raw(db_connection, run_ids)
+    skipped = {}
+    if not overwrite:
+        for run_id in runs_with_hrba_results(db_connection, sorted(set(raw['Run_Id']))):
+            skipped[run_id] = 'has HRBA-analysed Results'
+        if skipped:
+            keep = [i for i, r in enumerate(raw['Run_Id']) if r not in skipped]
+            raw = {k: ([v[i] for i in keep] if isinstance(v, list) else v[keep]) for k, v in raw.items()}
+
+    with perf.timer('analysis.ratio'):
+        meas = ratio_analysis(raw, gains)
+    with perf.timer('analysis.rs'):
+        Rs, u_Rs, df_Rs, missing = rs_values(db_connection.cursor(), meas)
+    for run_id, name in zip(meas['Run_Id'], meas['Rs_Name']):
+        if name in missing:
+            skipped.setdefault(run_id, f'no Res_Info for Rs ({name})')
+    for run_id in set(raw['Run_Id']) - set(meas['Run_Id']):
+        skipped.setdefault(run_id, 'no complete measurements')
+
+    records = list(analysis_records(meas, Rs, u_Rs, df_Rs))
+    written = sorted({rec.run_id for rec in records})
+    if verbose:
+        print(f'{len(meas["Run_Id"])} measurements in {len(set(meas["Run_Id"]))} runs analysed; '
+              f'writing Results for {len(written)} runs.')
+    if not written:
+        return written, skipped
+
+    # Replace earlier Results (the no. of measurements may differ):
+    if not db_connection.in_transaction:
+        db_connection.execute('BEGIN')
+    sub_q = select_runs(db_connection, written)
+    with perf.timer('sql.write'):
+        excluded = db_connection.execute("SELECT Excluded, Run_Id, Meas_No, Parameter FROM Results "
+                                         f"WHERE Run_Id IN ({sub_q}) AND Excluded IS NOT NULL;").fetchall()
+        db_connection.execute(f"DELETE FROM Results WHERE Run_Id IN ({sub_q});")
+        db_connection.execute(f"DELETE FROM Uncert_Contribs WHERE Run_Id IN ({sub_q});")
+    writer = BatchWriter(db_connection)
+    writer.add_records(to_db_records(records, verbose))
+    writer.flush()
+    with perf.timer('sql.write'):  # (Put back any hand-set Excluded flags.)
+        db_connection.executemany("UPDATE Results SET Excluded = ? WHERE Run_Id = ? AND Meas_No = ? AND Parameter = ?;",
+                                  excluded)
+    fill_expu_k(db_connection, written)
+    add_dates(db_connection, written)
+    refresh_drift_history(db_connection, run_ids=written, verbose=verbose)
+    return written, skipped
+
+
+"""
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    perf.start('Raw_Data_to_Results')
+    test = True
+    Q_test_script = input('Test before running properly? (Y/N) >')
+    if Q_test_script.startswith('N'):
+        test = False  # This is NOT a test!
+
+    db_path = input('Full Resistors.db path? (press "d" for default location) >')
+    if db_path == 'd':
+        db_path = r'G:\My Drive\Resistors.db'  # Default location.
+    db_connection = db_connections.connect(db_connections.checkout(db_path))  # (Working copy if HR_WORKING_COPY=1.)
+
+    names = input("Run_Ids, separated by ';'? (For all runs press 'Enter') >")
+    run_ids = [n.strip() for n in names.split(';') if n.strip()] or None
+    overwrite = input('Re-analyse runs with HRBA-analysed Results too? (y/n) >') in ('y', 'Y', 'yes', 'Yes')
+    gains_file = input("DVM gain-factor file (.json or .csv)? (For no gain corrections press 'Enter') >")
+    gains = read_gains(gains_file) if gains_file else None
+    if gains:
+        print('Gain factors: ' + ', '.join(f'{name} {gain}' for name, gain in gains.items()))
+
+    t0 = time.perf_counter()
+    written, skipped = analyse_runs(db_connection, run_ids, overwrite, gains, verbose=not perf.quiet())
+    elapsed = time.perf_counter() - t0
+
+    print('\n---------------------------------------------------------------------------------------------------\n')
+    print(f'Wrote Results for {len(written)} runs in {elapsed:.1f} s.')
+    for run_id, reason in sorted(skipped.items()):
+        print(f'Skipped {run_id}: {reason}')
+
+    # tidy up:
+    if test is False:
+        db_connection.commit()  # Assign all updates to database.
+    else:
+        db_connection.rollback()
+
+    if db_connection:
+        db_connections.close(db_connection, publish=not test)  # (Publishes a working copy - see db_connections.py.)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Res_Info_batch.py - Initial version (Python 3).
+
+Batch version of Results_to_Res_Info.py.
+
+Refresh Res_Info for every resistor in the Runs table (or a supplied list).
+Each resistor's alpha / gamma / tau fits (Results_to_Res_Info.fit_res_info())
+run in a separate worker process, with its own read-only database connection,
+and each resistor's Res_Info records are written, as soon as its fit is done, by
+a single writer thread (db_connections.WriterQueue).
+A resistor whose data can't be fitted is reported, but doesn't stop the batch.
+"""
+
+import concurrent.futures as cf
+import time
+import traceback
+
+from Results_to_Res_Info import fit_res_info, LIMIT_MAX, RES_INFO_QUERY
+import db_connections
+import perf
+from Results_to_Drift_History import refresh_drift_history
+
+
+"""
+---------------------------------------
+            Helper functions:
+---------------------------------------
+"""
+
+
+def all_rx_names(db_connection):
+    """List every resistor measured as Rx in a FIXED-range, non-blacklisted run."""
+    q = ("SELECT DISTINCT Rx_Name FROM Runs WHERE Range_Mode='FIXED' AND "
+         "(Blacklist IS NULL OR Blacklist='No') ORDER BY Rx_Name;")
+    return [row[0] for row in db_connection.execute(q).fetchall()]
+
+
+def fit_job(db_path, Rx_name, Rs_name, run_count):
+    """
+    Worker-process job: fit one resistor.
+    :return: (list of Res_Info records, fit time in s)
+    """
+    t_start = time.perf_counter()
+    db_connection = db_connections.connect(db_path, read_only=True)
+    try:
+        res_info = fit_res_info(db_connection.cursor(), Rx_name, Rs_name, run_count, verbose=False)
+    finally:
+        db_connection.close()
+    return res_info, time.perf_counter() - t_start
+
+
+def fit_batch(db_path, Rx_names, Rs_name='', run_count=LIMIT_MAX, workers=None, writer=None):
+    """
+    Fit many resistors in parallel.
+    :param db_path: Full Resistors.db path
+    :param Rx_names: List of resistor names
+    :param Rs_name: Preferred Rs_name ('' for any Rs)
+    :param run_count: 1 (most recent run only) or LIMIT_MAX (all valid results)
+    :param workers: Number of worker processes (default: number of CPUs)
+    :param writer: db_connections.WriterQueue - if given, each resistor's records are written
+    (uncommitted) as soon as its fit completes
+    :return: (Res_Info records, timings dict {Rx_name: fit time}, failures dict {Rx_name: error text})
+    """
+    res_info = []
+    timings = {}
+    failures = {}
+    with cf.ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {pool.submit(fit_job, db_path, name, Rs_name, run_count): name for name in Rx_names}
+        for job in cf.as_completed(jobs):
+            name = jobs[job]
+            try:
+                records, fit_t = job.result()
+            except Exception:
+                failures[name] = traceback.format_exc()
+                print(f'FAILED:\t{name}')
+                continue
+            res_info.extend(records)
+            timings[name] = fit_t
+            if writer is not None:
+                writer.executemany(RES_INFO_QUERY, records)
+            print(f'{fit_t:.2f} s\t{len(records)} parameters\t{name}')
+    return res_info, timings, failures
+
+
+"""
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    perf.start('Res_Info_batch')
+    test = True
+    Q_test_script = input('Test before running properly? (Y/N) >')
+    if Q_test_script.startswith('N'):
+        test = False  # This is NOT a test!
+
+    db_path = input('Full Resistors.db path? (press "d" for default location) >')
+    if db_path == 'd':
+        db_path = r'G:\My Drive\Resistors.db'  # Default location.
+    db_path = db_connections.checkout(db_path)  # (Working copy if HR_WORKING_COPY=1.)
+    db_connection = db_connections.connect(db_path, read_only=True)
+
+    names = input("Rx_names, separated by ';'? (For all resistors press 'Enter') >")
+    if names == '':
+        Rx_names = all_rx_names(db_connection)
+    else:
+        Rx_names = [n.strip() for n in names.split(';') if n.strip()]
+    print(f'Fitting {len(Rx_names)} resistors.')
+
+    Rs_name = input("Preferred Rs_name(s)? (For any Rs press 'Enter') >")
+    limit_choices = {'r': 1, 'a': LIMIT_MAX}
+    response = input("Restrict to results from most-recent run ('r')"
+                     " or use all valid results ('a')?")
+    assert response in limit_choices.keys(), 'Error - Invalid input!'
+    run_count = limit_choices[response]
+
+    n_workers = input('Number of worker processes? (press "Enter" for one per CPU) >')
+    n_workers = int(n_workers) if n_workers else None
+
+    t0 = time.perf_counter()
+    with db_connections.WriterQueue(db_path) as writer:
+        res_info, timings, failures = fit_batch(db_path, Rx_names, Rs_name, run_count, n_workers, writer)
+        fitted = list(timings)  # (R_Corr uses the new alpha, gamma etc.)
+        writer.submit(lambda conn: refresh_drift_history(conn, R_names=fitted)).result()
+        if test is False:
+            writer.commit()  # Assign all updates to database.
+        else:
+            writer.rollback()  # Queries were still run, as a check - but discard the changes.
+    for t in timings.values():
+        perf.add_time('fit.resistor', t)  # (Worker-process time.)
+    elapsed = time.perf_counter() - t0
+
+    print('\n---------------------------------------------------------------------------------------------------\n')
+    print(f'Fitted {len(timings)}/{len(Rx_names)} resistors ({len(res_info)} Res_Info records) in {elapsed:.1f} s.')
+    if timings:
+        print(f'Fit time per resistor: mean {sum(timings.values()) / len(timings):.2f} s, '
+              f'max {max(timings.values()):.2f} s ({max(timings, key=timings.get)}).')
+    for name, err in failures.items():
+        print(f'\nFAILED: {name}\n{err}')
+
+    if db_connection:
+        db_connection.close()
+    db_connections.checkin(db_path, publish=not test)  # (Publishes a working copy - see db_connections.py.)
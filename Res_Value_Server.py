@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Res_Value_Server.py - Initial version (Python 3).
+
+Long-running local service version of Get_Todays_Value.py.
+
+Res_Info for every resistor is loaded into memory (as ureals) at start-up.
+Requests for R(T, V, t) are then answered from memory, over HTTP on localhost:
+    GET /value?R_name=HR9103%2010M&T=21.0 0.01 50&V=10&t=2023-01-01 00:00:00
+        T and V: "val unc dof" (as at Get_Todays_Value.py's prompts), or just "val".
+        t: 'yyyy-mm-dd HH:MM:SS', or 'n' (default) for now.
+        -> {"R_name", "value", "uncert", "dof", "latency_ms"}  (dof is null if infinite)
+    GET /resistors  -> list of resistor names
+    GET /stats      -> request count, latency and cache statistics
+
+Each request runs on its own thread, with a read-only connection borrowed from a
+db_connections.ReaderPool. Before each request, PRAGMA data_version shows whether
+another connection has committed changes to the database. If so, a digest of each
+resistor's Res_Info records is compared with the one loaded, and only resistors
+whose records have changed are re-loaded (new resistors are added; deleted ones
+dropped). (data_version is per connection, so each pooled connection's last value
+is kept - a connection's first look, or its first look after a change another
+connection has already re-loaded, costs just a digest query.)
+
+GTC isn't thread-safe, so re-loads and calculations hold the store's lock - requests
+still overlap in everything else (reading, parsing and replying).
+"""
+
+import collections
+import hashlib
+import http.server
+import json
+import math
+import sqlite3
+import statistics
+import threading
+import time
+import urllib.parse
+
+from Get_Todays_Value import str_to_ureal_args, date_to_days, todays_value
+from Results_to_Res_Info import read_book_values
+from ureal_cache import cache_info
+import db_connections
+import perf
+
+
+HOST = '127.0.0.1'  # Localhost only.
+PORT = 8765
+N_LATENCIES = 1000  # No. of recent request latencies kept for statistics.
+POOL_SIZE = db_connections.POOL_SIZE  # Max. no. of read-only connections.
+
+DIGEST_QUERY = ("SELECT R_Name, Parameter, Value, Uncert, DoF, Label, Ureal_Str FROM Res_Info "
+                "ORDER BY R_Name, Parameter;")
+
+
+"""
+---------------------------------------
+            Helper functions:
+---------------------------------------
+"""
+
+
+def res_info_digests(db_connection):
+    """
+    Digest of each resistor's Res_Info records.
+    :return: dict {R_name: digest}
+    """
+    hashers = {}
+    for row in db_connection.execute(DIGEST_QUERY):
+        hashers.setdefault(row[0], hashlib.sha1()).update(repr(row[1:]).encode())
+    return {name: h.hexdigest() for name, h in hashers.items()}
+
+
+class ResValueStore:
+    """In-memory book values for all resistors, kept in step with Res_Info."""
+
+    def __init__(self, pool):
+        """
+        :param pool: db_connections.ReaderPool for Resistors.db
+        """
+        self.pool = pool
+        self.lock = threading.Lock()  # (Held while re-loading or calculating - GTC isn't thread-safe.)
+        self.books = {}  # {R_name: {Parameter: ureal}}
+        self.digests = {}  # {R_name: digest}
+        self.data_versions = {}  # {id(connection): data_version when the store was last in step with it}
+        self.n_reloads = 0  # No. of resistors (re-)loaded since start-up.
+        self.reload_time = 0.0  # Total time spent (re-)loading [s].
+        self.refresh()
+
+    def refresh(self, db_connection=None):
+        """
+        Re-load resistors whose Res_Info records have changed since they were loaded.
+        :param db_connection: Pooled connection to check with (one is borrowed if None)
+        :return: list of re-loaded resistor names
+        """
+        if db_connection is None:
+            with self.pool.connection() as db_connection:
+                return self.refresh(db_connection)
+        version = db_connection.execute('PRAGMA data_version;').fetchone()[0]
+        with self.lock:
+            if self.data_versions.get(id(db_connection)) == version:
+                return []
+            t_start = time.perf_counter()
+            digests = res_info_digests(db_connection)
+            changed = [name for name, d in digests.items() if self.digests.get(name) != d]
+            curs = db_connection.cursor()
+            try:
+                for name in changed:
+                    self.books[name] = read_book_values(curs, name)
+                    self.digests[name] = digests[name]  # (So a failure part-way re-tries only the rest.)
+            finally:
+                curs.close()
+            for name in set(self.books) - set(digests):  # Deleted from Res_Info.
+                del self.books[name]
+            self.digests = digests
+            self.data_versions[id(db_connection)] = version  # (Only once everything has re-loaded.)
+            reload_t = time.perf_counter() - t_start
+            self.n_reloads += len(changed)
+            self.reload_time += reload_t
+        perf.add_time('value.reload', reload_t)
+        return changed
+
+    def value(self, R_name, R_temp, R_V, t_days):
+        """R(T, V, t) for one resistor (see Get_Todays_Value.todays_value())."""
+        self.refresh()
+        with self.lock:
+            if R_name not in self.books:
+                raise KeyError(f'No resistor info available for {R_name}!')
+            return todays_value(self.books[R_name], R_temp, R_V, t_days)
+
+    def names(self):
+        """Sorted names of all loaded resistors (after a refresh())."""
+        self.refresh()
+        with self.lock:
+            return sorted(self.books)
+
+
+class ResValueHandler(http.server.BaseHTTPRequestHandler):
+    """Answer /value, /resistors and /stats requests from the server's ResValueStore."""
+
+    def do_GET(self):
+        t_start = time.perf_counter()
+        url = urllib.parse.urlparse(self.path)
+        query = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+        try:
+            if url.path == '/value':
+                R = self.server.store.value(query['R_name'], str_to_ureal_args(query['T']),
+                                            str_to_ureal_args(query['V']), date_to_days(query.get('t', 'n')))
+                latency = time.perf_counter() - t_start
+                self.server.add_latency(latency)
+                body = {'R_name': query['R_name'], 'value': R.x, 'uncert': R.u,
+                        'dof': None if math.isinf(R.df) else R.df, 'latency_ms': 1000*latency}
+            elif url.path == '/resistors':
+                body = self.server.store.names()
+            elif url.path == '/stats':
+                body = self.server.statistics()
+            else:
+                self.send_error(404, 'Unknown request (use /value, /resistors or /stats)')
+                return
+        except (KeyError, ValueError, AssertionError) as msg:
+            self.server.count('errors')
+            self.send_error(400, str(msg))
+            return
+        except sqlite3.Error as msg:  # E.g. database locked by an ingest or a publish - worth re-trying.
+            self.server.count('errors')
+            self.send_error(503, f'Database unavailable: {msg}')
+            return
+        except Exception as msg:
+            self.server.count('errors')
+            self.send_error(500, f'{type(msg).__name__}: {msg}')
+            return
+        self.server.count('requests')
+        self._reply(body)
+
+    def _reply(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Keep console quiet - see /stats instead.
+
+
+class ResValueServer(http.server.ThreadingHTTPServer):
+    """HTTP server (a thread per request) holding a ResValueStore and request statistics."""
+
+    daemon_threads = True  # (Don't wait for open requests on Ctrl-C.)
+
+    def __init__(self, pool, host=HOST, port=PORT):
+        """
+        :param pool: db_connections.ReaderPool for Resistors.db
+        """
+        t_start = time.perf_counter()
+        self.store = ResValueStore(pool)
+        self.load_time = time.perf_counter() - t_start
+        self.stats = {'requests': 0, 'errors': 0, 'latencies': collections.deque(maxlen=N_LATENCIES)}
+        self.stats_lock = threading.Lock()
+        super().__init__((host, port), ResValueHandler)
+
+    def count(self, key):
+        """Count a request ('requests') or an error ('errors')."""
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def add_latency(self, latency):
+        """Record a /value request's latency [s]."""
+        with self.stats_lock:
+            self.stats['latencies'].append(latency)
+
+    def statistics(self):
+        """Request latency [ms], store and ureal-cache statistics."""
+        with self.stats_lock:
+            lat = sorted(1000*t for t in self.stats['latencies'])
+        latency = {}
+        if lat:
+            latency = {'n': len(lat), 'mean': statistics.fmean(lat), 'median': statistics.median(lat),
+                       'p95': lat[min(len(lat) - 1, int(0.95*len(lat)))], 'max': lat[-1]}
+        return {'requests': self.stats['requests'], 'errors': self.stats['errors'],
+                'latency_ms': latency, 'resistors': len(self.store.books),
+                'load_time_s': self.load_time, 'reloads': self.store.n_reloads,
+                'reload_time_s': self.store.reload_time, 'ureal_cache': cache_info()}
+
+
+"""
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    perf.start('Res_Value_Server')
+    db_path = input('Full Resistors.db path? (press "d" for default location) >')
+    if db_path == 'd':
+        db_path = r'G:\My Drive\Resistors.db'  # Default location.
+    pool = db_connections.ReaderPool(db_path, POOL_SIZE)  # (Read-only connections, one per concurrent request.)
+
+    port = input(f'Port? (press "Enter" for {PORT}) >')
+    port = int(port) if port else PORT
+
+    server = ResValueServer(pool, HOST, port)
+    print(f'Loaded {len(server.store.books)} resistors in {server.load_time:.2f} s.')
+    print(f'Serving on http://{HOST}:{port}/ (/value, /resistors, /stats) - Ctrl-C to stop.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Results_to_Drift_History.py - Initial version (Python 3).
+
+Materialized drift history: one Drift_History row per (resistor, run, measurement),
+with its epoch-day date (days since 1970-01-01, as hr_dates.py), T, V and R (with
+uncertainties) and R corrected to the resistor's reference conditions with its
+current Res_Info alpha, gamma, TRef and VRef:
+    R_Corr = R/(1 + alpha*(T - TRef) + gamma*(V - VRef)),   u_R_Corr = u_R/(same)
+(u_R_Corr doesn't include the uncertainties of alpha and gamma; R_Corr is NULL if
+the resistor has no alpha / TRef yet, and the gamma term is left out if it has no
+gamma / VRef.)
+
+The table's primary key is (R_Name, Meas_Day, Run_Id, Meas_No), with no separate
+rowid, so a resistor's history over a date range is a single range scan of it (see
+TREND_QUERY and drift_history()) - no joins, and no ureals to thaw.
+
+Rows are built in SQL (one INSERT ... SELECT, pivoting each measurement's V, T and R
+Results records). Refreshes are incremental - only these runs are rebuilt:
+    * run_ids - the runs a script has just written (ingest and re-analysis pass them);
+    * runs of R_names - resistors just refitted (the Res_Info scripts pass them);
+    * as a fall-back, for writes from elsewhere: runs with Results rows, or whose
+      resistor has Res_Info rows, above the highest rowids seen by the last refresh
+      (kept in Derived_State - see db_writer.get_state()).
+(The rowids alone aren't enough: after a DELETE, or an INSERT OR REPLACE of the last
+rows, SQLite re-uses the freed rowids.)
+Hand edits of the columns Drift_History copies (Results.Excluded; Runs.Blacklist,
+Range_Mode, Rx_Name, Rs_Name) are caught by triggers, which add the run to
+Drift_History_Dirty - the next refresh rebuilds (and empties) it. Deleted runs still
+need a full refresh.
+"""
+
+import time
+
+import db_connections
+import hr_dates
+import perf
+from db_writer import DERIVED_STATE_SCHEMA, get_state, select_runs, set_state
+
+
+TABLE = 'Drift_History'
+SCHEMA = (
+    f"CREATE TABLE IF NOT EXISTS {TABLE} (R_Name TEXT NOT NULL, Meas_Day REAL NOT NULL, Run_Id TEXT NOT NULL, "
+    "Meas_No INTEGER NOT NULL, Rs_Name TEXT, Meas_Date TEXT, Range_Mode TEXT, Blacklist TEXT, Excluded TEXT, "
+    "T REAL, u_T REAL, V REAL, u_V REAL, R REAL, u_R REAL, DoF_R REAL, R_Corr REAL, u_R_Corr REAL, "
+    "PRIMARY KEY (R_Name, Meas_Day, Run_Id, Meas_No)) WITHOUT ROWID;",
+    f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_Run ON {TABLE} (Run_Id);",  # (For incremental refreshes.)
+    DERIVED_STATE_SCHEMA,
+    f"CREATE TABLE IF NOT EXISTS {TABLE}_Dirty (Run_Id TEXT PRIMARY KEY) WITHOUT ROWID;",
+    f"CREATE TRIGGER IF NOT EXISTS trg_Results_{TABLE}_upd AFTER UPDATE OF Excluded ON Results "
+    "WHEN OLD.Excluded IS NOT NEW.Excluded BEGIN "
+    f"INSERT OR IGNORE INTO {TABLE}_Dirty (Run_Id) VALUES (NEW.Run_Id); END;",
+    f"CREATE TRIGGER IF NOT EXISTS trg_Runs_{TABLE}_upd AFTER UPDATE OF Blacklist, Range_Mode, Rx_Name, Rs_Name "
+    "ON Runs WHEN OLD.Blacklist IS NOT NEW.Blacklist OR OLD.Range_Mode IS NOT NEW.Range_Mode "
+    "OR OLD.Rx_Name IS NOT NEW.Rx_Name OR OLD.Rs_Name IS NOT NEW.Rs_Name BEGIN "
+    f"INSERT OR IGNORE INTO {TABLE}_Dirty (Run_Id) VALUES (NEW.Run_Id); END;",
+)
+STATE_RESULTS = f'{TABLE}.Results'  # Derived_State names.
+STATE_RES_INFO = f'{TABLE}.Res_Info'
+
+_MEAS_DATE = 'MAX(res.Meas_Date)'  # (The same for all of a measurement's records.)
+_CORR = "(1 + a.Value*(m.T - tr.Value) + COALESCE(g.Value*(m.V - vr.Value), 0))"
+BUILD_QUERY = (
+    f"INSERT OR REPLACE INTO {TABLE} (R_Name, Meas_Day, Run_Id, Meas_No, Rs_Name, Meas_Date, Range_Mode, "
+    "Blacklist, Excluded, T, u_T, V, u_V, R, u_R, DoF_R, R_Corr, u_R_Corr) "
+    "SELECT m.R_Name, m.Meas_Day, m.Run_Id, m.Meas_No, m.Rs_Name, m.Meas_Date, m.Range_Mode, m.Blacklist, "
+    f"m.Excluded, m.T, m.u_T, m.V, m.u_V, m.R, m.u_R, m.DoF_R, m.R/{_CORR}, m.u_R/{_CORR} "
+    "FROM (SELECT ru.Rx_Name AS R_Name, "
+    f"{hr_dates.SQL_DAYS.format(_MEAS_DATE)} AS Meas_Day, res.Run_Id AS Run_Id, res.Meas_No AS Meas_No, "
+    f"ru.Rs_Name AS Rs_Name, {_MEAS_DATE} AS Meas_Date, ru.Range_Mode AS Range_Mode, ru.Blacklist AS Blacklist, "
+    "MAX(res.Excluded) AS Excluded, "  # ('Yes' if any record is excluded.)
+    "MAX(CASE WHEN res.Parameter='T' THEN res.Value END) AS T, "
+    "MAX(CASE WHEN res.Parameter='T' THEN res.Uncert END) AS u_T, "
+    "MAX(CASE WHEN res.Parameter='V' THEN res.Value END) AS V, "
+    "MAX(CASE WHEN res.Parameter='V' THEN res.Uncert END) AS u_V, "
+    "MAX(CASE WHEN res.Parameter='R' THEN res.Value END) AS R, "
+    "MAX(CASE WHEN res.Parameter='R' THEN res.Uncert END) AS u_R, "
+    "MAX(CASE WHEN res.Parameter='R' THEN res.DoF END) AS DoF_R "
+    "FROM Results res JOIN Runs ru ON ru.Run_Id = res.Run_Id {where} "
+    "GROUP BY res.Run_Id, res.Meas_No "
+    "HAVING R IS NOT NULL AND Meas_Day IS NOT NULL AND R_Name IS NOT NULL) m "
+    "LEFT JOIN Res_Info a ON a.R_Name = m.R_Name AND a.Parameter = 'alpha' "
+    "LEFT JOIN Res_Info tr ON tr.R_Name = m.R_Name AND tr.Parameter = 'TRef' "
+    "LEFT JOIN Res_Info g ON g.R_Name = m.R_Name AND g.Parameter = 'gamma' "
+    "LEFT JOIN Res_Info vr ON vr.R_Name = m.R_Name AND vr.Parameter = 'VRef';"
+)
+DIRTY_RUNS_QUERY = ("SELECT Run_Id FROM Results WHERE rowid > ? UNION "
+                    "SELECT Run_Id FROM Runs WHERE Rx_Name IN (SELECT R_Name FROM Res_Info WHERE rowid > ?);")
+RESISTOR_RUNS_QUERY = "SELECT Run_Id FROM Runs WHERE Rx_Name = ?;"
+TREND_QUERY = (f"SELECT Meas_Day, Meas_Date, Run_Id, Meas_No, T, V, R, u_R, R_Corr, u_R_Corr FROM {TABLE} "
+               "WHERE R_Name = ? AND Meas_Day BETWEEN ? AND ? {filter} ORDER BY Meas_Day;")
+VALID_FILTER = ("AND (Excluded IS NULL OR Excluded = 'No') AND (Blacklist IS NULL OR Blacklist = 'No') "
+                "AND Range_Mode = 'FIXED'")  # (As Results_to_Res_Info.get_measurements().)
+
+
+"""
+---------------------------------------
+            Helper functions:
+---------------------------------------
+"""
+
+
+def ensure_tables(db_connection):
+    """Create the Drift_History, Drift_History_Dirty and Derived_State tables (and index, triggers), if missing."""
+    for query in SCHEMA:
+        db_connection.execute(query)
+
+
+def max_rowid(db_connection, table):
+    return db_connection.execute(f"SELECT MAX(rowid) FROM {table};").fetchone()[0] or 0
+
+
+def drift_history(db_connection, R_name, start_day=-1e9, end_day=1e9, valid_only=True):
+    """
+    A resistor's R-vs-time history (one range scan of Drift_History's primary key).
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param R_name: Resistor name
+    :param start_day, end_day: Date range (days since 1970-01-01 - see hr_dates.to_days())
+    :param valid_only: Leave out excluded / blacklisted / non-FIXED-range measurements
+    :return: list of (Meas_Day, Meas_Date, Run_Id, Meas_No, T, V, R, u_R, R_Corr, u_R_Corr) tuples
+    """
+    query = TREND_QUERY.format(filter=VALID_FILTER if valid_only else '')
+    with perf.timer('sql.read'):
+        return db_connection.execute(query, (R_name, start_day, end_day)).fetchall()
+
+
+def refresh_drift_history(db_connection, full=False, run_ids=(), R_names=(), verbose=True):
+    """
+    Rebuild Drift_History rows for the given runs and resistors, runs flagged in
+    Drift_History_Dirty, and any runs with Results (or whose resistor has Res_Info)
+    added since the last refresh - or all runs, if full.
+    The caller should commit (or roll back) afterwards.
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param full: Rebuild the whole table
+    :param run_ids: Runs whose Results have just been written (or re-written)
+    :param R_names: Resistors whose Res_Info has just been written (all their runs are rebuilt)
+    :param verbose: Print progress if True
+    :return: No. of rows written
+    """
+    ensure_tables(db_connection)
+    max_results = max_rowid(db_connection, 'Results')
+    max_res_info = max_rowid(db_connection, 'Res_Info')
+    if not db_connection.in_transaction:
+        db_connection.execute('BEGIN')
+    with perf.timer('sql.drift'):
+        flagged = [row[0] for row in db_connection.execute(f"SELECT Run_Id FROM {TABLE}_Dirty;")]
+        if full:
+            db_connection.execute(f"DELETE FROM {TABLE};")
+            n = db_connection.execute(BUILD_QUERY.format(where='')).rowcount
+        else:
+            since_results = get_state(db_connection, STATE_RESULTS)
+            since_res_info = get_state(db_connection, STATE_RES_INFO)
+            if (max_results <= since_results and max_res_info <= since_res_info and not flagged
+                    and not run_ids and not R_names):
+                if verbose:
+                    print('Drift_History is up to date.')
+                return 0
+            dirty = set(run_ids) | set(flagged)
+            dirty.update(row[0] for row in db_connection.execute(DIRTY_RUNS_QUERY, (since_results, since_res_info)))
+            for R_name in R_names:
+                dirty.update(row[0] for row in db_connection.execute(RESISTOR_RUNS_QUERY, (R_name,)))
+            runs = select_runs(db_connection, dirty, table='Drift_Runs')
+            db_connection.execute(f"DELETE FROM {TABLE} WHERE Run_Id IN ({runs});")
+            n = db_connection.execute(BUILD_QUERY.format(where=f"WHERE res.Run_Id IN ({runs})")).rowcount
+        db_connection.execute(f"DELETE FROM {TABLE}_Dirty;")
+    set_state(db_connection, STATE_RESULTS, max_results)
+    set_state(db_connection, STATE_RES_INFO, max_res_info)
+    perf.count('rows.drift', n)
+    if verbose:
+        print(f"Drift_History: {n} measurements written{' (full rebuild)' if full else f' ({len(dirty)} runs)'}.")
+    return n
+
+
+"""
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    perf.start('Results_to_Drift_History')
+    test = True
+    Q_test_script = input('Test before running properly? (Y/N) >')
+    if Q_test_script.startswith('N'):
+        test = False  # This is NOT a test!
+
+    db_path = input('Full Resistors.db path? (press "d" for default location) >')
+    if db_path == 'd':
+        db_path = r'G:\My Drive\Resistors.db'  # Default location.
+    db_connection = db_connections.connect(db_connections.checkout(db_path))  # (Working copy if HR_WORKING_COPY=1.)
+
+    full = input('Rebuild whole table? (press "Enter" for new / changed runs only) (y/n) >') in ('y', 'Y', 'yes', 'Yes')
+    t0 = time.perf_counter()
+    n = refresh_drift_history(db_connection, full)
+    print(f'Refreshed in {time.perf_counter() - t0:.2f} s.')
+
+    R_name = input("Resistor name, to show its history? (press 'Enter' to skip) >")
+    if R_name:
+        for day, date, run_id, meas_no, T, V, R, u_R, R_corr, u_R_corr in drift_history(db_connection, R_name):
+            print(f'{date}\t{T:.3f}\t{V:.1f}\t{R} +/- {u_R}\t{R_corr}\t{run_id} ({meas_no})')
+
+    # tidy up:
+    if test is False:
+        db_connection.commit()  # Assign all updates to database.
+    else:
+        db_connection.rollback()
+
+    if db_connection:
+        db_connections.close(db_connection, publish=not test and n > 0)  # (Publishes a working copy.)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Rlink_to_Link_Resistance.py - Initial version (Python 3).
+
+Calculate each run's link resistance from its Raw_Rlink_Data readings and store
+it in the (derived) Link_Resistance table.
+
+Each reading is a (dV+, dV-) pair across the link, for the two source polarities:
+    dV = (dV+ - dV-)/2
+The link current is that of R1 and R2 in series, with |V1| and |V2| applied:
+    I = (absV1 + absV2)/(R1 + R2)
+where R1, R2 are the nominal values of the run's Rx and Rs (from the '<name> <value>'
+naming convention, e.g. 'HR9103 10M' -> 1e7). Then
+    Rlink = mean(dV)/I,  u(Rlink) = sd(dV)/sqrt(N)/I,  dof = N - 1
+for the N valid readings of a run. (Rlink is NULL if a nominal value isn't known;
+the dV statistics are still stored. With fewer than 2 readings, u(Rlink) and dof are NULL.)
+
+All readings of all runs are processed in one grouped pass (NumPy). Refreshes are
+incremental: Derived_State (see db_writer.get_state()) keeps the highest Raw_Rlink_Data
+rowid seen, and only runs with newer rows (added or re-ingested since - INSERT OR
+REPLACE gives new rowids) are recalculated. A full refresh recalculates every run.
+"""
+
+import re
+import time
+
+import numpy as np
+
+import db_connections
+import perf
+from db_writer import BatchWriter, DERIVED_STATE_SCHEMA, get_state, select_runs, set_state
+
+
+TABLE = 'Link_Resistance'
+SCHEMA = (
+    f"CREATE TABLE IF NOT EXISTS {TABLE} (Run_Id TEXT PRIMARY KEY, N_Readings INTEGER, absV1 REAL, absV2 REAL, "
+    "dV REAL, u_dV REAL, Rlink REAL, Uncert REAL, DoF REAL, Updated TEXT);",
+    DERIVED_STATE_SCHEMA,
+)
+LINK_QUERY = (f"INSERT OR REPLACE INTO {TABLE} "
+              "(Run_Id,N_Readings,absV1,absV2,dV,u_dV,Rlink,Uncert,DoF,Updated) "
+              "VALUES (?,?,?,?,?,?,?,?,?,datetime('now','localtime'));")
+READINGS_QUERY = ("SELECT l.Run_Id, l.absV1, l.absV2, l.deltaVpos, l.deltaVneg, r.Rx_Name, r.Rs_Name "
+                  "FROM Raw_Rlink_Data l LEFT JOIN Runs r ON r.Run_Id = l.Run_Id {where} "
+                  "ORDER BY l.Run_Id, l.Reading_No;")
+INF_DOF = 1e6  # dof stored for infinite dof (as HRBA_Results_to_db.py).
+MULTIPLIERS = {'': 1.0, 'R': 1.0, 'k': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+
+
+"""
+---------------------------------------
+            Helper functions:
+---------------------------------------
+"""
+
+
+def ensure_tables(db_connection):
+    """Create the Link_Resistance and Derived_State tables, if missing."""
+    for query in SCHEMA:
+        db_connection.execute(query)
+
+
+def nominal_value(R_name):
+    """
+    Nominal resistance from a '<name> <value>' resistor name, e.g. 'HR9103 10M' -> 1e7.
+    :return: float, or nan if the name doesn't end with a value
+    """
+    match = re.search(r'\s(\d+(?:\.\d+)?)\s*([RkMGT]?)$', R_name or '')
+    if match is None:
+        return np.nan
+    return float(match.group(1))*MULTIPLIERS[match.group(2)]
+
+
+def runs_to_refresh(db_connection, since_rowid=0):
+    """Run_Ids with Raw_Rlink_Data rows newer than since_rowid."""
+    q = "SELECT DISTINCT Run_Id FROM Raw_Rlink_Data WHERE rowid > ?;"
+    return [row[0] for row in db_connection.execute(q, (since_rowid,))]
+
+
+"""
+---------------------------------------
+            Calculation:
+---------------------------------------
+"""
+
+
+def link_resistance(run_ids, absV1, absV2, dV_pos, dV_neg, R_sum):
+    """
+    Link resistance of every run, in one grouped pass.
+    :param run_ids: Run_Id of each reading (grouped - all readings of a run together)
+    :param absV1, absV2, dV_pos, dV_neg: Arrays, one element per reading (nan for NULL)
+    :param R_sum: Array of R1 + R2 (nominal) per reading
+    :return: (list of Run_Ids, dict of per-run arrays 'N', 'absV1', 'absV2', 'dV', 'u_dV', 'Rlink', 'Uncert', 'DoF')
+    """
+    ids = np.array(run_ids, dtype=object)
+    if len(ids) == 0:
+        return [], {k: np.zeros(0) for k in ('N', 'absV1', 'absV2', 'dV', 'u_dV', 'Rlink', 'Uncert', 'DoF')}
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    group = np.cumsum(np.r_[False, ids[1:] != ids[:-1]])  # Group no. of each reading.
+
+    dV = (dV_pos - dV_neg)/2
+    valid = np.isfinite(dV)
+    N = np.add.reduceat(valid.astype(float), starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.add.reduceat(np.where(valid, dV, 0.0), starts)/N
+        dev = np.where(valid, dV - mean[group], 0.0)  # (Two-pass variance - dV's sd is tiny compared to dV.)
+        sd = np.sqrt(np.add.reduceat(dev**2, starts)/(N - 1))
+        u_dV = sd/np.sqrt(N)
+        current = (np.abs(absV1[starts]) + np.abs(absV2[starts]))/R_sum[starts]
+        Rlink = mean/current
+        uncert = u_dV/current
+    dof = np.where(N > 1, N - 1, np.nan)
+    return list(ids[starts]), {'N': N, 'absV1': absV1[starts], 'absV2': absV2[starts], 'dV': mean,
+                               'u_dV': u_dV, 'Rlink': Rlink, 'Uncert': uncert, 'DoF': dof}
+
+
+def read_readings(db_connection, run_ids=None):
+    """
+    Read Raw_Rlink_Data (with nominal R1 + R2 of each run), grouped by run.
+    :return: (run_ids list, absV1, absV2, dV_pos, dV_neg, R_sum) - float arrays, one element per reading
+    """
+    where = f"WHERE l.Run_Id IN ({select_runs(db_connection, run_ids)})" if run_ids is not None else ''
+    with perf.timer('sql.read'):
+        rows = db_connection.execute(READINGS_QUERY.format(where=where)).fetchall()
+    if not rows:
+        return [], *(np.zeros(0) for _ in range(5))
+    ids, v1, v2, pos, neg, rx, rs = zip(*rows)
+    nominal = {name: nominal_value(name) for name in set(rx) | set(rs)}
+    R_sum = np.array([nominal[a] + nominal[b] for a, b in zip(rx, rs)])
+    return (list(ids), np.array(v1, dtype=float), np.array(v2, dtype=float),
+            np.array(pos, dtype=float), np.array(neg, dtype=float), R_sum)
+
+
+def to_db(value):
+    """Array element -> database value (nan -> NULL)."""
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def refresh_link_resistance(db_connection, full=False, verbose=True):
+    """
+    Recalculate Link_Resistance for runs with new Raw_Rlink_Data (or all runs, if full).
+    The caller should commit (or roll back) afterwards.
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param full: Recalculate every run
+    :param verbose: Print progress if True
+    :return: No. of runs written
+    """
+    ensure_tables(db_connection)
+    max_rowid = db_connection.execute("SELECT MAX(rowid) FROM Raw_Rlink_Data;").fetchone()[0] or 0
+    since = 0 if full else get_state(db_connection, TABLE)
+    if max_rowid <= since:
+        if verbose:
+            print('Link_Resistance is up to date.')
+        return 0
+    run_ids = None if full else runs_to_refresh(db_connection, since)
+    if verbose:
+        print(f"Recalculating {'all runs' if full else f'{len(run_ids)} runs'}...")
+
+    with perf.timer('analysis.rlink'):
+        ids, stats = link_resistance(*read_readings(db_connection, run_ids))
+    dofs = np.where(np.isnan(stats['DoF']), np.nan, np.minimum(stats['DoF'], INF_DOF))  # (NaN -> NULL.)
+    records = zip(ids, stats['N'].astype(int).tolist(), *(map(to_db, stats[k]) for k in
+                  ('absV1', 'absV2', 'dV', 'u_dV', 'Rlink', 'Uncert')), map(to_db, dofs))
+    writer = BatchWriter(db_connection)
+    if full:
+        writer.begin()
+        db_connection.execute(f"DELETE FROM {TABLE};")  # (Including runs no longer in Raw_Rlink_Data.)
+    writer.add_many(LINK_QUERY, list(records))
+    writer.flush()
+    set_state(db_connection, TABLE, max_rowid)
+    perf.count('runs.rlink', len(ids))
+    n_no_rlink = int(np.sum(~np.isfinite(stats['Rlink'])))
+    if verbose and n_no_rlink:
+        print(f'{n_no_rlink} runs without Rlink (unknown nominal values, or < 2 readings).')
+    return len(ids)
+
+
+"""
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    perf.start('Rlink_to_Link_Resistance')
+    test = True
+    Q_test_script = input('Test before running properly? (Y/N) >')
+    if Q_test_script.startswith('N'):
+        test = False  # This is NOT a test!
+
+    db_path = input('Full Resistors.db path? (press "d" for default location) >')
+    if db_path == 'd':
+        db_path = r'G:\My Drive\Resistors.db'  # Default location.
+    db_connection = db_connections.connect(db_connections.checkout(db_path))  # (Working copy if HR_WORKING_COPY=1.)
+
+    full = input('Recalculate all runs? (press "Enter" for new runs only) (y/n) >') in ('y', 'Y', 'yes', 'Yes')
+
+    t0 = time.perf_counter()
+    n = refresh_link_resistance(db_connection, full)
+    print(f'Wrote link resistance of {n} runs in {time.perf_counter() - t0:.2f} s.')
+
+    # tidy up:
+    if test is False:
+        db_connection.commit()  # Assign all updates to database.
+    else:
+        db_connection.rollback()
+
+    if db_connection:
+        db_connections.close(db_connection, publish=not test and n > 0)  # (Publishes a working copy.)
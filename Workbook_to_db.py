@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Workbook_to_db.py - Initial version (Python 3).
+
+Single-pass ingest of an HRBC / HRBA Excel file.
+
+Replaces running HRBC_raw_data_to_db.py, HRBA_Results_to_db.py,
+Add_ExpU_to_Results.py and Add_date_to_Runs.py one after another:
+The workbook is loaded once and its 'Data', 'Rlink' and 'Results' sheets
+are all parsed from that one copy (or streamed). ExpU/k (Results) and
+Meas_Date (Runs) are then filled in for the new or modified runs only,
+and everything is committed in a single transaction.
+"""
+
+import pylightxl as xl
+
+import HRBC_raw_data_to_db as hrbc
+import HRBA_Results_to_db as hrba
+from Add_ExpU_to_Results import fill_expu_k
+from Add_date_to_Runs import add_dates
+import db_connections
+from db_writer import BatchWriter
+from ingest_manifest import Manifest
+import perf
+from Results_to_Drift_History import refresh_drift_history
+import xlsx_stream
+
+
+SHEETS = ('Data', 'Rlink', 'Results')
+
+
+def ingest_workbook(db_connection, xl_file, is_singledvm, streaming=False, force=False, verbose=True):
+    """
+    Parse all HRBC / HRBA sheets of a workbook and write them to Resistors.db.
+    The caller should commit (or roll back) afterwards.
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param xl_file: Full XL path/filename
+    :param is_singledvm: True for single-DVM data (no 'Rlink' sheet or Raw_Data records)
+    :param streaming: Stream sheets with xlsx_stream, rather than loading them with pylightxl
+    :param force: Re-ingest all runs, even if unchanged since the last ingest
+    :param verbose: Print progress if True
+    :return: ingest_manifest.Manifest (its 'touched' attribute lists the runs written per sheet)
+    """
+    # Only parse sheets that exist (and have changed):
+    present = xlsx_stream.StreamWorkbook(xl_file).ws_names()
+    manifest = Manifest(db_connection, xl_file, force)
+    sheets = [s for s in SHEETS if s in present and not (s == 'Rlink' and is_singledvm)]
+    sheets = [s for s in sheets if force or not manifest.is_unchanged((s,))]
+    if not sheets:
+        return manifest
+
+    # Load workbook just once:
+    with perf.timer('xl.read'):
+        if streaming:
+            wb = xlsx_stream.readxl(xl_file, sheets)
+        else:
+            wb = xl.readxl(xl_file, sheets)
+
+    writer = BatchWriter(db_connection)
+    parsers = {'Data': lambda rows: hrbc.parse_data_sheet(rows, is_singledvm, xl_file, verbose),
+               'Rlink': lambda rows: hrbc.parse_rlink_sheet(rows, verbose),
+               'Results': lambda rows: hrba.parse_results_sheet(rows, verbose)}
+    for sheet in sheets:  # (In SHEETS order, so Runs records exist before 'Results' updates them.)
+        records = perf.timed_iter(f'parse.{sheet}', parsers[sheet](wb.ws(sheet).rows))
+        writer.add_records(manifest.changed(sheet, records))
+        manifest.record(writer, sheet)
+        writer.flush()
+
+    # Post-processing, for just the runs written above:
+    if 'Results' in manifest.touched:
+        fill_expu_k(db_connection, manifest.touched['Results'])
+    all_touched = set().union(*manifest.touched.values())
+    if all_touched:
+        add_dates(db_connection, all_touched)
+        refresh_drift_history(db_connection, run_ids=all_touched, verbose=verbose)
+    return manifest
+
+
+"""
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    perf.start('Workbook_to_db')
+    db_connection = hrbc.db_connect()
+
+    test = True
+    response = input('Is this just a test (Y/N)? >')
+    if response.startswith('N'):
+        test = False
+
+    xl_file, is_singledvm, streaming = hrbc.xl_prompt()
+    force = input('Re-ingest runs that are unchanged since last ingest? (y/n)?') in ('y', 'Y', 'yes', 'Yes')
+
+    manifest = ingest_workbook(db_connection, xl_file, is_singledvm, streaming, force, verbose=not perf.quiet())
+    print('\n---------------------------------------------------------------------------------------------------\n')
+    if manifest.touched:
+        for sheet, runs in manifest.touched.items():
+            print(f"'{sheet}': wrote {len(runs)} new or modified runs.")
+    else:
+        print('Workbook unchanged since last ingest - nothing to do.')
+
+    # tidy up:
+    if test is False:
+        print('\nCommitting changes to db...')
+        db_connection.commit()  # Assign all updates to database.
+    else:
+        db_connection.rollback()
+
+    if db_connection:
+        db_connections.close(db_connection, publish=not test)  # (Publishes a working copy - see db_connections.py.)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+bench.py - Initial version (Python 3).
+
+Benchmark suite, on synthetic workloads (see synth_data.py).
+
+Measures:
+    * parse - HRBA_Results_to_db.parse_results() alone (no database): rows/s,
+    * ingest - Workbook_to_db.ingest_workbook() of a synthetic HRBC workbook into an
+      empty database, loaded whole (pylightxl) and streamed (xlsx_stream): rows/s,
+      with the per-stage breakdown from perf.py,
+    * fit - Results_to_Res_Info.fit_res_info() time per resistor (all results),
+    * value - Get_Todays_Value look-up latency (Res_Info read + evaluation, with an
+      empty ureal cache) and batch_predict() throughput.
+Each run's results are appended (one JSON object per line) to a results file,
+along with the scale, git revision and platform, and compared with the previous
+result at the same scale - changes beyond THRESHOLD are flagged.
+"""
+
+import datetime as dt
+import json
+import os
+import platform
+import shutil
+import db_connections
+import statistics
+import subprocess
+import tempfile
+import time
+
+import perf
+import synth_data
+from HRBA_Results_to_db import parse_results
+from Get_Todays_Value import batch_predict, date_to_days, todays_value
+from Results_to_Res_Info import fit_res_info, read_book_values, RES_INFO_QUERY
+from ureal_cache import clear_cache
+from Workbook_to_db import ingest_workbook
+
+
+# Workload scales: (resistors, runs per resistor, measurements per run, Rlink readings per run)
+SCALES = {'small': (4, 6, 4, 5), 'medium': (20, 25, 4, 10), 'large': (100, 50, 6, 20)}
+RESULTS_FILE = 'bench_results.jsonl'
+THRESHOLD = 0.1  # Relative change flagged as a regression / improvement.
+N_LOOKUPS = 200  # Single-value look-ups timed per run.
+
+
+"""
+---------------------------------------
+            Benchmarks:
+---------------------------------------
+"""
+
+
+def bench_parse(sheets, repeats=5):
+    """
+    Parse the 'Results' sheet into typed records (best of repeats) - parser only, no database.
+    :return: dict of metrics (rows/s, elapsed s, records yielded)
+    """
+    rows = sheets['Results']
+    best = float('inf')
+    n_records = 0
+    for _ in range(repeats):
+        t_start = time.perf_counter()
+        n_records = sum(1 for _ in parse_results(rows))
+        best = min(best, time.perf_counter() - t_start)
+    return {'rows_per_s': len(rows)/best, 'elapsed_s': best, 'records': n_records}
+
+
+def bench_ingest(work_dir, xl_file, streaming):
+    """
+    Ingest a workbook into a new, empty database.
+    :return: dict of metrics (rows/s, elapsed s, rows written, perf.py stage timings)
+    """
+    db_path = os.path.join(work_dir, f"ingest_{'stream' if streaming else 'load'}.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db_connection = db_connections.connect(db_path)
+    for query in synth_data.SCHEMA:
+        db_connection.execute(query)
+    db_connection.commit()
+
+    perf.reset()
+    t_start = time.perf_counter()
+    ingest_workbook(db_connection, xl_file, False, streaming, force=True, verbose=False)
+    db_connection.commit()
+    elapsed = time.perf_counter() - t_start
+    db_connection.close()
+    summ = perf.summary()
+    n_rows = summ['counters'].get('rows.written', 0)
+    return {'rows_per_s': n_rows/elapsed, 'elapsed_s': elapsed, 'rows': n_rows,
+            'stages_s': {name: t['total_s'] for name, t in summ['timers'].items()}}
+
+
+def bench_fit(db_path):
+    """
+    Fit every resistor (all results) and write its Res_Info records.
+    :return: dict of metrics (fit time per resistor: mean, median, max [s]), resistor names
+    """
+    db_connection = db_connections.connect(db_path)
+    curs = db_connection.cursor()
+    names = [row[0] for row in curs.execute("SELECT DISTINCT Rx_Name FROM Runs ORDER BY Rx_Name;").fetchall()]
+    clear_cache()
+    times = []
+    for name in names:
+        t_start = time.perf_counter()
+        res_info = fit_res_info(curs, name, verbose=False)
+        times.append(time.perf_counter() - t_start)
+        curs.executemany(RES_INFO_QUERY, res_info)
+    db_connection.commit()
+    db_connection.close()
+    return {'per_resistor_mean_s': statistics.fmean(times), 'per_resistor_median_s': statistics.median(times),
+            'per_resistor_max_s': max(times), 'resistors': len(names)}, names
+
+
+def bench_value(db_path, names, n_lookups=N_LOOKUPS):
+    """
+    Time single-value look-ups (as Get_Todays_Value.py) and one batch_predict() of n_lookups rows.
+    :return: dict of metrics (look-up latency [ms]: mean, median, p95; batch rows/s)
+    """
+    db_connection = db_connections.connect(db_path)
+    curs = db_connection.cursor()
+    t_days = date_to_days('2020-01-01 00:00:00')
+    latencies = []
+    for i in range(n_lookups):
+        clear_cache()  # Cold look-up: Res_Info read and thawed every time.
+        t_start = time.perf_counter()
+        book = read_book_values(curs, names[i % len(names)])
+        todays_value(book, synth_data.T_REF, synth_data.TEST_VS[0], t_days)
+        latencies.append(1000*(time.perf_counter() - t_start))
+    latencies.sort()
+
+    rows = [{'R_name': names[i % len(names)], 'T': f'{synth_data.T_REF} 0.01 8', 'V': '10 0.001 8',
+             'Date': '2020-01-01 00:00:00'} for i in range(n_lookups)]
+    clear_cache()
+    t_start = time.perf_counter()
+    batch_predict(curs, rows, exact=False)
+    batch_t = time.perf_counter() - t_start
+    db_connection.close()
+    return {'lookup_mean_ms': statistics.fmean(latencies), 'lookup_median_ms': statistics.median(latencies),
+            'lookup_p95_ms': latencies[min(len(latencies) - 1, int(0.95*len(latencies)))],
+            'batch_rows_per_s': n_lookups/batch_t}
+
+
+def run_benchmarks(scale, work_dir, seed=0):
+    """
+    Generate a workload at one of SCALES and run all benchmarks on it.
+    :return: result dict (JSON-serialisable)
+    """
+    n_resistors, n_runs, n_meas, n_readings = SCALES[scale]
+    sheets = synth_data.workload(n_resistors, n_runs, n_meas, n_readings, seed)
+    xl_file = os.path.join(work_dir, f'synthetic_{scale}.xlsx')
+    synth_data.write_workbook(xl_file, sheets)
+
+    result = {'scale': scale, 'seed': seed, 'date': dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+              'revision': git_revision(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'sheet_rows': {name: len(rows) for name, rows in sheets.items()}}
+    print(f'Parse ({scale})...')
+    result['parse'] = bench_parse(sheets)
+    print(f'Ingest ({scale})...')
+    result['ingest_load'] = bench_ingest(work_dir, xl_file, streaming=False)
+    result['ingest_stream'] = bench_ingest(work_dir, xl_file, streaming=True)
+
+    print('Fit...')
+    db_path = os.path.join(work_dir, f'synthetic_{scale}.db')
+    shutil.copyfile(os.path.join(work_dir, 'ingest_load.db'), db_path)
+    result['fit'], names = bench_fit(db_path)
+
+    print('Value look-up...')
+    result['value'] = bench_value(db_path, names)
+    return result
+
+
+"""
+---------------------------------------
+            Results:
+---------------------------------------
+"""
+
+
+def git_revision():
+    """Short git revision of this working copy ('' if unavailable), with '+' if it has local changes."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    return rev + ('+' if dirty else '')
+
+
+def save_result(result, path=RESULTS_FILE):
+    """Append a result to the results file (one JSON object per line)."""
+    with open(path, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+
+def load_results(path=RESULTS_FILE):
+    """All results in the results file (oldest first)."""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def metrics(result):
+    """Flatten a result's benchmark metrics: {'group.metric': value}."""
+    flat = {}
+    for group in ('parse', 'ingest_load', 'ingest_stream', 'fit', 'value'):
+        for name, val in result.get(group, {}).items():
+            if isinstance(val, (int, float)):
+                flat[f'{group}.{name}'] = val
+    return flat
+
+
+def compare(previous, current, threshold=THRESHOLD):
+    """
+    Compare two results' metrics.
+    Rates ('..._per_s') are better when higher; times ('..._s', '..._ms') when lower.
+    :return: list of (metric, previous, current, relative change, verdict), verdict is
+    'regression', 'improvement' or '' (within threshold)
+    """
+    prev = metrics(previous)
+    rows = []
+    for name, val in metrics(current).items():
+        if name not in prev or not prev[name] or not name.endswith(('_s', '_ms')):
+            continue
+        change = (val - prev[name])/prev[name]
+        better = change > 0 if name.endswith('_per_s') else change < 0
+        verdict = '' if abs(change) <= threshold else ('improvement' if better else 'regression')
+        rows.append((name, prev[name], val, change, verdict))
+    return rows
+
+
+"""
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    scale = input(f"Scale? ({', '.join(SCALES)}; press 'Enter' for 'small') >") or 'small'
+    assert scale in SCALES, 'Error - Invalid scale!'
+    results_file = input(f'Results file? (press "Enter" for {RESULTS_FILE}) >') or RESULTS_FILE
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        result = run_benchmarks(scale, work_dir)
+
+    print('\n---------------------------------------------------------------------------------------------------\n')
+    for name, val in metrics(result).items():
+        print(f'{name:40s}{val:14.4g}')
+
+    previous = [r for r in load_results(results_file) if r.get('scale') == scale]
+    if previous:
+        print(f"\nCompared with {previous[-1]['date']} ({previous[-1]['revision'] or 'unknown revision'}):")
+        for name, prev, val, change, verdict in compare(previous[-1], result):
+            print(f'{name:40s}{prev:14.4g}{val:14.4g}{100*change:+9.1f} %  {verdict}')
+    save_result(result, results_file)
+    print(f'\nResult appended to {results_file}.')
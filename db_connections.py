@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+db_connections.py - Initial version (Python 3).
+
+Shared connection layer for Resistors.db.
+
+Every connection gets a busy timeout and the PRAGMAS below. The default journal
+mode is SQLite's rollback journal, as the shared Resistors.db lives on a synced
+drive (G:\My Drive): a sync client can upload the main file without its -wal and
+-shm files, so other PCs would get stale or torn copies, and WAL's shared memory
+doesn't work across machines anyway. Writable connections switch a database left
+in WAL mode back to the rollback journal (if no one else has it open).
+
+With HR_DB_WAL=1 - only for a database on local disk (e.g. a working copy, below) -
+writable connections switch it to WAL (write-ahead log) instead. Then readers see
+the last committed state and never wait on a writer, so look-ups keep working
+while an ingest or a Res_Info refit holds its write transaction open. (In either
+mode, writers queue behind each other - up to the busy timeout.)
+
+    db_connection = connect(db_path)                  # Read / write.
+    db_connection = connect(db_path, read_only=True)  # Look-ups.
+
+    pool = ReaderPool(db_path)           # Read-only connections, shared between threads:
+    with pool.connection() as conn:
+        ...
+
+    with WriterQueue(db_path) as writer:  # One writer thread - all writes in submission order:
+        writer.submit(fn, *args)          # Runs fn(db_connection, *args) on the writer thread.
+        writer.commit()
+
+Res_Value_Server answers look-ups from a ReaderPool. Res_Info_batch writes through a
+WriterQueue (its worker processes only read), so its fits don't contend for the
+write lock. The other (single-threaded) scripts have just one writer each - their
+own connection - and write to it directly.
+
+Working copies - for a database on a synced / network drive, where every page read
+and fsync pays the network's latency. With HR_WORKING_COPY=1, checkout() copies
+the database (with SQLite's backup API) to local disk and returns the copy's path;
+the job then runs at local-disk speed, and checkin() publishes the result back:
+    db_path = checkout(db_path)  # (Unchanged if HR_WORKING_COPY isn't set.)
+    ...
+    checkin(db_path, publish=not test)  # (After closing all connections to it.)
+Publishing copies the working copy back into the shared file with the backup API,
+as one ordinary write transaction: other readers (e.g. Res_Value_Server) see either
+the old or the new database, never a mixture, and see the change (PRAGMA
+data_version) as they would any commit. But only if the shared file hasn't changed
+since checkout: if its size or mtime differ, a fresh copy of it is compared (SHA-1)
+with the checked-out one - so only then is it read in full. Otherwise
+PublishConflict is raised and the working copy is kept, for the changes to be
+re-applied by hand.
+The shared file must be in rollback-journal mode (the default - see above).
+"""
+
+import concurrent.futures as cf
+import contextlib
+import hashlib
+import os
+import pathlib
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+import perf
+
+
+WAL_ENV = 'HR_DB_WAL'
+WORKING_COPY_ENV = 'HR_WORKING_COPY'
+WORKING_DIR_ENV = 'HR_WORKING_DIR'  # Where working copies are made (default: system temp. directory).
+BUSY_TIMEOUT = 30.0  # [s] - how long to wait for another writer's lock before 'database is locked'.
+PRAGMAS = (('cache_size', -64000),  # 64 MB page cache (negative values are in kB).
+           ('mmap_size', 256*1024*1024),  # Memory-map up to 256 MB of the file for reads.
+           ('temp_store', 'MEMORY'))
+POOL_SIZE = 4  # Default max. no. of ReaderPool connections.
+
+
+def use_wal():
+    """True if WAL is switched on with HR_DB_WAL=1 (for a database on local disk only)."""
+    return os.environ.get(WAL_ENV, '0') not in ('', '0')
+
+
+def db_uri(db_path, read_only=False):
+    """URI for a database file (mode=ro if read_only)."""
+    uri = pathlib.Path(db_path).absolute().as_uri()
+    return uri + '?mode=ro' if read_only else uri
+
+
+def configure(db_connection):
+    """Apply PRAGMAS to a connection."""
+    for name, value in PRAGMAS:
+        db_connection.execute(f'PRAGMA {name} = {value};')
+
+
+def set_journal_mode(db_connection, wal=True):
+    """
+    Switch the database to WAL (or back to the rollback journal), and set synchronous to
+    match: NORMAL is safe in WAL mode, but the rollback journal needs FULL to be safe
+    against corruption on a power cut.
+    :return: journal mode now in force (e.g. 'wal', 'delete' or 'memory')
+    """
+    mode = 'WAL' if wal else 'DELETE'
+    try:
+        mode = db_connection.execute(f'PRAGMA journal_mode = {mode};').fetchone()[0]
+    except sqlite3.OperationalError:  # (Leaving WAL needs the only connection - keep WAL for now.)
+        mode = db_connection.execute('PRAGMA journal_mode;').fetchone()[0]
+    db_connection.execute(f"PRAGMA synchronous = {'NORMAL' if mode == 'wal' else 'FULL'};")
+    return mode
+
+
+def connect(db_path, read_only=False, wal=None, **kwargs):
+    """
+    Open a configured connection to Resistors.db.
+    :param db_path: Full Resistors.db path (or ':memory:')
+    :param read_only: Open with mode=ro (look-ups) - no journal-mode change
+    :param wal: Journal mode for writable connections - WAL if True, the rollback journal if False.
+        Default: use_wal() (i.e. the rollback journal unless HR_DB_WAL=1)
+    :param kwargs: Passed to sqlite3.connect() (e.g. isolation_level, check_same_thread)
+    :return: sqlite3 connection
+    """
+    kwargs.setdefault('timeout', BUSY_TIMEOUT)
+    if db_path == ':memory:':
+        db_connection = sqlite3.connect(db_path, **kwargs)
+    else:
+        db_connection = sqlite3.connect(db_uri(db_path, read_only), uri=True, **kwargs)
+    configure(db_connection)
+    if not read_only and db_path != ':memory:':
+        set_journal_mode(db_connection, use_wal() if wal is None else wal)
+    return db_connection
+
+
+class ReaderPool:
+    """
+    Read-only connections, re-used between look-ups (and threads).
+    At most size connections are open; connection() waits for a free one.
+    """
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = max(int(size), 1)
+        self.idle = queue.LifoQueue()  # (Most recently used first - its cache is warmest.)
+        self.n_open = 0
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Context manager lending a read-only connection."""
+        db_connection = self._acquire()
+        try:
+            yield db_connection
+        finally:
+            if db_connection.in_transaction:
+                db_connection.rollback()
+            self.idle.put(db_connection)
+
+    def _acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.n_open < self.size:
+                self.n_open += 1
+                return connect(self.db_path, read_only=True, check_same_thread=False)
+        return self.idle.get()
+
+    def close(self):
+        """Close all idle connections (call when no connections are lent out)."""
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.n_open -= 1
+
+
+class WriterQueue:
+    """
+    A single writer thread, holding the only writable connection.
+    Jobs (fn(db_connection, *args)) run one at a time, in submission order, and
+    return concurrent.futures.Future objects. Nothing is committed unless asked -
+    and commit() refuses (raising the first error) if any job since the last
+    commit / rollback failed, so un-awaited writes can't fail silently.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db_path, **kwargs):
+        """
+        :param db_path: Full Resistors.db path
+        :param kwargs: Passed to connect()
+        """
+        self.jobs = queue.Queue()
+        self.db_connection = None
+        self.errors = []  # Failed jobs' exceptions, since the last commit / rollback.
+        ready = cf.Future()
+        self.thread = threading.Thread(target=self._run, args=(db_path, kwargs, ready),
+                                       name='db-writer', daemon=True)
+        self.thread.start()
+        ready.result()  # (Re-raises any connection error here.)
+
+    def _run(self, db_path, kwargs, ready):
+        try:
+            self.db_connection = connect(db_path, **kwargs)
+        except Exception as err:
+            ready.set_exception(err)
+            return
+        ready.set_result(True)
+        while True:
+            job = self.jobs.get()
+            if job is self._STOP:
+                break
+            fn, args, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(self.db_connection, *args))
+            except BaseException as err:
+                self.errors.append(err)
+                future.set_exception(err)
+        self.db_connection.close()  # (Rolls back anything uncommitted.)
+
+    def submit(self, fn, *args):
+        """
+        Queue fn(db_connection, *args) to run on the writer thread.
+        :return: Future (its result is fn's return value)
+        """
+        future = cf.Future()
+        self.jobs.put((fn, args, future))
+        return future
+
+    def execute(self, query, values=()):
+        """Queue one query."""
+        return self.submit(_execute, query, values)
+
+    def executemany(self, query, rows):
+        """Queue one query, for many rows."""
+        return self.submit(_executemany, query, list(rows))
+
+    def commit(self):
+        """Commit everything written so far (waits for it). Raises the first error if a job failed."""
+        return self.submit(self._commit).result()
+
+    def rollback(self):
+        """Discard everything written since the last commit (waits for it)."""
+        return self.submit(self._rollback).result()
+
+    def _commit(self, db_connection):
+        if self.errors:
+            err = self.errors[0]
+            raise RuntimeError(f'Not committed - {len(self.errors)} write(s) failed, first: {err!r}') from err
+        with perf.timer('sql.commit'):
+            db_connection.commit()
+
+    def _rollback(self, db_connection):
+        self.errors.clear()
+        db_connection.rollback()
+
+    def close(self):
+        """Finish queued jobs, then close the connection (uncommitted changes are rolled back)."""
+        if self.thread.is_alive():
+            self.jobs.put(self._STOP)
+            self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+def _execute(db_connection, query, values):
+    with perf.timer('sql.write'):
+        db_connection.execute(query, values)
+
+
+def _executemany(db_connection, query, rows):
+    with perf.timer('sql.write'):
+        db_connection.executemany(query, rows)
+    perf.count('rows.written', len(rows))
+
+
+"""
+---------------------------------------
+            Working copies:
+---------------------------------------
+"""
+
+
+class PublishConflict(Exception):
+    """The shared database changed after its working copy was checked out."""
+
+
+def use_working_copy():
+    """True if HR_WORKING_COPY is set (and not '0')."""
+    return os.environ.get(WORKING_COPY_ENV, '0') not in ('', '0')
+
+
+def file_stat(path):
+    """(size, mtime in ns) of a file - (0, 0) if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 0, 0
+    return st.st_size, st.st_mtime_ns
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-1 hex digest of a file's contents."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def backup(src_path, dest_path, src_read_only=True):
+    """
+    Copy a database with SQLite's backup API - a consistent snapshot, even if
+    another connection is writing. dest_path is left in rollback-journal mode.
+    """
+    src = connect(src_path, read_only=src_read_only)
+    dest = sqlite3.connect(dest_path)
+    try:
+        src.backup(dest)
+        dest.execute('PRAGMA journal_mode = DELETE;')
+    finally:
+        dest.close()
+        src.close()
+
+
+class WorkingCopy:
+    """A local copy of a shared database, to be published back (or discarded) when done."""
+
+    def __init__(self, db_path, work_dir=None):
+        self.db_path = os.path.abspath(db_path)
+        self.work_dir = tempfile.mkdtemp(prefix='hr_wc_', dir=work_dir or os.environ.get(WORKING_DIR_ENV))
+        self.path = os.path.join(self.work_dir, os.path.basename(self.db_path))
+        self.stat = None  # Shared file's (size, mtime) at checkout...
+        self.hash = None  # ... and the hash of its copy (backup() copies are byte-for-byte repeatable).
+
+    def checkout(self, retries=3):
+        """
+        Copy the shared database to local disk.
+        :return: Path of the working copy
+        """
+        for _ in range(retries):
+            stat = file_stat(self.db_path)
+            with perf.timer('wc.checkout'):
+                backup(self.db_path, self.path)
+            if file_stat(self.db_path) == stat:  # (Not written to during the copy.)
+                self.stat = stat
+                self.hash = file_hash(self.path)  # (Local - cheap.)
+                return self.path
+        raise PublishConflict(f'{self.db_path} kept changing during checkout - try again later.')
+
+    def check(self):
+        """
+        Raise PublishConflict if the shared database has changed since checkout.
+        Unchanged size and mtime means unchanged; otherwise (e.g. a sync client re-wrote
+        it) a fresh copy's hash is compared with the checked-out one.
+        """
+        if file_stat(self.db_path + '-wal')[0] > 0:
+            raise PublishConflict(f'{self.db_path} has uncheckpointed WAL changes (in use elsewhere?).')
+        if file_stat(self.db_path) == self.stat:
+            return
+        check_path = self.path + '.check'
+        try:
+            with perf.timer('wc.check'):
+                backup(self.db_path, check_path)
+                changed = file_hash(check_path) != self.hash
+        finally:
+            if os.path.exists(check_path):
+                os.remove(check_path)
+        if changed:
+            raise PublishConflict(f'{self.db_path} has changed since checkout.')
+
+    def publish(self):
+        """
+        Copy the working copy into the shared database (one write transaction, with the
+        backup API), if the shared one is unchanged (see check()). On a conflict, the
+        working copy is kept (at self.path).
+        """
+        try:
+            self.check()
+            with perf.timer('wc.publish'):
+                src = connect(self.path, read_only=True)
+                dest = connect(self.db_path, wal=False)
+                try:
+                    src.backup(dest)
+                    set_journal_mode(dest, wal=False)  # (In case the working copy was in WAL mode.)
+                finally:
+                    dest.close()
+                    src.close()
+        except (PublishConflict, sqlite3.Error, OSError) as err:
+            raise PublishConflict(f'{err} Not published - working copy kept at {self.path}') from err
+        self.discard()
+
+    def discard(self):
+        """Delete the working copy."""
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+_working_copies = {}  # {working-copy path: WorkingCopy}
+
+
+def checkout(db_path):
+    """
+    If HR_WORKING_COPY is set, copy db_path to local disk (see WorkingCopy).
+    :return: Path to use for this job - the working copy's, or db_path unchanged
+    """
+    if not use_working_copy() or db_path == ':memory:':
+        return db_path
+    wc = WorkingCopy(db_path)
+    local_path = wc.checkout()
+    _working_copies[os.path.realpath(local_path)] = wc
+    print(f'Working on a local copy of {db_path} ({local_path}).')
+    return local_path
+
+
+def checkin(db_path, publish=True):
+    """
+    Finish with a path from checkout(): publish (or discard) its working copy.
+    Does nothing if db_path isn't a working copy. Close all connections to it first.
+    :param db_path: Path returned by checkout()
+    :param publish: Publish the working copy if True, discard it if False
+    """
+    wc = _working_copies.pop(os.path.realpath(db_path), None) if db_path else None
+    if wc is None:
+        return
+    if publish:
+        wc.publish()
+        print(f'Published working copy to {wc.db_path}.')
+    else:
+        wc.discard()
+
+
+def db_file(db_connection):
+    """File path of a connection's main database ('' for an in-memory one)."""
+    return db_connection.execute('PRAGMA database_list;').fetchone()[2]
+
+
+def close(db_connection, publish=True):
+    """Close a connection, then checkin() its database file (if it's a working copy)."""
+    db_path = db_file(db_connection)
+    db_connection.close()
+    checkin(db_path, publish)
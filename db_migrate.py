@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+db_migrate.py - Initial version (Python 3).
+
+Bring Resistors.db up to the current schema version.
+
+The schema version is kept in SQLite's PRAGMA user_version. Each migration in
+MIGRATIONS is applied (in order, each in its own transaction) if the database's
+version is lower than the migration's, and the version is then updated.
+
+Migration 1 adds indexes for the access paths of the analysis scripts:
+    * Runs by Rx_Name / Range_Mode, ordered by Meas_Date (Results_to_Res_Info.py),
+    * Raw_Data test-voltages by Run_Id (Results_to_Res_Info.py),
+    * Results by Run_Id (with Meas_Date - the correlated MAX(Meas_Date) sub-query of
+      Add_date_to_Runs.py), by Excluded (Results_to_Res_Info.py), and rows still
+      missing k (a partial index - Add_ExpU_to_Results.py's DoF and rowid-range look-ups),
+    * Res_Info by R_Name (Get_Todays_Value.py, Res_Value_Server.py),
+    * Raw_Rlink_Data by Run_Id.
+An index is skipped if its table doesn't exist, or if an existing index (including
+a primary key) already starts with the same columns. ANALYZE is run afterwards,
+so the query planner has statistics to choose between indexes.
+
+Migration 2 adds numeric epoch-day columns (days since 1970-01-01, as hr_dates.py)
+alongside the date strings - Results.Meas_Day, Runs.Meas_Day and Res_Info.Cal_Day
+(Cal_Date records only) - back-fills them, indexes them and adds triggers that keep
+them up to date whenever the date strings are inserted or updated (e.g. at ingest).
+
+The report shows EXPLAIN QUERY PLAN for each of the shipped queries (QUERIES)
+before and after migrating.
+"""
+
+import sqlite3
+
+import db_connections
+from hr_dates import SQL_DAYS
+
+
+"""
+---------------------------------------
+            Helper functions:
+---------------------------------------
+"""
+
+
+def schema_version(db_connection):
+    return db_connection.execute('PRAGMA user_version;').fetchone()[0]
+
+
+def table_exists(db_connection, table):
+    row = db_connection.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?;", (table,)).fetchone()
+    return row is not None
+
+
+def index_columns(db_connection, table):
+    """Column lists of all existing indexes on table (including primary keys): [[col, ...], ...]"""
+    indexes = []
+    for idx in db_connection.execute(f"PRAGMA index_list('{table}');").fetchall():
+        info = db_connection.execute(f"PRAGMA index_info('{idx[1]}');").fetchall()
+        indexes.append([col[2] for col in sorted(info)])
+    return indexes
+
+
+def create_index(db_connection, name, table, columns, where=''):
+    """
+    Create an index, unless table is missing or an existing index starts with the same columns.
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param name: Index name
+    :param table: Table name
+    :param columns: Sequence of column names
+    :param where: Optional WHERE clause (partial index)
+    :return: True if index created
+    """
+    if not table_exists(db_connection, table):
+        print(f'\t{name}: skipped (no {table} table).')
+        return False
+    if not where:
+        for existing in index_columns(db_connection, table):
+            if existing[:len(columns)] == list(columns):
+                print(f'\t{name}: skipped (already indexed: {table}({", ".join(existing)})).')
+                return False
+    where_clause = f' WHERE {where}' if where else ''
+    db_connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)}){where_clause};")
+    print(f'\t{name}: {table}({", ".join(columns)}){where_clause}')
+    return True
+
+
+"""
+---------------------------------------
+            Migrations:
+---------------------------------------
+"""
+
+
+def migrate_1(db_connection):
+    """Indexes for the analysis scripts' queries."""
+    create_index(db_connection, 'idx_Runs_Rx', 'Runs',
+                 ('Rx_Name', 'Range_Mode', 'Meas_Date', 'Rs_Name', 'Blacklist', 'Run_Id'))
+    create_index(db_connection, 'idx_Runs_Run_Id', 'Runs', ('Run_Id',))
+    create_index(db_connection, 'idx_Raw_Data_Run_V1set', 'Raw_Data', ('Run_Id', 'V1set'))
+    create_index(db_connection, 'idx_Results_Run_Date', 'Results', ('Run_Id', 'Meas_Date'))
+    create_index(db_connection, 'idx_Results_Excluded', 'Results', ('Excluded', 'Run_Id'))
+    create_index(db_connection, 'idx_Results_k_null', 'Results', ('Run_Id',), where='k IS NULL')
+    create_index(db_connection, 'idx_Res_Info_Name', 'Res_Info', ('R_Name', 'Parameter'))
+    create_index(db_connection, 'idx_Raw_Rlink_Run', 'Raw_Rlink_Data', ('Run_Id', 'Reading_No'))
+
+
+def column_exists(db_connection, table, column):
+    return any(col[1] == column for col in db_connection.execute(f"PRAGMA table_info('{table}');"))
+
+
+def add_day_column(db_connection, table, day_col, date_col, parameter=None):
+    """
+    Add a numeric epoch-day column (days since 1970-01-01, see hr_dates.py) that shadows a
+    date-string column: back-filled now, then kept up to date by INSERT / UPDATE triggers.
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param table: Table name
+    :param day_col: Name of new (REAL) column
+    :param date_col: Name of date-string column
+    :param parameter: Only convert records with this Parameter (e.g. 'Cal_Date' in Res_Info)
+    """
+    if not table_exists(db_connection, table):
+        print(f'\t{table}.{day_col}: skipped (no {table} table).')
+        return
+    if not column_exists(db_connection, table, day_col):
+        db_connection.execute(f"ALTER TABLE {table} ADD COLUMN {day_col} REAL;")
+    days = SQL_DAYS.format(date_col)
+    where = f" WHERE Parameter = '{parameter}'" if parameter else ''
+    n = db_connection.execute(f"UPDATE {table} SET {day_col} = {days}{where};").rowcount
+    print(f'\t{table}.{day_col}: back-filled {n} rows from {date_col}.')
+
+    new_days = SQL_DAYS.format(f'NEW.{date_col}')
+    when = f" WHEN NEW.Parameter = '{parameter}'" if parameter else ''
+    for event, trigger in (('INSERT', f'trg_{table}_{day_col}_ins'),
+                           (f'UPDATE OF {date_col}', f'trg_{table}_{day_col}_upd')):
+        db_connection.execute(f"DROP TRIGGER IF EXISTS {trigger};")
+        db_connection.execute(f"CREATE TRIGGER {trigger} AFTER {event} ON {table}{when} BEGIN "
+                              f"UPDATE {table} SET {day_col} = {new_days} WHERE rowid = NEW.rowid; END;")
+
+
+def migrate_2(db_connection):
+    """Numeric epoch-day columns for measurement / calibration dates."""
+    add_day_column(db_connection, 'Results', 'Meas_Day', 'Meas_Date')
+    add_day_column(db_connection, 'Runs', 'Meas_Day', 'Meas_Date')
+    add_day_column(db_connection, 'Res_Info', 'Cal_Day', 'Value', 'Cal_Date')
+    create_index(db_connection, 'idx_Results_Meas_Day', 'Results', ('Meas_Day',))
+    create_index(db_connection, 'idx_Runs_Meas_Day', 'Runs', ('Meas_Day',))
+
+
+# (version, description, function) - in order. Append new migrations here.
+MIGRATIONS = [
+    (1, 'Indexes for analysis queries', migrate_1),
+    (2, 'Epoch-day columns (Results.Meas_Day, Runs.Meas_Day, Res_Info.Cal_Day)', migrate_2),
+]
+
+
+def migrate(db_connection, analyze=True):
+    """
+    Apply all migrations newer than the database's schema version.
+    Each migration (and its version update) is committed separately.
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param analyze: Run ANALYZE afterwards (if anything was applied)
+    :return: List of versions applied
+    """
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if version <= schema_version(db_connection):
+            continue
+        print(f'Migration {version}: {description}...')
+        db_connection.execute('BEGIN')
+        try:
+            func(db_connection)
+            db_connection.execute(f'PRAGMA user_version = {int(version)};')
+        except Exception:
+            db_connection.rollback()
+            raise
+        db_connection.commit()
+        applied.append(version)
+    if applied and analyze:
+        print('Running ANALYZE...')
+        db_connection.execute('ANALYZE;')
+        db_connection.commit()
+    return applied
+
+
+"""
+---------------------------------------
+       Query-plan report:
+---------------------------------------
+"""
+
+
+def sample_values(db_connection):
+    """Realistic parameters for the report queries (first Rx, run and resistor found)."""
+    def first(q):
+        try:
+            row = db_connection.execute(q).fetchone()
+        except sqlite3.OperationalError:  # Table missing.
+            return ''
+        return row[0] if row else ''
+    return {'Rx_Name': first("SELECT Rx_Name FROM Runs LIMIT 1;"),
+            'Run_Id': first("SELECT Run_Id FROM Runs LIMIT 1;"),
+            'R_Name': first("SELECT R_Name FROM Res_Info LIMIT 1;"),
+            'Day_Lo': 18000.0, 'Day_Hi': 18100.0, 'Rowid_Lo': 1, 'Rowid_Hi': 20000}
+
+
+# Temporary tables the scripts' queries use (see db_writer.select_runs(), Add_ExpU_to_Results.py):
+TEMP_TABLES = ("CREATE TEMP TABLE IF NOT EXISTS Selected_Runs (Run_Id TEXT PRIMARY KEY);",
+               "CREATE TEMP TABLE IF NOT EXISTS K_Factors (DoF REAL PRIMARY KEY, k REAL);")
+_RUNS = "Run_Id IN (SELECT Run_Id FROM temp.Selected_Runs)"  # (Ingest: just the runs written.)
+_NO_EXPU = "ExpU IS NULL AND k IS NULL AND Uncert IS NOT NULL AND DoF IS NOT NULL"
+_K = "(SELECT k FROM temp.K_Factors WHERE K_Factors.DoF = Results.DoF)"
+
+# (name, query, parameter names) - shipped queries, as issued by the scripts:
+QUERIES = [
+    ('Results_to_Res_Info: results',
+     "SELECT * FROM Results WHERE (Excluded IS NULL OR Excluded='No') AND Run_Id IN "
+     "(SELECT Run_Id FROM Runs WHERE Rx_Name = ? AND Range_Mode='FIXED' AND "
+     "(Blacklist IS NULL OR Blacklist='No') ORDER BY Meas_Date DESC LIMIT 100);", ('Rx_Name',)),
+    ('Results_to_Res_Info: test-voltages',
+     "SELECT DISTINCT V1set FROM Raw_Data WHERE V1set>0 AND Run_Id IN "
+     "(SELECT Run_Id FROM Runs WHERE Rx_Name=? AND Range_Mode = 'FIXED' AND "
+     "(Blacklist IS NULL OR Blacklist='No') AND "
+     "Run_Id NOT IN (SELECT Run_Id FROM Results WHERE Excluded='Yes') "
+     "ORDER BY Meas_Date DESC LIMIT 100);", ('Rx_Name',)),
+    ('Add_date_to_Runs: rowid range',
+     f"SELECT MIN(rowid), MAX(rowid) FROM Runs WHERE Run_Id IN (SELECT Run_Id FROM Results) AND {_RUNS};", ()),
+    ('Add_date_to_Runs: latest dates',
+     "UPDATE Runs SET Meas_Date = (SELECT MAX(Meas_Date) FROM Results WHERE Results.Run_Id = Runs.Run_Id) "
+     f"WHERE rowid BETWEEN ? AND ? AND Run_Id IN (SELECT Run_Id FROM Results) AND {_RUNS};",
+     ('Rowid_Lo', 'Rowid_Hi')),
+    ('Add_ExpU_to_Results: distinct DoF',
+     f"SELECT DISTINCT DoF FROM Results WHERE {_NO_EXPU} AND {_RUNS};", ()),
+    ('Add_ExpU_to_Results: rowid range (all runs)',
+     f"SELECT MIN(rowid), MAX(rowid) FROM Results WHERE {_NO_EXPU} ;", ()),
+    ('Add_ExpU_to_Results: ExpU, k',
+     f"UPDATE Results SET ExpU = {_K}*Uncert, k = {_K} WHERE rowid BETWEEN ? AND ? AND {_NO_EXPU} AND {_RUNS};",
+     ('Rowid_Lo', 'Rowid_Hi')),
+    ('Get_Todays_Value: book values',
+     "SELECT Parameter, Label, Ureal_Str, Value FROM Res_Info WHERE R_Name=?;", ('R_Name',)),
+    ('Date-range: runs',
+     "SELECT Run_Id FROM Runs WHERE Meas_Day BETWEEN ? AND ?;", ('Day_Lo', 'Day_Hi')),
+    ('Res_Info_batch: resistors',
+     "SELECT DISTINCT Rx_Name FROM Runs WHERE Range_Mode='FIXED' AND "
+     "(Blacklist IS NULL OR Blacklist='No') ORDER BY Rx_Name;", ()),
+]
+
+
+def query_plans(db_connection):
+    """EXPLAIN QUERY PLAN for each of QUERIES: {name: [plan line, ...]}"""
+    params = sample_values(db_connection)
+    for query in TEMP_TABLES:
+        db_connection.execute(query)
+    plans = {}
+    for name, query, param_names in QUERIES:
+        try:
+            rows = db_connection.execute('EXPLAIN QUERY PLAN ' + query,
+                                         [params[p] for p in param_names]).fetchall()
+        except sqlite3.OperationalError as msg:  # Table or column missing.
+            plans[name] = [f'(n/a: {msg})']
+            continue
+        plans[name] = [row[-1] for row in rows]
+    return plans
+
+
+def print_plans(before, after):
+    for name in before:
+        print(f'\n{name}:')
+        print('    before:')
+        for line in before[name]:
+            print(f'\t{line}')
+        print('    after:')
+        for line in after[name]:
+            print(f'\t{line}')
+
+
+"""
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    db_path = input('Full Resistors.db path? (press "d" for default location) >')
+    if db_path == 'd':
+        db_path = r'G:\My Drive\Resistors.db'  # Default location.
+    db_path = db_connections.checkout(db_path)  # (Working copy if HR_WORKING_COPY=1.)
+    db_connection = db_connections.connect(db_path, isolation_level=None)  # (Transactions managed explicitly.)
+
+    print(f'Schema version: {schema_version(db_connection)} (latest: {MIGRATIONS[-1][0]})')
+    plans_before = query_plans(db_connection)
+    applied = migrate(db_connection)
+    if applied:
+        print(f'Applied migration(s) {applied}; schema version now {schema_version(db_connection)}.')
+    else:
+        print('Nothing to do - schema is up to date.')
+
+    print('\n-------------------------- EXPLAIN QUERY PLAN --------------------------')
+    print_plans(plans_before, query_plans(db_connection))
+
+    if db_connection:
+        db_connections.close(db_connection, publish=bool(applied))  # (Publishes a working copy - see db_connections.py.)
@@ -7,14 +7,14 @@ Created on Tue 28/09/2020
 @author: t.lawson
 """
 
-import sqlite3
+import db_connections
 
 
 # Set up connection to database:
 db_path = input('Full Resistors.db path? (press "d" for default location) >')
 if db_path == 'd':
     db_path = r'G:\My Drive\Resistors_v100.db'  # Default location.
-db_connection = sqlite3.connect(db_path)
+db_connection = db_connections.connect(db_path)
 curs = db_connection.cursor()
 
 
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+db_writer.py - Initial version (Python 3).
+
+Batched writes to Resistors.db.
+
+Rows are accumulated per (parameterised) query and flushed with
+executemany(), so SQLite prepares each statement once per batch rather
+than once per row, and values are bound with their native types
+(no round-trip through text).
+All flushes between commits happen inside one explicit transaction.
+Write and commit times are recorded by perf.py ('sql.write', 'sql.commit').
+
+Parsers yield (run_id, query, values) records - one per row, or one per block
+of rows for the same query, with values a Rows list (a bulk record).
+"""
+
+import perf
+
+
+BATCH_SIZE = 5000  # Default no. of pending rows before a flush.
+
+
+class Rows(list):
+    """Values of several rows for the same query - the values of a bulk record."""
+
+
+def count_rows(records):
+    """No. of rows in a sequence of records (bulk records count all their rows)."""
+    return sum(len(values) if isinstance(values, Rows) else 1 for run_id, query, values in records)
+
+
+class BatchWriter:
+    """
+    Accumulate typed rows and write them with executemany().
+
+    Usage:
+        writer = BatchWriter(db_connection)
+        writer.add(query, values)  # or writer.add_records(records)
+        ...
+        writer.commit()  # (or writer.rollback())
+    """
+
+    def __init__(self, db_connection, batch_size=BATCH_SIZE):
+        """
+        :param db_connection: sqlite3 connection to Resistors.db
+        :param batch_size: No. of pending rows that triggers a flush
+        """
+        self.db_connection = db_connection
+        self.batch_size = max(int(batch_size), 1)
+        self.pending = {}  # {query: [values, ...]} - dict preserves query order.
+        self.n_pending = 0
+        self.n_written = 0
+
+    def add(self, query, values):
+        """
+        Queue one row.
+        :param query: Parameterised query (with '?' placeholders)
+        :param values: Tuple of values for this row
+        """
+        self.pending.setdefault(query, []).append(values)
+        self.n_pending += 1
+        if self.n_pending >= self.batch_size:
+            self.flush()
+
+    def add_many(self, query, rows):
+        """
+        Queue several rows for the same query.
+        :param query: Parameterised query (with '?' placeholders)
+        :param rows: Sequence of value tuples
+        """
+        rows = rows if isinstance(rows, list) else list(rows)
+        self.pending.setdefault(query, []).extend(rows)
+        self.n_pending += len(rows)
+        if self.n_pending >= self.batch_size:
+            self.flush()
+
+    def add_records(self, records):
+        """
+        Queue parsed (run_id, query, values) records.
+        :param records: Iterable of (run_id, query, values) tuples (values may be Rows)
+        :return: No. of rows queued
+        """
+        n = 0
+        for run_id, query, values in records:
+            if isinstance(values, Rows):
+                self.add_many(query, values)
+                n += len(values)
+            else:
+                self.add(query, values)
+                n += 1
+        return n
+
+    def begin(self):
+        """Open an explicit transaction (if one isn't already open)."""
+        if not self.db_connection.in_transaction:
+            self.db_connection.execute('BEGIN')
+
+    def flush(self):
+        """Write all pending rows (within the current transaction)."""
+        if self.n_pending == 0:
+            return
+        with perf.timer('sql.write'):
+            self.begin()
+            curs = self.db_connection.cursor()
+            for query, rows in self.pending.items():
+                curs.executemany(query, rows)
+            curs.close()
+        perf.count('rows.written', self.n_pending)
+        self.n_written += self.n_pending
+        self.pending.clear()
+        self.n_pending = 0
+
+    def commit(self):
+        """Flush remaining rows and commit the transaction."""
+        self.flush()
+        with perf.timer('sql.commit'):
+            self.db_connection.commit()
+
+    def rollback(self):
+        """Discard pending rows and roll back the transaction."""
+        self.pending.clear()
+        self.n_pending = 0
+        self.db_connection.rollback()
+
+
+def select_runs(db_connection, run_ids, table='Selected_Runs'):
+    """
+    Load a set of Run_Ids into a temporary table, for use in
+    '... WHERE Run_Id IN (SELECT Run_Id FROM temp.<table>)' clauses.
+    (Avoids SQLite's limit on the no. of '?' parameters in one query.)
+    :param db_connection: sqlite3 connection to Resistors.db
+    :param run_ids: Iterable of Run_Ids
+    :param table: Name of temporary table
+    :return: SQL sub-query selecting the Run_Ids
+    """
+    db_connection.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} (Run_Id TEXT PRIMARY KEY);")
+    db_connection.execute(f"DELETE FROM temp.{table};")
+    db_connection.executemany(f"INSERT OR IGNORE INTO temp.{table} (Run_Id) VALUES (?);",
+                              ((r,) for r in run_ids))
+    return f"SELECT Run_Id FROM temp.{table}"
+
+
+DERIVED_STATE_SCHEMA = ("CREATE TABLE IF NOT EXISTS Derived_State "
+                        "(Name TEXT PRIMARY KEY, Max_Rowid INTEGER, Updated TEXT);")
+
+
+def get_state(db_connection, name):
+    """
+    Refresh state of a derived table (e.g. Link_Resistance): the highest source-table
+    rowid processed by its last refresh (0 if never refreshed).
+    """
+    db_connection.execute(DERIVED_STATE_SCHEMA)
+    row = db_connection.execute("SELECT Max_Rowid FROM Derived_State WHERE Name=?;", (name,)).fetchone()
+    return row[0] if row and row[0] is not None else 0
+
+
+def set_state(db_connection, name, max_rowid):
+    """Record the highest source-table rowid processed by a derived table's refresh."""
+    db_connection.execute(DERIVED_STATE_SCHEMA)
+    db_connection.execute("INSERT OR REPLACE INTO Derived_State (Name, Max_Rowid, Updated) "
+                          "VALUES (?,?,datetime('now','localtime'));", (name, max_rowid))
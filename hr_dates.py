@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+hr_dates.py - Initial version (Python 3).
+
+Timezone-stable date conversions for Resistors.db.
+
+Dates are stored as 'YYYY-MM-DD hh:mm:ss' strings of (lab) wall-clock time.
+They used to be converted to numbers with time.mktime(), which interprets them
+in the local timezone of whichever PC runs the script (and its daylight-saving
+rules), so the same date could map to different numbers on different PCs.
+Here a date string is treated as a naive time and converted as if it were UTC,
+so the result doesn't depend on where (or in which season) it's calculated,
+and differences between dates are true elapsed days.
+
+These conversions match SQLite's julianday() - EPOCH_JD, so the numeric
+Meas_Day / Cal_Day columns (see db_migrate.py) can be calculated in SQL.
+"""
+
+import datetime as dt
+
+
+T_FMT = '%Y-%m-%d %H:%M:%S'
+EPOCH = dt.datetime(1970, 1, 1)  # (Naive - see module docstring.)
+EPOCH_JD = 2440587.5  # Julian day of EPOCH.
+SECONDS_PER_DAY = 86400.0
+
+# SQL expression for days since EPOCH, of a date-string column (format with column name):
+SQL_DAYS = "(julianday({}) - 2440587.5)"
+
+
+def to_days(d_str):
+    """
+    Date string ('YYYY-MM-DD hh:mm:ss') to days since 1970-01-01 00:00:00.
+    :param d_str: Date string
+    :return: float
+    """
+    return (dt.datetime.strptime(d_str, T_FMT) - EPOCH).total_seconds()/SECONDS_PER_DAY
+
+
+def from_days(days):
+    """
+    Days since 1970-01-01 00:00:00 to a date string (rounded to the nearest second).
+    :param days: float
+    :return: Date string ('YYYY-MM-DD hh:mm:ss')
+    """
+    return (EPOCH + dt.timedelta(seconds=round(days*SECONDS_PER_DAY))).strftime(T_FMT)
+
+
+def now_days():
+    """Current (local wall-clock) time, in days since 1970-01-01 00:00:00."""
+    return to_days(dt.datetime.now().strftime(T_FMT))
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+ingest_manifest.py - Initial version (Python 3).
+
+Record what has already been ingested into Resistors.db, so that
+unchanged workbooks (and unchanged runs within modified workbooks)
+can be skipped on re-ingest.
+
+Tables (created if missing):
+    Ingest_Manifest - one record per (workbook, sheet):
+        Source_File, Sheet, File_Size, File_Mtime, File_Hash, Ingest_Date
+    Ingest_Manifest_Runs - one record per (workbook, sheet, run):
+        Source_File, Sheet, Run_Id, Digest
+Run digests are hashes of all parsed records for that run, so a modified
+workbook only re-writes the runs whose records have actually changed.
+(Bulk records - db_writer.Rows - are hashed in pickled form: repr() of many
+floats is slower than writing them.)
+
+Usage (with a db_writer.BatchWriter, so the manifest is committed in the
+same transaction as the data it describes):
+    manifest = Manifest(db_connection, xl_file)
+    if not manifest.is_unchanged(sheets):
+        for sheet in sheets:
+            writer.add_records(manifest.changed(sheet, parse(sheet)))
+            manifest.record(writer, sheet)
+        writer.commit()
+"""
+
+import datetime as dt
+import hashlib
+import os
+import pickle
+
+from db_writer import Rows
+
+
+T_FMT = '%Y-%m-%d %H:%M:%S'
+
+MANIFEST_TABLES = (
+    "CREATE TABLE IF NOT EXISTS Ingest_Manifest (Source_File TEXT NOT NULL, Sheet TEXT NOT NULL, "
+    "File_Size INTEGER, File_Mtime REAL, File_Hash TEXT, Ingest_Date TEXT, "
+    "PRIMARY KEY (Source_File, Sheet));",
+    "CREATE TABLE IF NOT EXISTS Ingest_Manifest_Runs (Source_File TEXT NOT NULL, Sheet TEXT NOT NULL, "
+    "Run_Id TEXT NOT NULL, Digest TEXT, PRIMARY KEY (Source_File, Sheet, Run_Id));",
+)
+MANIFEST_QUERY = ("INSERT OR REPLACE INTO Ingest_Manifest "
+                  "(Source_File,Sheet,File_Size,File_Mtime,File_Hash,Ingest_Date) VALUES (?,?,?,?,?,?);")
+MANIFEST_RUN_QUERY = ("INSERT OR REPLACE INTO Ingest_Manifest_Runs (Source_File,Sheet,Run_Id,Digest) "
+                      "VALUES (?,?,?,?);")
+
+
+def ensure_tables(db_connection):
+    """Create the manifest tables if they don't exist yet."""
+    for q in MANIFEST_TABLES:
+        db_connection.execute(q)
+
+
+def file_key(xl_file):
+    """Normalised workbook path, used as the manifest key."""
+    return os.path.normcase(os.path.abspath(xl_file))
+
+
+def file_hash(xl_file):
+    """SHA-256 of the workbook's contents (hex string)."""
+    h = hashlib.sha256()
+    with open(xl_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest:
+    """Manifest entries for one workbook."""
+
+    def __init__(self, db_connection, xl_file, force=False):
+        """
+        :param db_connection: sqlite3 connection to Resistors.db
+        :param xl_file: Full XL path/filename
+        :param force: If True, changed() passes on every run (full re-ingest)
+        """
+        ensure_tables(db_connection)
+        self.db_connection = db_connection
+        self.xl_file = xl_file
+        self.force = force
+        self.key = file_key(xl_file)
+        stat = os.stat(xl_file)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self._hash = None
+        self.new_digests = {}  # {sheet: {run_id: digest}}
+        self.touched = {}  # {sheet: {run_id, ...}} - new or modified runs.
+
+    @property
+    def hash(self):
+        """File content hash (only calculated when needed)."""
+        if self._hash is None:
+            self._hash = file_hash(self.xl_file)
+        return self._hash
+
+    def is_unchanged(self, sheets):
+        """
+        Has this workbook (and each of sheets) been ingested already, with identical contents?
+        Size and mtime are checked first - the file is only hashed if its mtime has changed.
+        :param sheets: Sequence of sheet names
+        :return: True if every sheet was ingested from identical file contents
+        """
+        for sheet in sheets:
+            row = self.db_connection.execute(
+                "SELECT File_Size, File_Mtime, File_Hash FROM Ingest_Manifest WHERE Source_File=? AND Sheet=?;",
+                (self.key, sheet)).fetchone()
+            if row is None:
+                return False
+            size, mtime, f_hash = row
+            if size != self.size:
+                return False
+            if mtime != self.mtime and f_hash != self.hash:
+                return False
+        return True
+
+    def old_digests(self, sheet):
+        """Run digests recorded at the last ingest of sheet: {run_id: digest}."""
+        rows = self.db_connection.execute(
+            "SELECT Run_Id, Digest FROM Ingest_Manifest_Runs WHERE Source_File=? AND Sheet=?;",
+            (self.key, sheet)).fetchall()
+        return dict(rows)
+
+    def changed(self, sheet, records):
+        """
+        Filter parsed records, passing on only those of new or modified runs.
+        Records are buffered one run at a time (runs' records are contiguous),
+        hashed, and released only if the run's digest differs from the manifest
+        (or if self.force is set).
+        The Run_Ids passed on are collected in self.touched[sheet].
+        :param sheet: Sheet name
+        :param records: Iterable of (run_id, query, values) tuples
+        :return: generator of (run_id, query, values) tuples
+        """
+        old = self.old_digests(sheet)
+        new = self.new_digests.setdefault(sheet, {})
+        touched = self.touched.setdefault(sheet, set())
+        hashers = {}
+        seen_twice = set()  # Runs whose records aren't contiguous - never skipped.
+        block = []
+        block_run = None
+        for record in _with_sentinel(records):
+            run_id = record[0] if record is not None else None
+            if record is None or run_id != block_run:
+                if block:  # Release (or drop) the finished block:
+                    new[block_run] = hashers[block_run].hexdigest()
+                    if self.force or old.get(block_run) != new[block_run] or block_run in seen_twice:
+                        touched.add(block_run)
+                        yield from block
+                if record is None:
+                    break
+                block = []
+                block_run = run_id
+                if run_id in hashers:
+                    seen_twice.add(run_id)
+                else:
+                    hashers[run_id] = hashlib.sha256()
+            hashers[run_id].update(record_bytes(record))
+            block.append(record)
+
+    def record(self, writer, sheet):
+        """
+        Queue manifest records for sheet (after its records have been through changed()).
+        Runs no longer present in the sheet are dropped from the manifest.
+        :param writer: db_writer.BatchWriter used for the data itself
+        :param sheet: Sheet name
+        """
+        writer.flush()  # Keep manifest updates in order with the data...
+        writer.begin()  # ...and in the same transaction.
+        self.db_connection.execute("DELETE FROM Ingest_Manifest_Runs WHERE Source_File=? AND Sheet=?;",
+                                   (self.key, sheet))
+        now = dt.datetime.now().strftime(T_FMT)
+        writer.add(MANIFEST_QUERY, (self.key, sheet, self.size, self.mtime, self.hash, now))
+        digests = self.new_digests.get(sheet, {})
+        writer.add_many(MANIFEST_RUN_QUERY, [(self.key, sheet, r, d) for r, d in digests.items()])
+
+
+def record_bytes(record):
+    """Bytes of a (run_id, query, values) record, for its run's digest."""
+    if isinstance(record[2], Rows):
+        return record[1].encode() + pickle.dumps(record[2], protocol=4)
+    return repr(record[1:]).encode()
+
+
+def _with_sentinel(records):
+    """Iterate over records, then None."""
+    yield from records
+    yield None
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+perf.py - Initial version (Python 3).
+
+Lightweight timing / profiling instrumentation for the Resistors.db scripts.
+
+Named stage timers and counters accumulate in a process-wide PerfRecorder:
+    with perf.timer('sql.write'):
+        ...
+    perf.count('rows.written', n)
+    for record in perf.timed_iter('parse.Data', parser):  # Time spent inside the generator only.
+        ...
+They cost a couple of perf_counter() calls each, so are always on - but are
+only reported when asked for, with environment variables (read by start()):
+    HR_PERF_REPORT=<path>   Write a report at exit: CSV if path ends with '.csv', otherwise JSON.
+    HR_PERF_PROFILE=<path>  Capture a cProfile of the whole run (view with pstats / snakeviz).
+    HR_QUIET=1              Suppress per-row console output (see quiet()) - on large sheets,
+                            printing each row can take longer than the ingest itself.
+
+Usage (in a script's main section):
+    perf.start('HRBC_raw_data_to_db')
+    verbose = not perf.quiet()
+"""
+
+import atexit
+import cProfile
+import csv
+import json
+import os
+import time
+
+
+PERF_REPORT_ENV = 'HR_PERF_REPORT'
+PERF_PROFILE_ENV = 'HR_PERF_PROFILE'
+QUIET_ENV = 'HR_QUIET'
+
+
+class _Timer:
+    """Context manager adding its elapsed time to one of a PerfRecorder's timers."""
+
+    __slots__ = ('recorder', 'name', 't_start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.t_start = 0.0
+
+    def __enter__(self):
+        self.t_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.recorder.add_time(self.name, time.perf_counter() - self.t_start)
+        return False
+
+
+class PerfRecorder:
+    """Accumulated stage timings {name: [calls, total s, max s]} and counters {name: n}."""
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.t_start = time.perf_counter()
+
+    def timer(self, name):
+        """Context manager timing one stage (times are accumulated over calls)."""
+        return _Timer(self, name)
+
+    def add_time(self, name, seconds, calls=1):
+        """Add an externally-measured time (e.g. from a worker process) to a timer."""
+        t = self.timers.setdefault(name, [0, 0.0, 0.0])
+        t[0] += calls
+        t[1] += seconds
+        t[2] = max(t[2], seconds)
+
+    def count(self, name, n=1):
+        """Add n to a counter."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed_iter(self, name, iterable):
+        """
+        Yield from iterable, timing only the work done inside it (not by the consumer).
+        The timer's calls are the no. of items yielded.
+        """
+        clock = time.perf_counter
+        it = iter(iterable)
+        total = longest = 0.0
+        n = 0
+        try:
+            while True:
+                t_start = clock()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    total += clock() - t_start
+                    break
+                dt = clock() - t_start
+                total += dt
+                longest = max(longest, dt)
+                n += 1
+                yield item
+        finally:
+            t = self.timers.setdefault(name, [0, 0.0, 0.0])
+            t[0] += n
+            t[1] += total
+            t[2] = max(t[2], longest)
+
+    def reset(self):
+        """Clear all timers and counters, and restart the elapsed-time clock."""
+        self.timers.clear()
+        self.counters.clear()
+        self.t_start = time.perf_counter()
+
+    def summary(self, script=''):
+        """
+        All timings and counters.
+        :return: dict {'script', 'elapsed_s', 'timers': {name: {'calls', 'total_s', 'mean_s', 'max_s'}},
+        'counters': {name: n}}
+        """
+        timers = {name: {'calls': n, 'total_s': total, 'mean_s': total/n if n else 0.0, 'max_s': longest}
+                  for name, (n, total, longest) in sorted(self.timers.items())}
+        return {'script': script, 'elapsed_s': time.perf_counter() - self.t_start,
+                'timers': timers, 'counters': dict(sorted(self.counters.items()))}
+
+    def write(self, path, script=''):
+        """Write summary() to path - as CSV (one row per timer / counter) if it ends with '.csv', else JSON."""
+        summ = self.summary(script)
+        if path.lower().endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(('script', 'kind', 'name', 'calls', 'total_s', 'mean_s', 'max_s'))
+                writer.writerow((script, 'elapsed', '', 1, summ['elapsed_s'], summ['elapsed_s'], summ['elapsed_s']))
+                for name, t in summ['timers'].items():
+                    writer.writerow((script, 'timer', name, t['calls'], t['total_s'], t['mean_s'], t['max_s']))
+                for name, n in summ['counters'].items():
+                    writer.writerow((script, 'counter', name, n, '', '', ''))
+        else:
+            with open(path, 'w') as f:
+                json.dump(summ, f, indent=2)
+
+
+_recorder = PerfRecorder()
+_profiler = None
+
+
+def timer(name):
+    """Time a stage with the process-wide recorder (see PerfRecorder.timer())."""
+    return _recorder.timer(name)
+
+
+def add_time(name, seconds, calls=1):
+    """See PerfRecorder.add_time()."""
+    _recorder.add_time(name, seconds, calls)
+
+
+def count(name, n=1):
+    """See PerfRecorder.count()."""
+    _recorder.count(name, n)
+
+
+def timed_iter(name, iterable):
+    """See PerfRecorder.timed_iter()."""
+    return _recorder.timed_iter(name, iterable)
+
+
+def summary(script=''):
+    """See PerfRecorder.summary()."""
+    return _recorder.summary(script)
+
+
+def reset():
+    """See PerfRecorder.reset()."""
+    _recorder.reset()
+
+
+def quiet():
+    """True if per-row console output should be suppressed (HR_QUIET set, and not '0')."""
+    return os.environ.get(QUIET_ENV, '0') not in ('', '0')
+
+
+def start(script):
+    """
+    Start a script's performance session: restart the clock, start cProfile (if HR_PERF_PROFILE
+    is set) and write the report / profile when the script exits (however it exits).
+    :param script: Script name (recorded in the report)
+    """
+    global _profiler
+    _recorder.reset()
+    if os.environ.get(PERF_PROFILE_ENV):
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.register(finish, script)
+
+
+def finish(script=''):
+    """Stop profiling and write the report / profile, as requested by the environment variables."""
+    global _profiler
+    prof_path = os.environ.get(PERF_PROFILE_ENV)
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(prof_path)
+        _profiler = None
+        print(f'Profile written to {prof_path}')
+    report_path = os.environ.get(PERF_REPORT_ENV)
+    if report_path:
+        _recorder.write(report_path, script)
+        print(f'Performance report written to {report_path}')
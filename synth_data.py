@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+synth_data.py - Initial version (Python 3).
+
+Synthetic HRBC / HRBA workloads, for benchmarking (see bench.py) without
+touching production data.
+
+Workbooks have the same layout as real HRBC files:
+    'Data'    - a 'Run Id:' block per run: 4-reversal data rows (V1, V2, Vd readings,
+                GMH / room conditions and the R1/R2 comment) with the instrument role
+                assignments in columns AC:AE of the first rows,
+    'Rlink'   - a 'Run Id:' block per run: R1/R2 voltages and rows of dV+ / dV- pairs,
+    'Results' - an HRBA block per run: 3 rows (value / uncert / dof) per measurement,
+                with uncertainty-budget lines alongside, separated by blank rows.
+Resistor values follow R = R_nom*(1 + dev + alpha*(T - 20.5) + gamma*(V - V0) + tau*t),
+with random (but seeded, so repeatable) coefficients for each resistor.
+
+A synthetic Resistors.db is built by passing the same sheet rows through the
+real sheet parsers (HRBC_raw_data_to_db.py, HRBA_Results_to_db.py), so it has
+exactly the records an ingest would produce - no workbook files needed.
+"""
+
+import datetime as dt
+import random
+import db_connections
+
+import pylightxl as xl
+
+import HRBC_raw_data_to_db as hrbc
+import HRBA_Results_to_db as hrba
+from Add_ExpU_to_Results import fill_expu_k
+from Add_date_to_Runs import add_dates
+from db_writer import BatchWriter
+
+
+# Tables used by the scripts (see Data_model.pdf):
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS Runs (Run_Id TEXT PRIMARY KEY, Comment TEXT, Rs_Name TEXT, Rx_Name TEXT, "
+    "Range_Mode TEXT, SRC1 TEXT, SRC2 TEXT, DVMd TEXT, DVM12 TEXT, GMH1 TEXT, GMH2 TEXT, GMHroom TEXT, "
+    "Source_File TEXT, Meas_Date TEXT, Analysis_Note TEXT, Blacklist TEXT);",
+    "CREATE TABLE IF NOT EXISTS Raw_Data (Run_Id TEXT, Meas_No INTEGER, Rev_No INTEGER, V1set REAL, V2set REAL, "
+    "n INTEGER, Start_del REAL, AZ1_del REAL, Range_del REAL, V1_time TEXT, V1_val REAL, V1_sd REAL, "
+    "Vd_time TEXT, Vd_val REAL, Vd_sd REAL, V2_time TEXT, V2_val REAL, V2_sd REAL, GMH1 REAL, GMH2 REAL, "
+    "Troom REAL, Proom REAL, RHroom REAL, PRIMARY KEY (Run_Id, Meas_No, Rev_No));",
+    "CREATE TABLE IF NOT EXISTS Raw_Rlink_Data (Run_Id TEXT, Reading_No INTEGER, absV1 REAL, absV2 REAL, "
+    "deltaVpos REAL, deltaVneg REAL, PRIMARY KEY (Run_Id, Reading_No));",
+    "CREATE TABLE IF NOT EXISTS Results (Run_Id TEXT, Meas_Date TEXT, Analysis_Note TEXT, Meas_No INTEGER, "
+    "Parameter TEXT, Value REAL, Uncert REAL, DoF REAL, ExpU REAL, k REAL, Excluded TEXT, Ureal_Str TEXT, "
+    "PRIMARY KEY (Run_Id, Meas_No, Parameter));",
+    "CREATE TABLE IF NOT EXISTS Uncert_Contribs (Run_Id TEXT, Meas_No INTEGER, Quantity_Label TEXT, Value REAL, "
+    "Uncert REAL, DoF REAL, Sens_Co REAL, U_Contrib REAL, PRIMARY KEY (Run_Id, Meas_No, Quantity_Label));",
+    "CREATE TABLE IF NOT EXISTS Res_Info (R_Name TEXT, Parameter TEXT, Value, Uncert REAL, DoF REAL, Label TEXT, "
+    "Ref_Comment TEXT, Ureal_Str TEXT, PRIMARY KEY (R_Name, Parameter));",
+)
+
+DATA_WIDTH = 31  # Columns A:AE.
+ROLES = ('SRC1', 'SRC2', 'DVMd', 'DVM12', 'GMH1', 'GMH2', 'GMHroom', 'DVMT1', 'DVMT2', 'switchbox')
+DECADES = (('1M', 1e6), ('10M', 1e7), ('100M', 1e8), ('1G', 1e9))
+TEST_VS = (10, 100)  # Test-voltages, used in alternate runs.
+T_REF = 20.5
+START_DATE = dt.datetime(2015, 1, 5, 9, 0, 0)
+RUN_INTERVAL_DAYS = 14  # Between runs of the same resistor.
+XL_T_FMT = '%d/%m/%Y %H:%M:%S'  # Dates as written by the HRBC software.
+
+
+"""
+---------------------------------------
+            Resistor models:
+---------------------------------------
+"""
+
+
+def make_resistors(n_resistors, seed=0):
+    """
+    Random (repeatable) resistor models, each measured against a reference a decade below.
+    :param n_resistors: No. of (Rx) resistors
+    :param seed: Random seed
+    :return: list of dicts with keys 'name', 'Rs_name', 'R_nom', 'ratio', 'dev', 'alpha', 'gamma', 'tau'
+    """
+    rng = random.Random(seed)
+    resistors = []
+    for i in range(n_resistors):
+        suffix, R_nom = DECADES[i % len(DECADES)]
+        rs_suffix = DECADES[i % len(DECADES) - 1][0] if i % len(DECADES) else '100k'
+        resistors.append({'name': f'SYN{i:04d} {suffix}', 'Rs_name': f'SYNREF {rs_suffix}',
+                          'R_nom': R_nom, 'ratio': 10.0, 'dev': rng.gauss(0, 1e-5),
+                          'alpha': rng.gauss(0, 5e-6), 'gamma': rng.gauss(0, 1e-7), 'tau': rng.gauss(0, 1e-8)})
+    return resistors
+
+
+def r_value(res, T, V, t_days):
+    """Model value of resistor res at temperature T, test-voltage V and t_days after START_DATE."""
+    V0 = TEST_VS[0]
+    return res['R_nom']*(1 + res['dev'] + res['alpha']*(T - T_REF) + res['gamma']*(V - V0) + res['tau']*t_days)
+
+
+def make_runs(resistors, runs_per_resistor, seed=0):
+    """
+    Schedule runs: each resistor is measured every RUN_INTERVAL_DAYS, at alternating test-voltages.
+    :return: list of dicts with keys 'run_id', 'res', 'start' (datetime), 'V1'
+    """
+    rng = random.Random(seed + 1)
+    runs = []
+    for i, res in enumerate(resistors):
+        for j in range(runs_per_resistor):
+            start = START_DATE + dt.timedelta(days=j*RUN_INTERVAL_DAYS + i % RUN_INTERVAL_DAYS,
+                                              minutes=rng.randrange(0, 480))
+            runs.append({'run_id': f"HRBC.syn {start.strftime('%Y-%m-%d %H:%M:%S')} {res['name']}",
+                         'res': res, 'start': start, 'V1': TEST_VS[j % len(TEST_VS)]})
+    return runs
+
+
+"""
+---------------------------------------
+            Sheet rows:
+---------------------------------------
+"""
+
+
+def data_rows(runs, n_meas, seed=0):
+    """
+    'Data' sheet rows (lists of DATA_WIDTH cell values) for all runs.
+    :param runs: From make_runs()
+    :param n_meas: Measurements (of 4 reversals each) per run
+    """
+    rng = random.Random(seed + 2)
+    for run in runs:
+        res = run['res']
+        row = [''] * DATA_WIDTH
+        row[0] = 'Run Id:'
+        row[1] = run['run_id']
+        yield row
+        comment = f"R1: {res['name']} monitored by GMH, R2: {res['Rs_name']} monitored by GMH"
+        V1 = run['V1']
+        V2 = -V1/res['ratio']
+        k = 0  # Row count within run (role assignments go on the first len(ROLES) rows).
+        for m in range(n_meas):
+            for rev in range(4):
+                s = 1 if rev in (0, 3) else -1  # +, -, -, + reversal sequence.
+                t = run['start'] + dt.timedelta(minutes=10*(4*m + rev))
+                T = T_REF + rng.gauss(0, 0.05)
+                row = [''] * DATA_WIDTH
+                row[0:6] = [s*V1, s*V2, 10, 5, 2, 3]  # V1set, V2set, n, delays.
+                row[6:9] = [t.strftime(XL_T_FMT), s*V2 + rng.gauss(0, 1e-6), 1e-6]
+                row[12:15] = [(t + dt.timedelta(seconds=20)).strftime(XL_T_FMT), rng.gauss(0, 1e-7), 1e-7]
+                row[15:18] = [(t + dt.timedelta(seconds=40)).strftime(XL_T_FMT), s*V1 + rng.gauss(0, 1e-5), 1e-5]
+                row[20:25] = [T, T + rng.gauss(0, 0.01), T_REF + rng.gauss(0, 0.2), 1013 + rng.gauss(0, 5),
+                              45 + rng.gauss(0, 3)]
+                row[25] = comment
+                if k < len(ROLES):
+                    row[28] = ROLES[k]
+                    row[29] = f'{ROLES[k]} instrument'
+                    row[30] = 'FIXED' if ROLES[k] == 'DVM12' else ''
+                k += 1
+                yield row
+        yield [''] * DATA_WIDTH
+
+
+def rlink_rows(runs, n_readings, n_reversals=3, seed=0):
+    """
+    'Rlink' sheet rows for all runs.
+    :param runs: From make_runs()
+    :param n_readings: Rows of readings per run
+    :param n_reversals: (dV+, dV-) pairs per row
+    """
+    rng = random.Random(seed + 3)
+    width = 2*n_reversals
+    for run in runs:
+        pad = [''] * (width - 2)
+        yield ['Run Id:', run['run_id']] + pad
+        yield ['N_Reversals', n_reversals] + pad
+        yield ['N_Readings', n_readings] + pad
+        yield ['R1', '', '', float(run['V1'])] + pad[2:]
+        yield ['R2', '', '', run['V1']/run['res']['ratio']] + pad[2:]
+        yield ['ΔV+', 'ΔV-'] * n_reversals
+        for i in range(n_readings):
+            row = []
+            for j in range(n_reversals):
+                row += [1e-3 + rng.gauss(0, 1e-6), -1e-3 + rng.gauss(0, 1e-6)]
+            yield row
+        yield [''] * width
+
+
+def results_rows(runs, n_meas, seed=0):
+    """
+    HRBA 'Results' sheet rows for all runs.
+    :param runs: From make_runs()
+    :param n_meas: Measurements per run
+    """
+    rng = random.Random(seed + 4)
+    width = 16
+
+    def row_of(**cells):  # E.g. row_of(c1=..., c3=...)
+        row = [''] * width
+        for col, val in cells.items():
+            row[int(col[1:])] = val
+        return row
+
+    for run in runs:
+        res = run['res']
+        yield row_of(c0=f"Processed with HRBA v1.0 (synthetic) {run['run_id']}")
+        yield row_of(c2='Run Id:', c3=run['run_id'])
+        yield row_of(c0='Name', c1='V', c2='Date', c3='T', c4='R', c5='u(R)', c6='dof', c7='ExpU')
+        for m in range(n_meas):
+            t = run['start'] + dt.timedelta(minutes=10*(4*m + 2))
+            t_days = (t - START_DATE).total_seconds()/86400
+            T = T_REF + rng.gauss(0, 0.3)
+            V = run['V1']*(1 + rng.gauss(0, 1e-5))
+            R = r_value(res, T, V, t_days)*(1 + rng.gauss(0, 2e-7))
+            u_R = 2e-7*R
+            yield row_of(c1=V, c2=t.strftime(XL_T_FMT), c3=T, c4=R, c5=u_R, c6=50.0, c7=2.01*u_R,
+                         c9='Rs', c10=res['R_nom']/res['ratio'], c11=1e-7*res['R_nom']/res['ratio'], c12='inf',
+                         c13=res['ratio'], c14=1e-7*R)
+            yield row_of(c1=1e-4*V, c3=0.01, c9='ratio', c10=res['ratio'], c11=1e-7, c12=20,
+                         c13=res['R_nom']/res['ratio'], c14=1e-7*R)
+            yield row_of(c1=8, c3=9, c9='T_corr', c10=0.0, c11=0.0, c12=8, c13=1.0, c14=0.0)
+            yield row_of()
+
+
+def workload(n_resistors, runs_per_resistor, n_meas=4, n_readings=5, seed=0):
+    """
+    Rows for all three sheets of one synthetic workload.
+    :return: dict {sheet name: list of rows}
+    """
+    runs = make_runs(make_resistors(n_resistors, seed), runs_per_resistor, seed)
+    return {'Data': list(data_rows(runs, n_meas, seed)),
+            'Rlink': list(rlink_rows(runs, n_readings, seed=seed)),
+            'Results': list(results_rows(runs, n_meas, seed))}
+
+
+"""
+---------------------------------------
+            Outputs:
+---------------------------------------
+"""
+
+
+def write_workbook(filename, sheets):
+    """
+    Write sheet rows to an Excel file (with pylightxl).
+    :param filename: XL path/filename
+    :param sheets: dict {sheet name: list of rows}, e.g. from workload()
+    """
+    db = xl.Database()
+    for name, rows in sheets.items():
+        db.add_ws(ws=name)
+        ws = db.ws(name)
+        for r, row in enumerate(rows, 1):
+            for c, val in enumerate(row, 1):
+                if val != '':
+                    ws.update_index(row=r, col=c, val=val)
+    xl.writexl(db=db, fn=filename)
+
+
+def make_db(db_path, sheets, source_file='synthetic.xlsx'):
+    """
+    Build (or add to) a synthetic Resistors.db from sheet rows, through the real sheet parsers.
+    :param db_path: Database path (created if missing)
+    :param sheets: dict {sheet name: list of rows}, e.g. from workload()
+    :param source_file: Recorded as the Runs' Source_File
+    :return: No. of records written
+    """
+    db_connection = db_connections.connect(db_path)
+    for query in SCHEMA:
+        db_connection.execute(query)
+    writer = BatchWriter(db_connection)
+    writer.add_records(hrbc.parse_data_sheet(sheets['Data'], False, source_file, verbose=False))
+    writer.add_records(hrbc.parse_rlink_sheet(sheets['Rlink'], verbose=False))
+    writer.add_records(hrba.parse_results_sheet(sheets['Results'], verbose=False))
+    writer.flush()
+    fill_expu_k(db_connection)
+    add_dates(db_connection)
+    db_connection.commit()
+    db_connection.close()
+    return writer.n_written
+
+
+"""
+-------------------------------------------------------------------------------------
+                          Main script starts here...
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    n_resistors = int(input('No. of resistors? >'))
+    runs_per_resistor = int(input('Runs per resistor? >'))
+    n_meas = input('Measurements per run? (press "Enter" for 4) >')
+    n_meas = int(n_meas) if n_meas else 4
+    seed = input('Random seed? (press "Enter" for 0) >')
+    seed = int(seed) if seed else 0
+
+    sheets = workload(n_resistors, runs_per_resistor, n_meas, seed=seed)
+    print(f"Generated {len(sheets['Data'])} Data, {len(sheets['Rlink'])} Rlink and "
+          f"{len(sheets['Results'])} Results rows.")
+
+    xl_file = input('Synthetic XL path/filename? (press "Enter" for none) >')
+    if xl_file:
+        write_workbook(xl_file, sheets)
+        print(f'Wrote {xl_file}.')
+
+    db_path = input('Synthetic Resistors.db path? (press "Enter" for none) >')
+    if db_path:
+        n = make_db(db_path, sheets, xl_file or 'synthetic.xlsx')
+        print(f'Wrote {n} records to {db_path}.')
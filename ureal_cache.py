@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+ureal_cache.py - Initial version (Python 3).
+
+Shared, memoised deserialisation of GTC archives stored in Ureal_Str columns
+(Results and Res_Info tables).
+
+gtc.pr.loads_json() rebuilds an archive from scratch every time it's called,
+so refitting a resistor (or looking up its value again) in the same process
+repeatedly thaws the same uncertain numbers. Here each thawed ureal is kept in
+a bounded least-recently-used cache, keyed by a hash of the JSON text and the
+label extracted, so later requests for it are a dictionary look-up.
+Uncertain numbers are immutable, so sharing one instance between callers is safe.
+
+Usage:
+    from ureal_cache import str_to_ureal
+    un = str_to_ureal(row_ureal_str, label)
+    uns = thaw_archive(book_values_str)  # {label: ureal}, for multi-ureal archives.
+"""
+
+import collections
+import hashlib
+
+import GTC as gtc
+
+
+CACHE_SIZE = 20000  # Default max. no. of thawed ureals held.
+
+
+class UrealCache:
+    """Bounded LRU cache of ureals thawed from JSON archive strings."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        """
+        :param maxsize: Max. no. of ureals held (least-recently used are dropped first)
+        """
+        self.maxsize = max(int(maxsize), 1)
+        self._cache = collections.OrderedDict()  # {(digest, label): ureal}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(j_str, name):
+        """Cache key: (SHA-1 of archive JSON, label)."""
+        return hashlib.sha1(j_str.encode()).hexdigest(), name
+
+    def get(self, j_str, name):
+        """
+        Thaw (or recall) the ureal labelled name from a JSON archive string.
+        :param j_str: JSON archive (Ureal_Str column)
+        :param name: Label of ureal to extract
+        :return: ureal
+        """
+        k = self.key(j_str, name)
+        try:
+            un = self._cache[k]
+        except KeyError:
+            self.misses += 1
+            un = gtc.pr.loads_json(j_str).extract(name)
+            self._cache[k] = un
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+            return un
+        self.hits += 1
+        self._cache.move_to_end(k)
+        return un
+
+    def get_all(self, j_str):
+        """
+        Thaw (or recall) every ureal in a JSON archive string, with a single load.
+        :param j_str: JSON archive
+        :return: dict {label: ureal}
+        """
+        k = self.key(j_str, None)
+        try:
+            uns = self._cache[k]
+        except KeyError:
+            self.misses += 1
+            archive = gtc.pr.loads_json(j_str)
+            uns = dict(archive.items())
+            self._cache[k] = uns
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+            return uns
+        self.hits += 1
+        self._cache.move_to_end(k)
+        return uns
+
+    def clear(self):
+        """Empty the cache and reset the counters."""
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+    def info(self):
+        """Cache statistics: {'hits', 'misses', 'size', 'maxsize'}."""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache), 'maxsize': self.maxsize}
+
+
+_default_cache = UrealCache()
+
+
+def str_to_ureal(j_str, name):
+    """Thaw ureal labelled name from JSON archive j_str, via the process-wide cache."""
+    return _default_cache.get(j_str, name)
+
+
+def thaw_archive(j_str):
+    """Thaw all ureals in JSON archive j_str (one load), via the process-wide cache: {label: ureal}."""
+    return _default_cache.get_all(j_str)
+
+
+def cache_info():
+    """Statistics of the process-wide cache (see UrealCache.info())."""
+    return _default_cache.info()
+
+
+def clear_cache():
+    """Empty the process-wide cache."""
+    _default_cache.clear()
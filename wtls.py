@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+wtls.py - Initial version (Python 3).
+
+NumPy fast path for the type-A weighted total least-squares (WTLS) straight-line
+fits in Results_to_Res_Info.py.
+
+GTC.type_a.line_fit_wtls() builds a list of uncertain numbers for every data
+point and evaluates chi-squared (and its derivative) element-by-element in
+Python. Here the same fit is made on float arrays, using York's iteration for
+the slope (York et al., Am. J. Phys. 72 (2004) 367), and the uncertainties and
+covariance of the intercept and slope are the first-order propagation of u_x
+and u_y through the fit - the same quantities GTC calculates with its (Krystek &
+Anton) algorithm, so results agree to within GTC's minimisation tolerance.
+
+The intercept and slope are returned as a correlated pair of type-A uncertain
+numbers, as GTC.type_a.line_fit_wtls() returns them. Type-B fits are still made
+with GTC.type_b.line_fit_wtls() (the data's own uncertainty budgets are
+needed) and the two are combined with merge(), as before.
+
+Uncorrelated x-y pairs only (GTC's r_xy=None).
+
+If the iteration doesn't converge, line_fit_wtls() falls back to
+GTC.type_a.line_fit_wtls() for that fit (counted as 'wtls.fallback' by perf.py),
+so one awkward data set can't abort a Res_Info fit.
+"""
+
+import math
+
+import numpy as np
+import GTC as gtc
+
+import perf
+
+
+MAX_ITER = 100  # York iterations before giving up.
+REL_TOL = 1e-15  # Convergence criterion: relative change in slope.
+NOISE_TOL = 1e-12  # Below this relative change, also stop once the change stops shrinking (rounding noise).
+MERGE_U_TOL = 0.1  # merge(): allowed difference between values, as a fraction of their uncertainty.
+
+
+class ConvergenceError(RuntimeError):
+    """fit_arrays() didn't converge in MAX_ITER iterations."""
+
+
+def _values(seq):
+    """Values of a sequence of floats and/or uncertain numbers, as a list of floats."""
+    return [gtc.value(v) for v in seq]
+
+
+def fit_arrays(x, y, u_x, u_y):
+    """
+    WTLS fit of a straight line to float data: y = a + b*x.
+    :param x: Sequence of independent-variable values
+    :param y: Sequence of dependent-variable values
+    :param u_x: Sequence of standard uncertainties in x
+    :param u_y: Sequence of standard uncertainties in y
+    :return: (a, b, u_a, u_b, cov_ab, ssr) - all floats
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    v_x = np.asarray(u_x, dtype=float)**2
+    v_y = np.asarray(u_y, dtype=float)**2
+    N = len(x)
+    if not (N == len(y) == len(v_x) == len(v_y)):
+        raise RuntimeError(f'Incompatible sequence lengths: {len(x)}, {len(y)}, {len(v_x)}, {len(v_y)}')
+    if N < 2:
+        raise RuntimeError(f'At least 2 points needed for a line fit ({N} supplied)')
+
+    # Initial slope from weighted (in y only) least squares, as GTC:
+    w = 1.0/v_y
+    x_w = np.sum(w*x)/np.sum(w)
+    y_w = np.sum(w*y)/np.sum(w)
+    b = np.sum(w*(x - x_w)*(y - y_w))/np.sum(w*(x - x_w)**2)
+
+    step = math.inf
+    for _ in range(MAX_ITER):
+        W = 1.0/(v_y + b*b*v_x)
+        X_bar = np.sum(W*x)/np.sum(W)
+        Y_bar = np.sum(W*y)/np.sum(W)
+        U = x - X_bar
+        V = y - Y_bar
+        beta = W*(U*v_y + b*V*v_x)
+        b_new = np.sum(W*beta*V)/np.sum(W*beta*U)
+        last_step, step = step, abs(b_new - b)
+        converged = step <= REL_TOL*abs(b_new) or (step <= NOISE_TOL*abs(b_new) and step >= last_step)
+        b = b_new
+        if converged:
+            break
+    else:
+        raise ConvergenceError(f'WTLS fit did not converge in {MAX_ITER} iterations')
+
+    # Solution at the final slope:
+    W = 1.0/(v_y + b*b*v_x)
+    a = np.sum(W*y)/np.sum(W) - b*np.sum(W*x)/np.sum(W)
+    r = y - a - b*x  # Residuals.
+    ssr = np.sum(W*r**2)
+
+    # Sensitivities of (a, b) to each x and y, by implicit differentiation of the
+    # normal equations H = sum(W*r) = 0 and F = d(chi-sq)/db = sum(c*r**2 - 2*W*r*x) = 0,
+    # where c = dW/db. This is the first-order propagation GTC makes (York's
+    # approximate uncertainty expressions can differ from it by ~1 %).
+    c = -2.0*b*v_x*W**2
+    dc_db = -2.0*v_x*W**2 - 4.0*b*v_x*W*c
+    J = np.array([[-np.sum(W), np.sum(c*r - W*x)],
+                  [np.sum(2.0*W*x - 2.0*c*r), np.sum(dc_db*r**2 - 4.0*c*r*x + 2.0*W*x**2)]])
+    dH_dy, dF_dy = W, 2.0*c*r - 2.0*W*x
+    dH_dx, dF_dx = -b*W, 2.0*b*W*x - 2.0*W*r - 2.0*b*c*r
+    J_inv = np.linalg.inv(J)
+    s_y = -J_inv @ np.vstack((dH_dy, dF_dy))  # Rows: d(a)/d(y_k), d(b)/d(y_k).
+    s_x = -J_inv @ np.vstack((dH_dx, dF_dx))
+    cov = s_x*v_x @ s_x.T + s_y*v_y @ s_y.T  # 2x2 covariance of (a, b).
+    return float(a), float(b), math.sqrt(cov[0, 0]), math.sqrt(cov[1, 1]), float(cov[0, 1]), float(ssr)
+
+
+def line_fit_wtls(x, y, u_x, u_y, dof=None):
+    """
+    Fast equivalent of GTC.type_a.line_fit_wtls(x, y, u_x, u_y, dof=dof).a_b
+    (which is used instead if the fast fit doesn't converge).
+    :param x: Sequence of x-values (floats or uncertain numbers - only values are used)
+    :param y: Sequence of y-values (floats or uncertain numbers - only values are used)
+    :param u_x: Sequence of standard uncertainties in x
+    :param u_y: Sequence of standard uncertainties in y
+    :param dof: Degrees of freedom of the results (default inf, as GTC)
+    :return: (intercept, slope) - correlated pair of type-A ureals
+    """
+    try:
+        a, b, u_a, u_b, cov_ab, ssr = fit_arrays(_values(x), _values(y), u_x, u_y)
+    except ConvergenceError:
+        perf.count('wtls.fallback')
+        return tuple(gtc.ta.line_fit_wtls(_values(x), _values(y), u_x, u_y, dof=dof).a_b)
+    df = math.inf if dof is None else dof
+    a_un, b_un = gtc.multiple_ureal([a, b], [u_a, u_b], df)
+    if u_a > 0 and u_b > 0:
+        a_un.set_correlation(cov_ab/(u_a*u_b), b_un)
+    return a_un, b_un
+
+
+def merge(a, b, u_tol=MERGE_U_TOL):
+    """
+    GTC.type_a.merge(), with a tolerance scaled to the uncertainty of the values.
+    gtc.ta.merge() requires the values to agree to 1e-13 (absolute). A GTC type-B fit
+    stops at its minimiser's tolerance, so it won't agree that closely with the
+    (fully converged) result of line_fit_wtls() - but does to a tiny fraction of u.
+    The result takes the value of b (the GTC type-B fit), so merged values
+    are those obtained by merging two GTC fits.
+    :param a: Type-A result (from line_fit_wtls())
+    :param b: Type-B result (from GTC.type_b.line_fit_wtls())
+    :param u_tol: Allowed difference between the values, as a fraction of the larger uncertainty
+    :return: ureal with the value of b and the uncertainty components of both
+    """
+    tol = max(1e-13, u_tol*max(gtc.uncertainty(a), gtc.uncertainty(b)))
+    return gtc.ta.merge(b, a, TOL=tol)
+
+
+def compare_with_gtc(x, y, u_x, u_y):
+    """
+    Check line_fit_wtls() against GTC.type_a.line_fit_wtls() for one data set.
+    :return: dict of max. relative differences in value, uncertainty and a-b correlation
+    """
+    a_fast, b_fast = line_fit_wtls(x, y, u_x, u_y)
+    a_gtc, b_gtc = gtc.ta.line_fit_wtls(_values(x), _values(y), u_x, u_y).a_b
+
+    def rel(p, q):
+        return abs(p - q)/abs(q) if q != 0 else abs(p)
+
+    return {'value': max(rel(a_fast.x, a_gtc.x), rel(b_fast.x, b_gtc.x)),
+            'uncert': max(rel(a_fast.u, a_gtc.u), rel(b_fast.u, b_gtc.u)),
+            'correlation': abs(a_fast.get_correlation(b_fast) - a_gtc.get_correlation(b_gtc))}
+
+
+"""
+-------------------------------------------------------------------------------------
+    Self-check against GTC (Pearson-York test data, as in GTC's documentation):
+-------------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    x = [0.0, 0.9, 1.8, 2.6, 3.3, 4.4, 5.2, 6.1, 6.5, 7.4]
+    wx = [1000.0, 1000.0, 500.0, 800.0, 200.0, 80.0, 60.0, 20.0, 1.8, 1.0]
+    y = [5.9, 5.4, 4.4, 4.6, 3.5, 3.7, 2.8, 2.8, 2.4, 1.5]
+    wy = [1.0, 1.8, 4.0, 8.0, 20.0, 20.0, 70.0, 70.0, 100.0, 500.0]
+    u_x = [1/math.sqrt(w) for w in wx]
+    u_y = [1/math.sqrt(w) for w in wy]
+
+    print('NumPy WTLS:', line_fit_wtls(x, y, u_x, u_y))
+    print('GTC WTLS:  ', tuple(gtc.ta.line_fit_wtls(x, y, u_x, u_y).a_b))
+    print('Max. relative differences:', compare_with_gtc(x, y, u_x, u_y))
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+xlsx_stream.py - Initial version (Python 3).
+
+Streaming (bounded-memory) reader for .xlsx worksheets.
+
+pylightxl.readxl() builds every cell of the requested sheets in memory
+before any row can be processed. This module instead walks the sheet XML
+with iterparse(), yielding one row at a time and discarding it afterwards,
+so peak memory depends on the row being processed (plus the workbook's
+shared-strings table), not on the size of the sheet.
+
+StreamWorkbook mimics the parts of the pylightxl database interface used by
+the ingest scripts (wb.ws(name).rows and wb.ws(name).size), and rows are
+returned in the same form as pylightxl's:
+    * one list per row, padded with '' to the sheet width,
+    * empty rows (within the data) included as rows of '',
+    * shared/inline strings as str, numbers as int (if integral) or float,
+      booleans as True/False.
+Note: cached formula results are returned (formulas aren't re-evaluated) and
+date-formatted numeric cells are returned as numbers.
+"""
+
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+STRICT_REL_NS = '{http://purl.oclc.org/ooxml/officeDocument/relationships}id'
+
+
+def _local(tag):
+    """Strip namespace from an XML tag: '{ns}row' -> 'row'."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def col_num(ref):
+    """
+    Column number (1-based) of a cell reference.
+    :param ref: Cell reference, e.g. 'AB12'
+    :return: int, e.g. 28
+    """
+    n = 0
+    for ch in ref:
+        if ch.isalpha():
+            n = n*26 + ord(ch.upper()) - 64
+        else:
+            break
+    return n
+
+
+def _num(text):
+    """Convert numeric cell text, as pylightxl does (int if possible, else float)."""
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+
+
+class StreamSheet:
+    """A single worksheet, read lazily from the .xlsx archive."""
+
+    def __init__(self, workbook, name, path):
+        self.workbook = workbook
+        self.name = name
+        self.path = path  # Location of sheet XML within archive.
+        self._size = None
+
+    @property
+    def size(self):
+        """[n_rows, n_cols] - from the sheet's <dimension> element (or a full pass if missing)."""
+        if self._size is None:
+            with zipfile.ZipFile(self.workbook.filename) as zf, zf.open(self.path) as f:
+                for event, elem in ET.iterparse(f, events=('start',)):
+                    tag = _local(elem.tag)
+                    if tag == 'dimension':
+                        last = elem.get('ref', 'A1').split(':')[-1]
+                        self._size = [int(re.sub('[A-Za-z]', '', last) or 0), col_num(last)]
+                        break
+                    if tag == 'sheetData':
+                        break
+            if self._size is None:  # No <dimension> - count rows instead.
+                n_rows = n_cols = 0
+                for row in self._iter_cells():
+                    n_rows = row[0]
+                    n_cols = max(n_cols, max(row[1]) if row[1] else 0)
+                self._size = [n_rows, n_cols]
+        return self._size
+
+    def _iter_cells(self):
+        """
+        Yield (row_number, {col_number: value}) for each <row> in the sheet XML.
+        Each row element is discarded as soon as it's been read.
+        """
+        strings = self.workbook.shared_strings
+        with zipfile.ZipFile(self.workbook.filename) as zf, zf.open(self.path) as f:
+            row_no = 0
+            sheet_data = None
+            for event, elem in ET.iterparse(f, events=('start', 'end')):
+                tag = _local(elem.tag)
+                if event == 'start':
+                    if tag == 'sheetData':
+                        sheet_data = elem
+                    continue
+                if tag != 'row':
+                    continue
+                row_no = int(elem.get('r', row_no + 1))
+                cells = {}
+                col = 0
+                for c in elem:
+                    if _local(c.tag) != 'c':
+                        continue
+                    ref = c.get('r')
+                    col = col_num(ref) if ref else col + 1
+                    c_type = c.get('t', 'n')
+                    val = ''
+                    if c_type == 'inlineStr':
+                        val = ''.join(t.text or '' for t in c.iter() if _local(t.tag) == 't')
+                    else:
+                        v = next((x for x in c if _local(x.tag) == 'v'), None)
+                        text = v.text if v is not None and v.text is not None else ''
+                        if c_type == 's':
+                            val = strings[int(text)] if text != '' else ''
+                        elif c_type == 'b':
+                            val = text == '1'
+                        elif c_type in ('str', 'e'):
+                            val = text
+                        elif text != '':
+                            val = _num(text)
+                    if val != '':
+                        cells[col] = val
+                yield row_no, cells
+                elem.clear()
+                if sheet_data is not None:
+                    sheet_data.remove(elem)  # Don't let finished rows accumulate.
+
+    @property
+    def rows(self):
+        """Generator of rows (lists of cell values), as pylightxl's ws.rows."""
+        return self._iter_rows()
+
+    def _iter_rows(self):
+        n_cols = self.size[1]
+        prev_row = 0
+        pending_blank = 0  # Blank rows are only emitted if more data follows.
+        for row_no, cells in self._iter_cells():
+            if not cells:
+                continue
+            pending_blank += row_no - prev_row - 1
+            prev_row = row_no
+            width = max(n_cols, max(cells))
+            for _ in range(pending_blank):
+                yield [''] * width
+            pending_blank = 0
+            row = [''] * width
+            for col, val in cells.items():
+                row[col - 1] = val
+            yield row
+
+
+class StreamWorkbook:
+    """
+    Lazily-read .xlsx workbook with a pylightxl-like interface:
+        wb = StreamWorkbook(filename)
+        for row in wb.ws('Data').rows: ...
+    """
+
+    def __init__(self, filename, ws=None):
+        """
+        :param filename: Full XL path/filename
+        :param ws: Optional sequence of sheet names to make available (default all)
+        """
+        self.filename = filename
+        self._strings = None
+        self.sheets = {}
+        with zipfile.ZipFile(filename) as zf:
+            rels = {}
+            with zf.open('xl/_rels/workbook.xml.rels') as f:
+                for rel in ET.parse(f).getroot():
+                    target = rel.get('Target')
+                    if target.startswith('/'):
+                        target = target.lstrip('/')
+                    else:
+                        target = posixpath.normpath(posixpath.join('xl', target))
+                    rels[rel.get('Id')] = target
+            with zf.open('xl/workbook.xml') as f:
+                for elem in ET.parse(f).getroot().iter():
+                    if _local(elem.tag) == 'sheet':
+                        name = elem.get('name')
+                        r_id = elem.get(REL_NS) or elem.get(STRICT_REL_NS)
+                        if ws is None or name in ws:
+                            self.sheets[name] = StreamSheet(self, name, rels[r_id])
+
+    @property
+    def shared_strings(self):
+        """Workbook shared-strings table (read once, on first use)."""
+        if self._strings is None:
+            self._strings = []
+            with zipfile.ZipFile(self.filename) as zf:
+                if 'xl/sharedStrings.xml' in zf.namelist():
+                    with zf.open('xl/sharedStrings.xml') as f:
+                        for event, elem in ET.iterparse(f):
+                            if _local(elem.tag) == 'si':
+                                # Concatenate text runs, ignoring phonetic (rPh) text.
+                                parts = []
+                                for child in elem:
+                                    tag = _local(child.tag)
+                                    if tag == 't':
+                                        parts.append(child.text or '')
+                                    elif tag == 'r':
+                                        parts.extend(t.text or '' for t in child if _local(t.tag) == 't')
+                                self._strings.append(''.join(parts))
+                                elem.clear()
+        return self._strings
+
+    def ws_names(self):
+        return list(self.sheets)
+
+    def ws(self, ws):
+        return self.sheets[ws]
+
+
+def readxl(filename, ws=None):
+    """Streaming counterpart of pylightxl.readxl()."""
+    return StreamWorkbook(filename, ws)